@@ -4,4 +4,17 @@ export const API_BASE = (VITE || CRA || "https://questify.duckdns.org").replace(
 
 export const API_PREFIX = "/api";
 
-export const API = (path) => `${API_BASE}${API_PREFIX}${path}`;
\ No newline at end of file
+export const API = (path) => `${API_BASE}${API_PREFIX}${path}`;
+
+// Session token handed out by /login and /signup; the per-user routes require it
+const SESSION_KEY = "questify_session_token";
+
+export const setSessionToken = (token) => {
+  if (token) localStorage.setItem(SESSION_KEY, token);
+  else localStorage.removeItem(SESSION_KEY);
+};
+
+export const authHeaders = (headers = {}) => {
+  const token = localStorage.getItem(SESSION_KEY);
+  return token ? { ...headers, Authorization: `Bearer ${token}` } : headers;
+};
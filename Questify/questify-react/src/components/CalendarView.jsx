@@ -1,5 +1,5 @@
 import React, { useCallback, useEffect, useMemo, useRef, useState } from "react";
-import { API } from "../apiBase";
+import { API, authHeaders } from "../apiBase";
 
 import FullCalendar from "@fullcalendar/react";
 import dayGridPlugin from "@fullcalendar/daygrid";
@@ -179,7 +179,7 @@ export default function CalendarView({ date = new Date() }) {
 
   const loadEvents = useCallback(async () => {
     try {
-      const res = await fetch(API("/calendar/events"), { credentials: "include" });
+      const res = await fetch(API("/calendar/events"), { credentials: "include", headers: authHeaders() });
       if (!res.ok) {
         setEventsFetched([]);
         return;
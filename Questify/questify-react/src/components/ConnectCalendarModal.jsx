@@ -1,5 +1,5 @@
 import React, { useEffect, useState } from "react";
-import { API } from "../apiBase";
+import { API, authHeaders } from "../apiBase";
 
 function openCenteredPopup(url, title) {
   const w = 500, h = 650;
@@ -25,7 +25,7 @@ export default function ConnectCalendarModal({ onConnected, onClose }) {
     if (busy) return;
     setBusy(true);
     try {
-      const res = await fetch(API(`/oauth/${provider}/start`), { credentials: "include" });
+      const res = await fetch(API(`/oauth/${provider}/start`), { credentials: "include", headers: authHeaders() });
       if (!res.ok) throw new Error("Failed to start OAuth");
       const data = await res.json();
       if (data?.auth_url) openCenteredPopup(data.auth_url, `connect-${provider}`);
@@ -6,7 +6,8 @@ import CalendarView from "./CalendarView";
 import PomodoroTimer from "./PomodoroTimer";
 import ConnectCalendarModal from "./ConnectCalendarModal";
 import QuestifyNavBar from "./QuestifyNavBar";
-import { API } from "../apiBase";
+import { API, authHeaders } from "../apiBase";
+import { fetchBootstrap } from "../utils/UserAPI";
 
 import {
   Chart as ChartJS,
@@ -61,7 +62,7 @@ const DEFAULT = {
 
 export default function Dashboard() {
   // Gets the user data from UserContext
-  const { user, isAuthenticated, loading, refreshUser } = useUser();
+  const { user, isAuthenticated, loading, refreshUser, updateUser } = useUser();
 
   // Base to grab assets from public folder
   const base = process.env.PUBLIC_URL || "";
@@ -75,6 +76,9 @@ export default function Dashboard() {
   // Sets the current user info state
   const [state, setState] = useState(DEFAULT);
 
+  // First-paint data from /bootstrap; the task list waits for it instead of fetching on its own
+  const [boot, setBoot] = useState(null);
+
   // Set user info as a JSON object usable by the dashboard
   const USER_INFO = {
     profile: {
@@ -113,19 +117,39 @@ export default function Dashboard() {
     setState(clone(USER_INFO))
   }, [user, isAuthenticated, loading]);
 
-  // Refresh user data on mount and when returning to dashboard
+  // Refresh user data on mount and when returning to dashboard, along with the tasks and
+  // calendar status, in one request
   useEffect(() => {
-    if (user?.id) {
-      refreshUser();
+    if (!user?.id) {
+      setBoot({});
+      return;
     }
+    fetchBootstrap(user.id).then((data) => {
+      if (data) {
+        updateUser(data.user);
+        setBoot(data);
+      } else {
+        refreshUser();
+        setBoot({});
+      }
+    });
   }, []);
 
+  // The bootstrap's tasks only seed the first task list; coming back to the tab fetches fresh ones
+  useEffect(() => {
+    if (taskTab !== "list") setBoot((prev) => (prev?.tasks ? { ...prev, tasks: undefined } : prev));
+  }, [taskTab]);
+
   // calendar connect prompt
   useEffect(() => {
     const check = async () => {
       if (taskTab !== "calendar") return;
+      if (boot?.calendar) {
+        if (!boot.calendar.connected) setShowCalModal(true);
+        return;
+      }
       try {
-        const r = await fetch(API(`/oauth/status?user_id=1`), { credentials: "include" });
+        const r = await fetch(API(`/oauth/status`), { credentials: "include", headers: authHeaders() });
         if (!r.ok) throw new Error();
         const data = await r.json();
         if (!data.connected) setShowCalModal(true);
@@ -134,13 +158,14 @@ export default function Dashboard() {
       }
     };
     check();
-  }, [taskTab]);
+  }, [taskTab, boot]);
 
   const onCalendarConnected = async () => {
     try {
-      await fetch(API(`/calendar/sync`), { method: "POST", credentials: "include" });
+      await fetch(API(`/calendar/sync`), { method: "POST", credentials: "include", headers: authHeaders() });
     } catch { }
     window.dispatchEvent(new CustomEvent("calendar:refresh"));
+    setBoot((prev) => ({ ...prev, calendar: { ...prev?.calendar, connected: true } }));
     setShowCalModal(false);
   };
 
@@ -335,7 +360,7 @@ export default function Dashboard() {
                 </button>
               </div>
 
-              {taskTab === "list" && <TaskBoard />}
+              {taskTab === "list" && boot && <TaskBoard initialTasks={boot.tasks} />}
 
               {taskTab === "calendar" && (
                 <>
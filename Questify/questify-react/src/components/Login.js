@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from "react";
 import { useNavigate } from "react-router-dom";
 import { useUser } from "../contexts/UserContext";
-import { API } from "../apiBase";
+import { API, setSessionToken } from "../apiBase";
 
 const REMEMBER_KEY = "questify_remembered_user_id";
 
@@ -56,6 +56,7 @@ export default function Login() {
       const result = await response.json();
       
       if (result.id) {
+        setSessionToken(result.token);
         await fetchUserById(result.id);
         
         // Remember user if remember me selected with localstorage
@@ -1,7 +1,7 @@
 import React, { useState } from "react";
 import { useNavigate } from "react-router-dom";
 import { useUser } from "../contexts/UserContext";
-import { API } from "../apiBase";
+import { API, setSessionToken } from "../apiBase";
 
 export default function Signup() {
   const [email, setEmail] = useState("");
@@ -89,6 +89,7 @@ export default function Signup() {
 
       const result = await writeUser(email, user, pass);
       if (result.id) {
+        setSessionToken(result.token);
         await fetchUserById(result.id);
         alert("Account created. Welcome to Questify!");
         setTimeout(() => navigate("/build-adventurer"), 1500);
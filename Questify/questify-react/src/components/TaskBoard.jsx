@@ -91,10 +91,12 @@ function econDelta(task, type) {
   return deltas;
 }
 
-export default function TaskBoard() {
+export default function TaskBoard({ initialTasks }) {
   const { user, refreshUser } = useUser();
 
-  const [tasks, setTasks] = useState([]);
+  const [tasks, setTasks] = useState(initialTasks || []);
+  // Tasks handed over by the dashboard's bootstrap stand in for the first fetch
+  const haveInitialTasks = React.useRef(!!initialTasks);
   const rolloverInProgress = React.useRef(false);
 
   const [showAdd, setShowAdd] = useState(false);
@@ -113,6 +115,10 @@ export default function TaskBoard() {
   // Get tasks from backend and apply them to tasks state
   useEffect(() => {
     async function fetchTasks() {
+      if (haveInitialTasks.current) {
+        haveInitialTasks.current = false;
+        return;
+      }
       if (user && user.id) {
         try {
           const data = await readTasks(user.id);
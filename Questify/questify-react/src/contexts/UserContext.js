@@ -1,5 +1,5 @@
 import React, { createContext, useContext, useState, useEffect } from "react";
-import { API } from "../apiBase";
+import { API, authHeaders, setSessionToken } from "../apiBase";
 
 const UserContext = createContext();
 
@@ -45,7 +45,7 @@ export function UserProvider({ children }) {
     if (!userId) return null;
 
     try {
-      const response = await fetch(API(`/users/${userId}`));
+      const response = await fetch(API(`/users/${userId}`), { headers: authHeaders() });
       if (response.ok) {
         const userData = await response.json();
         updateUser(userData);
@@ -65,7 +65,7 @@ export function UserProvider({ children }) {
     if (!user?.id) return;
 
     try {
-      const response = await fetch(API(`/users/${user.id}`));
+      const response = await fetch(API(`/users/${user.id}`), { headers: authHeaders() });
       if (response.ok) {
         const userData = await response.json();
         updateUser(userData);
@@ -75,8 +75,10 @@ export function UserProvider({ children }) {
     }
   };
 
-  // Sets the user to null when loggin out
+  // Sets the user to null when loggin out, and revokes the session token
   const logout = () => {
+    fetch(API("/logout"), { method: "POST", headers: authHeaders() }).catch(() => {});
+    setSessionToken(null);
     updateUser(null);
   };
 
@@ -1,4 +1,4 @@
-import { API } from '../apiBase';
+import { API, authHeaders } from '../apiBase';
 
 /*------------------------------------------------------------------------------------
 Example:
@@ -9,7 +9,7 @@ export async function updateEconomy(user_id, econData) {
   try {
     const response = await fetch(API(`/users/${user_id}/economy`), {
       method: 'PATCH',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify(econData)
     });
     return await response.json();
@@ -1,4 +1,4 @@
-import { API } from '../apiBase';
+import { API, authHeaders } from '../apiBase';
 
 /*---------------------------------------------------------------------------------
 Example:                              -> Creates a task with title, type, etc.
@@ -12,7 +12,7 @@ export async function createTask(user_id, taskData) {
   try {
     const response = await fetch(API(`/users/${user_id}/tasks`), {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify(taskData)
     });
     return await response.json();
@@ -25,7 +25,7 @@ export async function createTask(user_id, taskData) {
 // Get all of a users tasks from backend using user_id
 export async function readTasks(user_id) {
     try {
-      const response = await fetch(API(`/users/${user_id}/tasks`));
+      const response = await fetch(API(`/users/${user_id}/tasks`), { headers: authHeaders() });
       const data = await response.json();
       return data;
     } catch (error) {
@@ -39,7 +39,7 @@ export async function updateTask(user_id, task_id, taskData) {
   try {
     const response = await fetch(API(`/users/${user_id}/tasks/${task_id}`), {
       method: 'PUT',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify(taskData)
     });
     return await response.json();
@@ -53,7 +53,8 @@ export async function updateTask(user_id, task_id, taskData) {
 export async function deleteTask(user_id, task_id) {
   try {
     await fetch(API(`/users/${user_id}/tasks/${task_id}`), {
-      method: 'DELETE'
+      method: 'DELETE',
+      headers: authHeaders()
     });
     return true;
   } catch (error) {
@@ -1,15 +1,29 @@
-import { API } from '../apiBase';
+import { API, authHeaders } from '../apiBase';
 
 // Updates rollover in user table, then is received through UserContext
 export async function updateRollover(user_id) {
   try {
     const response = await fetch(API(`/users/${user_id}/rollover`), {
       method: 'PATCH',
-      headers: { 'Content-Type': 'application/json' }
+      headers: authHeaders({ 'Content-Type': 'application/json' })
     });
     return await response.json();
   } catch (error) {
     console.error('Error updating rollover:', error);
     return null;
   }
-}
\ No newline at end of file
+}
+
+// Everything the dashboard shows first (profile, tasks, calendar status, today's events)
+// in one request. The server sends an ETag, so the browser revalidates its cached copy
+// and an unchanged payload comes back as an empty 304.
+export async function fetchBootstrap(user_id) {
+  try {
+    const response = await fetch(API(`/users/${user_id}/bootstrap`), { headers: authHeaders() });
+    if (!response.ok) return null;
+    return await response.json();
+  } catch (error) {
+    console.error('Error loading dashboard:', error);
+    return null;
+  }
+}
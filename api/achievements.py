@@ -0,0 +1,266 @@
+import json
+import threading
+from bisect import bisect_right
+from datetime import date
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from db import get_db, get_user_db, local_now, copy_shared_tables
+from sessions import require_user
+from profiling import require_admin
+import stats
+import feed
+
+router = APIRouter(prefix="/api", tags=["achievements"])
+
+# Rules live in achievements.reward_json as data, e.g.
+#   {"rule": {"event": "task_complete", "metric": "tasks_completed", "min": 100},
+#    "reward": {"gold": 50, "diamonds": 2}}
+# Counter metrics are kept in user_counters and bumped by the event that moves them;
+# gauge metrics (level, streaks) are reported by the event with their new value.
+EVENT_METRICS = {
+    "task_complete": ("tasks_completed",),
+    "quest_complete": ("quests_completed",),
+    "level_up": ("level",),
+    "streak": ("daily_streak", "quest_streak"),
+    "purchase": ("purchases", "gold_spent"),
+    "focus_session": ("focus_sessions", "focus_minutes"),
+}
+
+class RuleIn(BaseModel):
+    event: str
+    metric: str
+    min: int = Field(ge=1)
+
+class RewardIn(BaseModel):
+    gold: int = Field(0, ge=0)
+    diamonds: int = Field(0, ge=0)
+
+class AchievementIn(BaseModel):
+    code: str
+    name: str
+    description: str
+    rule: RuleIn
+    reward: RewardIn = RewardIn()
+
+class Rule:
+    __slots__ = ("achievement_id", "code", "name", "threshold", "gold", "diamonds")
+
+    def __init__(self, achievement_id, code, name, threshold, gold, diamonds):
+        self.achievement_id = achievement_id
+        self.code = code
+        self.name = name
+        self.threshold = threshold
+        self.gold = gold
+        self.diamonds = diamonds
+
+class RuleIndex:
+    # (event, metric) -> rules sorted by threshold. An event only looks at its own rules,
+    # and a bisect finds the ones whose threshold it just crossed.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = None
+
+    def get(self, db):
+        rules = self._rules
+        if rules is None:
+            with self._lock:
+                rules = self._rules
+                if rules is None:
+                    rules = self._rules = self._load(db)
+        return rules
+
+    def _load(self, db):
+        index = {}
+        for achievement_id, code, name, reward_json in db.execute(
+            text("SELECT id, code, name, reward_json FROM achievements")
+        ):
+            data = json.loads(reward_json or "{}")
+            rule = data.get("rule")
+            if not rule or rule.get("metric") not in EVENT_METRICS.get(rule.get("event"), ()):
+                continue
+            reward = data.get("reward", {})
+            index.setdefault((rule["event"], rule["metric"]), []).append(
+                Rule(achievement_id, code, name, int(rule["min"]),
+                     int(reward.get("gold", 0)), int(reward.get("diamonds", 0)))
+            )
+        out = {}
+        for key, rules in index.items():
+            rules.sort(key=lambda r: r.threshold)
+            out[key] = ([r.threshold for r in rules], rules)
+        return out
+
+    def invalidate(self):
+        with self._lock:
+            self._rules = None
+
+rule_index = RuleIndex()
+
+def _unlock(db, user_id, rule):
+    # The primary key makes the unlock idempotent; the reward is paid only on first insert
+    inserted = db.execute(
+        text("INSERT INTO user_achievements (user_id, achievement_id, unlocked_at) "
+             "VALUES (:user_id, :achievement_id, :unlocked_at) "
+             "ON CONFLICT DO NOTHING RETURNING achievement_id"),
+        {"user_id": user_id, "achievement_id": rule.achievement_id, "unlocked_at": local_now()},
+    ).first()
+    if inserted is None:
+        return False
+    if rule.gold or rule.diamonds:
+        from economy import record_ledger
+        db.execute(
+            text("UPDATE users SET gold = gold + :gold, diamonds = diamonds + :diamonds WHERE id = :user_id"),
+            {"user_id": user_id, "gold": rule.gold, "diamonds": rule.diamonds},
+        )
+        record_ledger(db, user_id, rule.gold, rule.diamonds, "achievement", {"achievement": rule.code})
+        stats.record(db, user_id, date.today(), gold=rule.gold, diamonds=rule.diamonds)
+    params = {"user_id": user_id, "text": f"Achievement unlocked: {rule.name}", "created_at": local_now()}
+    result = db.execute(
+        text("INSERT INTO narrative_events (user_id, event_type, text, created_at) "
+             "VALUES (:user_id, 'milestone', :text, :created_at)"),
+        params,
+    )
+    feed.stage(db, user_id, feed.narrative_entry(result.lastrowid, "milestone", params["text"], params["created_at"]))
+    return True
+
+def _crossed(db, user_id, event, metric, prev, value):
+    entry = rule_index.get(db).get((event, metric))
+    if entry is None or value <= prev:
+        return []
+    thresholds, rules = entry
+    lo, hi = bisect_right(thresholds, prev), bisect_right(thresholds, value)
+    return [rule.code for rule in rules[lo:hi] if _unlock(db, user_id, rule)]
+
+# Event hooks for the write paths. Like the guild hooks they only stage statements, so
+# unlocks and rewards commit (or roll back) with the change that earned them.
+def count(db, user_id, event, **deltas):
+    # Bump counter metrics and unlock whatever the new totals reach
+    unlocked = []
+    for metric, delta in deltas.items():
+        if not delta:
+            continue
+        value = db.execute(
+            text("INSERT INTO user_counters (user_id, metric, value) VALUES (:user_id, :metric, :delta) "
+                 "ON CONFLICT(user_id, metric) DO UPDATE SET value = value + excluded.value "
+                 "RETURNING value"),
+            {"user_id": user_id, "metric": metric, "delta": delta},
+        ).scalar()
+        unlocked += _crossed(db, user_id, event, metric, value - delta, value)
+    return unlocked
+
+def reached(db, user_id, event, metric, prev, value):
+    # A gauge metric moved from prev to value
+    return _crossed(db, user_id, event, metric, prev, value)
+
+@router.get("/achievements")
+def list_achievements(db: Session = Depends(get_db)):
+    rows = db.execute(text("SELECT id, code, name, description, reward_json FROM achievements ORDER BY id"))
+    out = []
+    for achievement_id, code, name, description, reward_json in rows:
+        data = json.loads(reward_json or "{}")
+        out.append({"id": achievement_id, "code": code, "name": name, "description": description,
+                    "rule": data.get("rule"), "reward": data.get("reward", {})})
+    return out
+
+@router.get("/users/{user_id}/achievements", dependencies=[Depends(require_user)])
+def user_achievements(user_id: int, db: Session = Depends(get_user_db)):
+    rows = db.execute(
+        text("""
+            SELECT a.code, a.name, a.description, ua.unlocked_at
+            FROM user_achievements ua JOIN achievements a ON a.id = ua.achievement_id
+            WHERE ua.user_id = :user_id ORDER BY ua.unlocked_at
+        """),
+        {"user_id": user_id},
+    ).mappings().all()
+    return [dict(r) for r in rows]
+
+@router.put("/admin/achievements", dependencies=[Depends(require_admin)])
+def upsert_achievement(item: AchievementIn, db: Session = Depends(get_db)):
+    if item.rule.metric not in EVENT_METRICS.get(item.rule.event, ()):
+        raise HTTPException(status_code=400, detail=f"Metric '{item.rule.metric}' is not fed by event '{item.rule.event}'")
+    reward_json = json.dumps({"rule": item.rule.model_dump(), "reward": item.reward.model_dump()})
+    achievement_id = db.execute(
+        text("""
+            INSERT INTO achievements (code, name, description, reward_json)
+            VALUES (:code, :name, :description, :reward_json)
+            ON CONFLICT(code) DO UPDATE SET
+                name = excluded.name, description = excluded.description, reward_json = excluded.reward_json
+            RETURNING id
+        """),
+        {"code": item.code, "name": item.name, "description": item.description, "reward_json": reward_json},
+    ).scalar()
+    db.commit()
+    copy_shared_tables()
+    rule_index.invalidate()
+    return {"id": achievement_id, "code": item.code}
+
+# Current value of every metric for a range of users, straight from the history tables
+_METRIC_SQL = {
+    "tasks_completed": "SELECT user_id, SUM(CASE outcome WHEN 'complete' THEN 1 ELSE -1 END) "
+                       "FROM task_logs WHERE user_id BETWEEN :lo AND :hi GROUP BY user_id",
+    "quests_completed": "SELECT user_id, COUNT(*) FROM quest_logs "
+                        "WHERE outcome = 'complete' AND user_id BETWEEN :lo AND :hi GROUP BY user_id",
+    "purchases": "SELECT user_id, COUNT(*) FROM economy_ledger "
+                 "WHERE reason = 'purchase' AND user_id BETWEEN :lo AND :hi GROUP BY user_id",
+    "gold_spent": "SELECT user_id, -SUM(delta_gold) FROM economy_ledger "
+                  "WHERE reason = 'purchase' AND user_id BETWEEN :lo AND :hi GROUP BY user_id",
+    "focus_sessions": "SELECT user_id, COUNT(*) FROM focus_sessions "
+                      "WHERE outcome = 'success' AND user_id BETWEEN :lo AND :hi GROUP BY user_id",
+    "focus_minutes": "SELECT user_id, SUM(actual_min) FROM focus_sessions "
+                     "WHERE outcome = 'success' AND user_id BETWEEN :lo AND :hi GROUP BY user_id",
+    "level": "SELECT id, level FROM users WHERE id BETWEEN :lo AND :hi",
+    "daily_streak": "SELECT user_id, current_run FROM daily_checkins WHERE user_id BETWEEN :lo AND :hi",
+    "quest_streak": "SELECT user_id, MAX(count) FROM streaks WHERE user_id BETWEEN :lo AND :hi GROUP BY user_id",
+}
+# Gauges are read from their own tables; only counters are stored in user_counters
+GAUGES = ("level", "daily_streak", "quest_streak")
+
+def backfill(conn, batch_size=500):
+    # Recompute counters from history and unlock everything already earned, one batch
+    # of users per transaction so a large table never holds the write lock for long.
+    # Streak rules see the current streaks (the best-ever run is not kept anywhere).
+    rules = rule_index.get(conn)
+    unlocked = 0
+    last_id = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            text("SELECT id FROM users WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": batch_size},
+        )]
+        if not ids:
+            return unlocked
+        lo, hi = ids[0], ids[-1]
+        values = {}
+        for metric, sql in _METRIC_SQL.items():
+            for user_id, value in conn.execute(text(sql), {"lo": lo, "hi": hi}):
+                values.setdefault(user_id, {})[metric] = value or 0
+
+        conn.execute(text("DELETE FROM user_counters WHERE user_id BETWEEN :lo AND :hi"), {"lo": lo, "hi": hi})
+        counters = [{"user_id": user_id, "metric": metric, "value": value}
+                    for user_id, metrics in values.items()
+                    for metric, value in metrics.items() if metric not in GAUGES and value]
+        if counters:
+            conn.execute(text("INSERT INTO user_counters (user_id, metric, value) VALUES (:user_id, :metric, :value)"),
+                         counters)
+
+        for user_id, metrics in values.items():
+            for (event, metric), (thresholds, event_rules) in rules.items():
+                reached_count = bisect_right(thresholds, metrics.get(metric, 0))
+                unlocked += sum(_unlock(conn, user_id, rule) for rule in event_rules[:reached_count])
+        conn.commit()
+        last_id = hi
+
+if __name__ == "__main__":
+    import sys
+    from db import user_engines
+
+    args = sys.argv[1:]
+    if not args or args[0] != "backfill" or len(args) > 2:
+        print("usage: python achievements.py backfill [batch_size]")
+        sys.exit(1)
+    total = 0
+    for engine in user_engines():
+        with engine.connect() as conn:
+            total += backfill(conn, int(args[1]) if len(args) == 2 else 500)
+    print(f"Backfilled achievements: {total} unlocked")
@@ -0,0 +1,261 @@
+import os
+import re
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import orjson
+from fastapi import HTTPException
+from metrics import observe_admission, gauge
+from sessions import verify, bearer_token
+
+# Set ADMISSION_ENABLED=0 to let every request straight through
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+# Write requests allowed into the app at once; SQLite has a single writer, so more than
+# a handful only turns into threads sleeping in busy_timeout
+WRITE_CONCURRENCY = int(os.getenv("ADMISSION_WRITE_CONCURRENCY", "4"))
+# Writes allowed to wait for a slot; past this they are turned away immediately
+WRITE_QUEUE = int(os.getenv("ADMISSION_WRITE_QUEUE", "64"))
+# Longest a queued write waits before it is turned away
+WRITE_WAIT_SECONDS = float(os.getenv("ADMISSION_WRITE_WAIT_SECONDS", "2"))
+# Idle buckets are dropped this often (a full bucket is the same as no bucket)
+SWEEP_SECONDS = 60
+
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+# Never limited: probes, scraping and the admin tools used to investigate an overload
+EXEMPT_PATHS = ("/api/health", "/api/metrics", "/api/admin/")
+
+# First match wins: (route class, methods, path pattern). Requests are matched on the raw
+# path because admission runs before routing.
+ROUTE_CLASSES = (
+    ("economy", frozenset(("PATCH",)), re.compile(r"^/api/users/\d+/(?:economy|rollover)$")),
+    ("sync", frozenset(("POST",)), re.compile(r"^/api/users/\d+/sync$")),
+    ("transfer", frozenset(("GET", "POST")), re.compile(r"^/api/users/\d+/(?:export|import)$")),
+    ("auth", frozenset(("POST",)), re.compile(r"^/api/(?:login|signup)$")),
+    ("heartbeat", frozenset(("POST",)), re.compile(r"^/api/users/\d+/focus/sessions/[^/]+/heartbeats$")),
+    ("write", WRITE_METHODS, re.compile(r"^/api/")),
+    ("read", frozenset(("GET", "HEAD")), re.compile(r"^/api/")),
+)
+
+# Write classes that skip the write gate here: heartbeats only update the in-memory
+# session, and an import reads its whole upload first and then takes a slot itself
+# (write_slot()), so a slow client doesn't hold one while it sends
+UNGATED_CLASSES = frozenset(("heartbeat", "transfer"))
+
+# route class -> (tokens refilled per second, bucket size)
+DEFAULT_LIMITS = {
+    "economy": (2.0, 10),
+    "sync": (1.0, 5),
+    "transfer": (1 / 60, 2),
+    "auth": (0.2, 5),
+    "heartbeat": (1.0, 5),
+    "write": (5.0, 30),
+    "read": (20.0, 60),
+}
+
+def parse_limits(spec):
+    # "economy=1/5,read=50/100": rate per second / burst, one entry per route class;
+    # a rate of 0 turns the class's bucket off
+    limits = dict(DEFAULT_LIMITS)
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = entry.partition("=")
+        rate, _, burst = value.partition("/")
+        if name not in limits:
+            raise ValueError(f"Unknown route class {name!r} in ADMISSION_LIMITS")
+        limits[name] = (float(rate), int(burst or limits[name][1]))
+    return limits
+
+LIMITS = parse_limits(os.getenv("ADMISSION_LIMITS", ""))
+
+class Buckets:
+    # Token buckets for one route class, keyed by user (or client address). A bucket is
+    # stored as the single float time at which it would be full again: the tokens left are
+    # (burst - (full_at - now) * rate), refilled lazily on the next request, and a bucket
+    # whose full_at has passed is full and can be forgotten.
+    __slots__ = ("rate", "burst", "_full_at", "_span", "_cost")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._full_at = {}
+        self._cost = 1 / rate
+        self._span = burst / rate
+
+    def take(self, key, now):
+        # 0 if a token was taken, otherwise seconds until one is available
+        full_at = max(self._full_at.get(key, now), now) + self._cost
+        wait = full_at - now - self._span
+        if wait > 0:
+            return wait
+        self._full_at[key] = full_at
+        return 0
+
+    def sweep(self, now):
+        idle = [key for key, full_at in self._full_at.items() if full_at <= now]
+        for key in idle:
+            del self._full_at[key]
+
+    def __len__(self):
+        return len(self._full_at)
+
+class WriteGate:
+    # Concurrency limit for write routes with a bounded FIFO of waiters. A finished write
+    # hands its slot straight to the oldest waiter.
+    def __init__(self, limit, queue):
+        self.limit = limit
+        self.queue = queue
+        self.active = 0
+        self._waiters = deque()
+        # Moving average of a write's duration, to tell rejected clients when to come back
+        self.avg_seconds = 0.05
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        return self.avg_seconds * (self.active + len(self._waiters)) / self.limit
+
+    async def acquire(self, timeout):
+        # "ok", "shed" (queue full) or "timeout"
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return "ok"
+        if len(self._waiters) >= self.queue:
+            return "shed"
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return "ok"
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived as we gave up; pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                return "timeout"
+            raise
+
+    def release(self, seconds=None):
+        if seconds is not None:
+            self.avg_seconds += (seconds - self.avg_seconds) * 0.1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+buckets = {name: Buckets(rate, burst) for name, (rate, burst) in LIMITS.items() if rate > 0}
+write_gate = WriteGate(WRITE_CONCURRENCY, WRITE_QUEUE)
+_last_sweep = [time.monotonic()]
+
+gauge("questify_admission_writes_active", "Write requests currently inside the app",
+      lambda: write_gate.active)
+gauge("questify_admission_writes_queued", "Write requests waiting for a slot",
+      lambda: write_gate.queued)
+gauge("questify_admission_buckets", "Token buckets held in memory",
+      lambda: sum(len(b) for b in buckets.values()))
+
+def route_class(method, path):
+    for name, methods, pattern in ROUTE_CLASSES:
+        if method in methods and pattern.match(path):
+            return name
+    return None
+
+def client_key(scope):
+    # The logged-in user, else the client address (login, signup, anonymous requests).
+    # Never the user id in the path: anyone could spend someone else's buckets with it.
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            user_id = verify(bearer_token(value.decode("latin-1")))
+            if user_id is not None:
+                return user_id
+            break
+    client = scope.get("client")
+    return client[0] if client else ""
+
+@asynccontextmanager
+async def write_slot(name):
+    # The write gate for a route of an ungated class, taken from inside the route
+    if not ADMISSION_ENABLED:
+        yield
+        return
+    outcome = await write_gate.acquire(WRITE_WAIT_SECONDS)
+    if outcome != "ok":
+        observe_admission(name, outcome)
+        raise HTTPException(status_code=429, detail="Server busy, try again shortly",
+                            headers={"Retry-After": str(max(1, math.ceil(write_gate.retry_after())))})
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        write_gate.release(time.monotonic() - start)
+
+async def _reject(send, retry_after, detail):
+    body = orjson.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class AdmissionMiddleware:
+    # Pure ASGI and ahead of routing, so a rejected request costs a dict lookup and never
+    # reaches body parsing, the threadpool or the database
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"].startswith(EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        name = route_class(method, scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        now = time.monotonic()
+        if now - _last_sweep[0] > SWEEP_SECONDS:
+            _last_sweep[0] = now
+            for bucket in buckets.values():
+                bucket.sweep(now)
+
+        bucket = buckets.get(name)
+        if bucket is not None:
+            wait = bucket.take(client_key(scope), now)
+            if wait:
+                observe_admission(name, "limited")
+                await _reject(send, wait, "Too many requests")
+                return
+
+        if method not in WRITE_METHODS or name in UNGATED_CLASSES:
+            observe_admission(name, "allowed")
+            await self.app(scope, receive, send)
+            return
+
+        outcome = await write_gate.acquire(WRITE_WAIT_SECONDS)
+        if outcome != "ok":
+            observe_admission(name, outcome)
+            await _reject(send, write_gate.retry_after(), "Server busy, try again shortly")
+            return
+        observe_admission(name, "allowed")
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            write_gate.release(time.monotonic() - start)
@@ -6,6 +6,7 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from sqlalchemy.orm import Session
 from .db import get_db
 from .calendar_oauth_store import CalendarAccount
+from sessions import session_user
 from .ics_calendar import db_conn
 
 router = APIRouter(prefix="/oauth", tags=["calendar-oauth"])
@@ -29,15 +30,15 @@ def _state():
     return secrets.token_urlsafe(24)
 
 @router.get("/status")
-def oauth_status(user_id: int, db: Session = Depends(get_db)):
+def oauth_status(user_id: int = Depends(session_user), db: Session = Depends(get_db)):
     acct = db.query(CalendarAccount).filter_by(user_id=user_id).first()
     return {"connected": bool(acct), "provider": acct.provider if acct else None}
 
 @router.get("/google/start")
-def google_start():
+def google_start(user_id: int = Depends(session_user)):
     state = _state()
     ver, chal = _pkce()
-    _TMP[state] = {"verifier": ver, "t": time.time()}
+    _TMP[state] = {"verifier": ver, "t": time.time(), "user_id": user_id}
     url = (
       "https://accounts.google.com/o/oauth2/v2/auth?"
       "response_type=code"
@@ -59,7 +60,8 @@ def google_start():
 async def google_cb(code: str, state: str, db: Session = Depends(get_db)):
     if state not in _TMP:  # invalid/expired state
         return HTMLResponse("<script>window.opener.postMessage({type:'oauth-error'},'*');window.close();</script>")
-    ver = _TMP.pop(state)["verifier"]
+    pending = _TMP.pop(state)
+    ver, user_id = pending["verifier"], pending["user_id"]
     async with httpx.AsyncClient(timeout=20) as x:
         token = await x.post("https://oauth2.googleapis.com/token", data={
             "code": code,
@@ -76,10 +78,9 @@ async def google_cb(code: str, state: str, db: Session = Depends(get_db)):
     refresh = tok.get("refresh_token")
     expires = datetime.utcnow() + timedelta(seconds=tok.get("expires_in", 3600))
 
-    # TODO: Replace user_id=1 with your authenticated user ID
-    acct = db.query(CalendarAccount).filter_by(user_id=1).first()
+    acct = db.query(CalendarAccount).filter_by(user_id=user_id).first()
     if not acct:
-        acct = CalendarAccount(user_id=1, provider="google")
+        acct = CalendarAccount(user_id=user_id, provider="google")
     acct.access_token = access
     acct.refresh_token = refresh
     acct.expires_at = expires
@@ -89,10 +90,10 @@ async def google_cb(code: str, state: str, db: Session = Depends(get_db)):
     return HTMLResponse("<script>window.opener.postMessage({type:'oauth-success',provider:'google'},'*');window.close();</script>")
 
 @router.get("/ms/start")
-def ms_start():
+def ms_start(user_id: int = Depends(session_user)):
     state = _state()
     ver, chal = _pkce()
-    _TMP[state] = {"verifier": ver, "t": time.time()}
+    _TMP[state] = {"verifier": ver, "t": time.time(), "user_id": user_id}
     auth = (
       "https://login.microsoftonline.com/common/oauth2/v2.0/authorize?"
       "response_type=code"
@@ -112,7 +113,8 @@ def ms_start():
 async def ms_cb(code: str, state: str, db: Session = Depends(get_db)):
     if state not in _TMP:
         return HTMLResponse("<script>window.opener.postMessage({type:'oauth-error'},'*');window.close();</script>")
-    ver = _TMP.pop(state)["verifier"]
+    pending = _TMP.pop(state)
+    ver, user_id = pending["verifier"], pending["user_id"]
     async with httpx.AsyncClient(timeout=20) as x:
         token = await x.post("https://login.microsoftonline.com/common/oauth2/v2.0/token", data={
             "client_id": MS_CLIENT_ID,
@@ -129,9 +131,9 @@ async def ms_cb(code: str, state: str, db: Session = Depends(get_db)):
     refresh = tok.get("refresh_token")
     expires = datetime.utcnow() + timedelta(seconds=tok.get("expires_in", 3600))
 
-    acct = db.query(CalendarAccount).filter_by(user_id=1).first()
+    acct = db.query(CalendarAccount).filter_by(user_id=user_id).first()
     if not acct:
-        acct = CalendarAccount(user_id=1, provider="microsoft")
+        acct = CalendarAccount(user_id=user_id, provider="microsoft")
     acct.access_token = access
     acct.refresh_token = refresh
     acct.expires_at = expires
@@ -9,20 +9,33 @@ from sqlalchemy.orm import Session
 from .db import get_db
 from .calendar_oauth_store import CalendarAccount
 from .ics_calendar import db_conn
+from metrics import outbound_hooks
+from db import shard_router
+from sessions import session_user
+import recurrence
 
 router = APIRouter(tags=["calendar-sync"])
 
 @router.get("/calendar/events")
-def get_events():
+def get_events(user_id: int = Depends(session_user)):
     with db_conn() as c:
         rows = c.execute(
             "SELECT id, title, start, end, description FROM local_calendar_events ORDER BY start ASC"
         ).fetchall()
         events = [dict(r) for r in rows]
-    return {"imported": events, "local": []}
+    # Recurring quests for the next 30 days, as all-day events; quests are on the user's
+    # shard, not in this service's database
+    today = datetime.now().date()
+    with shard_router.engine(user_id).connect() as conn:
+        local = [
+            {"id": f"quest-{quest.id}-{day}", "title": quest.title, "start": day, "end": day, "description": None}
+            for quest, days in recurrence.expand(conn, user_id, today, today + timedelta(days=30))
+            for day in days
+        ]
+    return {"imported": events, "local": local}
 
 @router.post("/calendar/sync")
-async def sync_calendar(user_id: int = 1, db: Session = Depends(get_db)):
+async def sync_calendar(user_id: int = Depends(session_user), db: Session = Depends(get_db)):
     acct = db.query(CalendarAccount).filter_by(user_id=user_id).first()
     if not acct:
         raise HTTPException(status_code=400, detail="No connected calendar")
@@ -31,7 +44,7 @@ async def sync_calendar(user_id: int = 1, db: Session = Depends(get_db)):
 
     # refresh token 
     if acct.expires_at and acct.expires_at <= now and acct.refresh_token and acct.provider == "google":
-        async with httpx.AsyncClient(timeout=20) as x:
+        async with httpx.AsyncClient(timeout=20, event_hooks=outbound_hooks()) as x:
             r = await x.post("https://oauth2.googleapis.com/token", data={
                 "client_id": os.getenv("GOOGLE_CLIENT_ID"),
                 "client_secret": os.getenv("GOOGLE_CLIENT_SECRET"),
@@ -46,7 +59,7 @@ async def sync_calendar(user_id: int = 1, db: Session = Depends(get_db)):
             db.commit()
 
     events = []
-    async with httpx.AsyncClient(timeout=20) as x:
+    async with httpx.AsyncClient(timeout=20, event_hooks=outbound_hooks()) as x:
         if acct.provider == "google":
             time_min = (now - timedelta(days=30)).isoformat("T") + "Z"
             time_max = (now + timedelta(days=90)).isoformat("T") + "Z"
@@ -1,13 +1,14 @@
 # import sqlite3
 # from contextlib import contextmanager
-from pathlib import Path
 import sqlalchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from db import get_db_path
 
 # DB_PATH = Path(__file__).resolve().parent.parent / "db" / "questify.db"
 # DB_PATH = "sqlite:///../db/questify.db"
-DB_PATH = f"sqlite:///{Path(__file__).resolve().parent.parent}/db/questify.db"
+# Calendar accounts live in the main app's questify.db, which bootstrap reads them from
+DB_PATH = get_db_path()
 engine = create_engine(DB_PATH)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = sqlalchemy.orm.declarative_base()
@@ -1,7 +1,8 @@
+import os
 import sqlite3
 from contextlib import contextmanager
 
-DB_PATH = "./calendar_local.db"
+DB_PATH = os.getenv("CALENDAR_DB", "./calendar_local.db")
 
 @contextmanager
 def db_conn():
@@ -24,6 +25,7 @@ def init_schema():
                 created_at TEXT
             )
         """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_local_calendar_events_start ON local_calendar_events(start)")
         c.commit()
 
 init_schema()
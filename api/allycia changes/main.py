@@ -1,11 +1,20 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .oauth import router as oauth_router
-from .calendar_api import router as calendar_router
+from .calendar_sync import router as calendar_router
 from .db import Base, engine 
+from metrics import router as metrics_router, MetricsMiddleware, METRICS_ENABLED
+from db import shard_router
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Users moved off their hashed shard; quests are read from wherever the user lives
+    shard_router.load()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -21,7 +30,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if METRICS_ENABLED:
+    # Calendar sync times its Google/Microsoft calls; this app has to serve them itself
+    app.add_middleware(MetricsMiddleware)
+
 Base.metadata.create_all(bind=engine)
 
 app.include_router(oauth_router, prefix="/api")
 app.include_router(calendar_router, prefix="/api")
+if METRICS_ENABLED:
+    app.include_router(metrics_router)
@@ -8,6 +8,7 @@ from sqlalchemy.orm import Session
 
 from .db import get_db
 from .calendar_oauth_store import CalendarAccount
+from sessions import session_user
 
 router = APIRouter(tags=["calendar-oauth"])
 
@@ -31,15 +32,15 @@ def _state():
     return secrets.token_urlsafe(24)
 
 @router.get("/oauth/status")
-def oauth_status(user_id: int, db: Session = Depends(get_db)):
+def oauth_status(user_id: int = Depends(session_user), db: Session = Depends(get_db)):
     acct = db.query(CalendarAccount).filter_by(user_id=user_id).first()
     return {"connected": bool(acct), "provider": acct.provider if acct else None}
 
 @router.get("/oauth/google/start")
-def google_start():
+def google_start(user_id: int = Depends(session_user)):
     state = _state()
     ver, chal = _pkce()
-    _TMP[state] = {"verifier": ver, "t": time.time()}
+    _TMP[state] = {"verifier": ver, "t": time.time(), "user_id": user_id}
     scope = "openid email profile https://www.googleapis.com/auth/calendar.readonly"
     url = (
         "https://accounts.google.com/o/oauth2/v2/auth"
@@ -56,7 +57,8 @@ async def google_cb(code: str, state: str, db: Session = Depends(get_db)):
     if state not in _TMP:
         return HTMLResponse("<script>window.opener.postMessage({type:'oauth-error'},'*');window.close();</script>")
 
-    ver = _TMP.pop(state)["verifier"]
+    pending = _TMP.pop(state)
+    ver, user_id = pending["verifier"], pending["user_id"]
     async with httpx.AsyncClient(timeout=20) as x:
         token = await x.post("https://oauth2.googleapis.com/token", data={
             "code": code,
@@ -75,10 +77,9 @@ async def google_cb(code: str, state: str, db: Session = Depends(get_db)):
     refresh = tok.get("refresh_token")
     expires = datetime.utcnow() + timedelta(seconds=tok.get("expires_in", 3600))
 
-    # TODO: replace hardcoded user_id=1 with auth'd user
-    acct = db.query(CalendarAccount).filter_by(user_id=1).first()
+    acct = db.query(CalendarAccount).filter_by(user_id=user_id).first()
     if not acct:
-        acct = CalendarAccount(user_id=1, provider="google")
+        acct = CalendarAccount(user_id=user_id, provider="google")
     acct.access_token = access
     acct.refresh_token = refresh
     acct.expires_at = expires
@@ -88,10 +89,10 @@ async def google_cb(code: str, state: str, db: Session = Depends(get_db)):
     return HTMLResponse("<script>window.opener.postMessage({type:'oauth-success',provider:'google'},'*');window.close();</script>")
 
 @router.get("/oauth/ms/start")
-def ms_start():
+def ms_start(user_id: int = Depends(session_user)):
     state = _state()
     ver, chal = _pkce()
-    _TMP[state] = {"verifier": ver, "t": time.time()}
+    _TMP[state] = {"verifier": ver, "t": time.time(), "user_id": user_id}
     scope = "offline_access openid profile email Calendars.Read"
     url = (
         "https://login.microsoftonline.com/common/oauth2/v2.0/authorize"
@@ -107,7 +108,8 @@ async def ms_cb(code: str, state: str, db: Session = Depends(get_db)):
     if state not in _TMP:
         return HTMLResponse("<script>window.opener.postMessage({type:'oauth-error'},'*');window.close();</script>")
 
-    ver = _TMP.pop(state)["verifier"]
+    pending = _TMP.pop(state)
+    ver, user_id = pending["verifier"], pending["user_id"]
     async with httpx.AsyncClient(timeout=20) as x:
         token = await x.post("https://login.microsoftonline.com/common/oauth2/v2.0/token", data={
             "client_id": MS_CLIENT_ID,
@@ -126,9 +128,9 @@ async def ms_cb(code: str, state: str, db: Session = Depends(get_db)):
     refresh = tok.get("refresh_token")
     expires = datetime.utcnow() + timedelta(seconds=tok.get("expires_in", 3600))
 
-    acct = db.query(CalendarAccount).filter_by(user_id=1).first()
+    acct = db.query(CalendarAccount).filter_by(user_id=user_id).first()
     if not acct:
-        acct = CalendarAccount(user_id=1, provider="microsoft")
+        acct = CalendarAccount(user_id=user_id, provider="microsoft")
     acct.access_token = access
     acct.refresh_token = refresh
     acct.expires_at = expires
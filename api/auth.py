@@ -1,14 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header
 from pydantic import BaseModel, EmailStr
 from typing import Optional
-from db import get_db, Base
+from db import get_db, get_user_db, Base, SHARDED, shard_router
 import bcrypt
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, BLOB
+from sqlalchemy import Column, Integer, String, BLOB, select, text
 from sqlalchemy.orm import Session
 import logging
+from serialize import RowMapper, json_response
+import sessions
 
 from tasks import TaskItem
+from leaderboard import leaderboard
 
 router = APIRouter(prefix="/api", tags=["auth"])
 
@@ -56,6 +59,11 @@ class SignupIn(BaseModel):
 class UserOut(BaseModel):
     id: int
 
+# Login and signup also hand out the session token the per-user routes ask for
+class SessionOut(UserOut):
+    token: str
+    expires_at: int
+
 class UserFullOut(BaseModel):
     id: int
     email: str
@@ -81,14 +89,19 @@ class UserFullOut(BaseModel):
     class Config:
         from_attributes = True
 
+USER_ROWS = RowMapper(UserFullOut, UserItem)
+
 class LoginIn(BaseModel):
     display_name: str
     password: str
 
 # This gets all the account names when signing up to compare
 @router.get("/users", response_model=list[ReadUsers])
-async def read_items(db: Session = Depends(get_db)):
-    db_items = db.query(UserItem.display_name).all()
+def read_items(db: Session = Depends(get_db)):
+    if SHARDED:
+        db_items = db.execute(text("SELECT display_name FROM user_shards")).all()
+    else:
+        db_items = db.query(UserItem.display_name).all()
     
     if not db_items:
         raise HTTPException(status_code=404, detail="No users found")
@@ -96,17 +109,47 @@ async def read_items(db: Session = Depends(get_db)):
     return db_items
 
 # Signup with email, display_name, and password
-@router.post("/signup", response_model=UserOut)
-async def create_item(item: SignupIn, db: Session = Depends(get_db)):
+@router.post("/signup", response_model=SessionOut)
+def create_item(item: SignupIn, db: Session = Depends(get_db)):
     pass_hash = bcrypt.hashpw(item.password.encode(), bcrypt.gensalt())
 
+    user_id = None
+    if SHARDED:
+        # The directory hands out the id (and keeps emails and display names unique across
+        # shards); the user's rows then go to the shard the id hashes to. The name check
+        # and the insert are one statement, so two signups can't both take a name.
+        try:
+            user_id = db.execute(
+                text("INSERT INTO user_shards (shard, email, display_name) "
+                     "SELECT -1, :email, :name WHERE NOT EXISTS "
+                     "(SELECT 1 FROM user_shards WHERE display_name = :name) "
+                     "RETURNING user_id"),
+                {"email": item.email, "name": item.display_name},
+            ).scalar()
+            if user_id is not None:
+                db.execute(text("UPDATE user_shards SET shard = :shard WHERE user_id = :user_id"),
+                           {"shard": shard_router.placement(user_id), "user_id": user_id})
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
+        if user_id is None:
+            raise HTTPException(status_code=409, detail="Display name already taken")
+        directory, db = db, shard_router.session(user_id)
+
     try:
         db_item = UserItem(
+            id=user_id,
             email=item.email,
             display_name=item.display_name
         )
         db.add(db_item)
         db.flush()
+        # The flush holds the write lock until commit, so a signup racing this one for the
+        # same name finds this row once it gets the lock
+        if not SHARDED and db.query(UserItem.id).filter(UserItem.display_name == item.display_name,
+                                                         UserItem.id != db_item.id).first():
+            raise HTTPException(status_code=409, detail="Display name already taken")
 
         pass_item = PassItem(user_id=db_item.id, pass_hash=pass_hash)
         db.add(pass_item)
@@ -122,33 +165,62 @@ async def create_item(item: SignupIn, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(db_item)
         
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
+        if SHARDED:
+            directory.execute(text("DELETE FROM user_shards WHERE user_id = :user_id"), {"user_id": user_id})
+            directory.commit()
         raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
-
-    return UserOut(id=db_item.id)
-
-# Login with display_name and password
-@router.post("/login", response_model=UserOut)
-async def login(item: LoginIn, db: Session = Depends(get_db)):
-    user = db.query(UserItem).filter(UserItem.display_name == item.display_name).first()
-    
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-
-    db_item = db.query(PassItem).filter(PassItem.user_id == user.id).first()
-    if not db_item or not bcrypt.checkpw(item.password.encode(), db_item.pass_hash):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-
-    return UserOut(id=user.id)
+    finally:
+        if SHARDED:
+            db.close()
+
+    leaderboard.update_user(db_item)
+    token, expires_at = sessions.issue(db_item.id)
+    return SessionOut(id=db_item.id, token=token, expires_at=expires_at)
+
+def _password_ok(db, user_id, password):
+    row = db.query(PassItem).filter(PassItem.user_id == user_id).first()
+    return row is not None and bcrypt.checkpw(password.encode(), row.pass_hash)
+
+# Login with display_name and password. Signup keeps display names unique; accounts
+# made before that may share one, so every holder of the name is tried in id order.
+@router.post("/login", response_model=SessionOut)
+def login(item: LoginIn, db: Session = Depends(get_db)):
+    if SHARDED:
+        user_ids = db.execute(text("SELECT user_id FROM user_shards WHERE display_name = :name ORDER BY user_id"),
+                              {"name": item.display_name}).scalars().all()
+        db.close()
+    else:
+        user_ids = db.execute(select(UserItem.id).where(UserItem.display_name == item.display_name)
+                              .order_by(UserItem.id)).scalars().all()
+
+    for user_id in user_ids:
+        if SHARDED:
+            with shard_router.session(user_id) as shard_db:
+                ok = _password_ok(shard_db, user_id, item.password)
+        else:
+            ok = _password_ok(db, user_id, item.password)
+        if ok:
+            token, expires_at = sessions.issue(user_id)
+            return SessionOut(id=user_id, token=token, expires_at=expires_at)
+    raise HTTPException(status_code=401, detail="Invalid credentials")
+
+# Revoke the session token sent with the request; it stops working right away
+@router.post("/logout", status_code=204)
+async def logout(authorization: Optional[str] = Header(None)):
+    sessions.revoke(sessions.bearer_token(authorization))
 
 # Get user info using the user ID
-@router.get("/users/{user_id}", response_model=UserFullOut)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(UserItem).filter(UserItem.id == user_id).first()
+@router.get("/users/{user_id}", response_model=UserFullOut, dependencies=[Depends(sessions.require_user)])
+def get_user(user_id: int, db: Session = Depends(get_user_db)):
+    row = db.execute(select(*USER_ROWS.columns).where(UserItem.id == user_id)).first()
     
-    if not user:
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return user
+    return json_response(USER_ROWS.one(row))
 
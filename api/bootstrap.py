@@ -0,0 +1,95 @@
+import os
+import asyncio
+import hashlib
+import sqlite3
+from datetime import date, timedelta
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select, text
+from db import engine, shard_router
+from sessions import require_user
+from serialize import json_response
+from auth import UserItem, USER_ROWS
+from tasks import TaskItem, TASK_ROWS
+import recurrence
+
+router = APIRouter(prefix="/api", tags=["bootstrap"], dependencies=[Depends(require_user)])
+
+# Imported calendar events live in the calendar service's own file
+CALENDAR_DB = os.getenv("CALENDAR_DB", "./calendar_local.db")
+
+# Each part runs on its own connection in the threadpool, so the two databases (and the
+# user's shard and the directory) are read at the same time
+
+def _profile(user_id):
+    with shard_router.engine(user_id).connect() as conn:
+        row = conn.execute(select(*USER_ROWS.columns).where(UserItem.id == user_id)).first()
+    return USER_ROWS.one(row) if row else None
+
+def _tasks(user_id):
+    with shard_router.engine(user_id).connect() as conn:
+        rows = conn.execute(select(*TASK_ROWS.columns).where(TaskItem.user_id == user_id)).all()
+    return TASK_ROWS.many(rows)
+
+def _calendar_status(user_id):
+    # Calendar accounts are kept in questify.db (the directory when users are sharded)
+    with engine.connect() as conn:
+        provider = conn.execute(text("SELECT provider FROM calendar_accounts WHERE user_id = :user_id LIMIT 1"),
+                                {"user_id": user_id}).scalar()
+    return {"connected": provider is not None, "provider": provider}
+
+def _imported_events(day):
+    # Read-only, so a missing file is not created; no file or no table yet means no events
+    try:
+        conn = sqlite3.connect(f"file:{CALENDAR_DB}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return []
+    try:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(
+            "SELECT id, title, start, end, description FROM local_calendar_events "
+            "WHERE start < ? AND end >= ? ORDER BY start",
+            ((day + timedelta(days=1)).isoformat(), day.isoformat()),
+        ).fetchall()
+        return [dict(r) for r in rows]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+def _quest_events(user_id, day):
+    # Recurring quests due today, shaped like the calendar service's local events
+    with shard_router.engine(user_id).connect() as conn:
+        return [{"id": f"quest-{quest.id}-{iso}", "title": quest.title, "start": iso, "end": iso,
+                 "description": None}
+                for quest, days in recurrence.expand(conn, user_id, day, day) for iso in days]
+
+def _etag(body):
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+# Everything the Dashboard needs for its first paint in one response: the profile, the
+# task list, whether a calendar is connected and today's events. The ETag is a hash of
+# the body, so a client whose copy is current gets an empty 304.
+@router.get("/users/{user_id}/bootstrap")
+async def bootstrap(user_id: int, if_none_match: Optional[str] = Header(None)):
+    today = date.today()
+    profile, tasks, calendar, imported, local = await asyncio.gather(
+        run_in_threadpool(_profile, user_id),
+        run_in_threadpool(_tasks, user_id),
+        run_in_threadpool(_calendar_status, user_id),
+        run_in_threadpool(_imported_events, today),
+        run_in_threadpool(_quest_events, user_id, today),
+    )
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    body = json_response({
+        "user": profile,
+        "tasks": tasks,
+        "calendar": calendar,
+        "today": {"date": today.isoformat(), "imported": imported, "local": local},
+    }).body
+    headers = {"ETag": _etag(body), "Cache-Control": "private, no-cache"}
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
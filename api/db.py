@@ -1,29 +1,210 @@
 from pathlib import Path
 import sqlalchemy
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
 import sys
 import os
+import sqlite3
+from datetime import datetime
 
-def get_db_path():
+def get_application_path():
     if getattr(sys, 'frozen', False):
-        application_path = os.path.dirname(os.path.dirname(sys.executable))
-    else:
-        application_path = Path(__file__).resolve().parent.parent
-    
-    db_path = os.path.join(application_path, 'db', 'questify.db')
-    return f"sqlite:///{db_path}"
+        return os.path.dirname(os.path.dirname(sys.executable))
+    return Path(__file__).resolve().parent.parent
+
+# QUESTIFY_DATA_DIR puts the database files somewhere else than next to schema.sql
+# (the tests use a temporary directory)
+def get_data_dir():
+    return os.getenv("QUESTIFY_DATA_DIR") or os.path.join(get_application_path(), 'db')
+
+def get_db_file():
+    return os.path.join(get_data_dir(), 'questify.db')
+
+def get_db_path():
+    return f"sqlite:///{get_db_file()}"
+
+# DB_SHARDS=N (N >= 2) spreads users over N shard files, each with its own engine and so
+# its own writer. questify.db then becomes the directory: which shard holds each user, and
+# the shared shop catalog and achievements, which are copied into every shard so per-user
+# queries can still join against them.
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+SHARDED = DB_SHARDS > 1
+
+def get_shard_file(shard):
+    return os.path.join(get_data_dir(), f'questify-shard{shard}.db')
+
+def database_files():
+    return [get_db_file()] + [get_shard_file(i) for i in range(DB_SHARDS if SHARDED else 0)]
+
+# WAL lets readers carry on while a write commits, and busy_timeout makes a second
+# writer wait for the lock instead of failing with "database is locked"
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    # Waits up to 5 s for the write lock, blocking the calling thread; routes that use the
+    # database are plain def so that wait happens in the threadpool, not on the event loop
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+def _create_engine(url):
+    new_engine = create_engine(url)
+    event.listen(new_engine, "connect", _sqlite_pragmas)
+    return new_engine
 
 # DB_PATH = f"sqlite:///{Path(__file__).resolve().parent.parent}/db/questify.db"
 DB_PATH = get_db_path()
-engine = create_engine(DB_PATH)
+engine = _create_engine(DB_PATH)
+shard_engines = [_create_engine(f"sqlite:///{get_shard_file(i)}") for i in range(DB_SHARDS if SHARDED else 0)]
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+shard_sessions = [sessionmaker(autocommit=False, autoflush=False, bind=e) for e in shard_engines]
+
+def all_engines():
+    return [engine] + shard_engines
+
+# The engines that hold user rows
+def user_engines():
+    return shard_engines if SHARDED else [engine]
+
 Base = sqlalchemy.orm.declarative_base()
 
 # Base.metadata.create_all(bind=engine)
 
+# Columns added to tables that already shipped; CREATE TABLE IF NOT EXISTS won't add them
+ADDED_COLUMNS = [
+    ("focus_sessions", "task_id", "TEXT"),
+    ("shop_items", "stock", "INTEGER"),
+]
+
+# Only in the directory of a sharded install. Ids are handed out here, so they are unique
+# across shards; email and display_name are kept for signup and login.
+DIRECTORY_SQL = """
+CREATE TABLE IF NOT EXISTS user_shards (
+  user_id      INTEGER PRIMARY KEY,
+  shard        INTEGER NOT NULL,
+  email        TEXT UNIQUE NOT NULL,
+  display_name TEXT NOT NULL,
+  moved        INTEGER NOT NULL DEFAULT 0   -- shard is not the one the id hashes to
+);
+CREATE INDEX IF NOT EXISTS idx_user_shards_name ON user_shards(display_name);
+CREATE INDEX IF NOT EXISTS idx_user_shards_moved ON user_shards(user_id) WHERE moved = 1;
+"""
+
+# Shared tables the directory owns and every shard keeps a copy of
+SHARED_TABLES = ("shop_items", "achievements")
+
+# Every statement in schema.sql is IF NOT EXISTS, so running it on startup only adds
+# tables and indexes that an older questify.db is missing
+def init_schema():
+    schema_path = os.path.join(get_application_path(), 'db', 'schema.sql')
+    if not os.path.exists(schema_path):
+        return
+    with open(schema_path) as f:
+        script = f.read()
+    for path in database_files():
+        _apply_schema(path, script)
+    if SHARDED:
+        conn = sqlite3.connect(get_db_file())
+        try:
+            conn.executescript(DIRECTORY_SQL)
+        finally:
+            conn.close()
+        copy_shared_tables()
+
+def _apply_schema(path, script):
+    # Own connection: the script toggles PRAGMA foreign_keys, which must not leak into the pool
+    conn = sqlite3.connect(path)
+    try:
+        # auto_vacuum can only be chosen before the first table exists; a brand new file
+        # gets INCREMENTAL so the maintenance job can hand freed pages back to the disk
+        if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.executescript(script)
+        for table, column, decl in ADDED_COLUMNS:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        conn.commit()
+    finally:
+        conn.close()
+
+# History rows are stamped in local time, like users.created_at and last_rollover, so
+# date(logged_at) is the same day the rollover and the rollups see
+def local_now():
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+def copy_shared_tables():
+    # Refresh every shard's copy of the shared tables from the directory. They are small
+    # and only change through the admin routes, which call this after they commit.
+    with engine.connect() as source:
+        tables = {table: source.execute(text(f"SELECT * FROM {table}")).mappings().all() for table in SHARED_TABLES}
+    for shard_engine in shard_engines:
+        with shard_engine.begin() as conn:
+            for table, rows in tables.items():
+                conn.execute(text(f"DELETE FROM {table}"))
+                if rows:
+                    cols = list(rows[0].keys())
+                    conn.execute(text(f"INSERT INTO {table} ({', '.join(cols)}) "
+                                      f"VALUES ({', '.join(':' + c for c in cols)})"), [dict(r) for r in rows])
+
+def jump_hash(key, buckets):
+    # Jump consistent hash: growing from N to N+1 shards moves only 1/(N+1) of the users
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+class ShardRouter:
+    # Users live on the shard their id hashes to. The directory records every user's
+    # shard, and only users the rebalance tool placed elsewhere are kept in memory, so a
+    # lookup never touches the database. The tool runs with the app stopped, so the map
+    # loaded at startup stays right; the directory's user_version records the shard count
+    # it was balanced for.
+    def __init__(self):
+        self.moved = {}
+
+    def load(self):
+        if not SHARDED:
+            return
+        with engine.connect() as conn:
+            balanced_for = conn.exec_driver_sql("PRAGMA user_version").scalar()
+            if balanced_for == 0 and conn.execute(text("SELECT 1 FROM users LIMIT 1")).first() is None:
+                # A new install has nothing to balance
+                conn.exec_driver_sql(f"PRAGMA user_version = {DB_SHARDS}")
+                balanced_for = DB_SHARDS
+            if balanced_for != DB_SHARDS:
+                raise RuntimeError(f"Users are not spread over {DB_SHARDS} shards yet; "
+                                   "stop the app and run `python shards.py rebalance`")
+            rows = conn.execute(text("SELECT user_id, shard FROM user_shards WHERE moved = 1")).all()
+        self.moved = dict(rows)
+
+    def placement(self, user_id):
+        return jump_hash(user_id, DB_SHARDS)
+
+    def shard_of(self, user_id):
+        return self.moved.get(user_id, self.placement(user_id))
+
+    def engine(self, user_id):
+        return shard_engines[self.shard_of(user_id)] if SHARDED else engine
+
+    def session(self, user_id):
+        return shard_sessions[self.shard_of(user_id)]() if SHARDED else SessionLocal()
+
+shard_router = ShardRouter()
+
 def get_db():
     db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# For routes under /users/{user_id}: a session on the shard that holds the user
+def get_user_db(user_id: int):
+    db = shard_router.session(user_id)
     try:
         yield db
     finally:
@@ -1,10 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from db import get_db
+from sqlalchemy import text
+from datetime import date
+import json
+from db import get_user_db, local_now
+from sessions import require_user
 from auth import UserItem, UserFullOut
+from leaderboard import leaderboard
+import guild
+import stats
+import achievements
+import recurrence
 
-router = APIRouter(prefix="/api", tags=["economy"])
+router = APIRouter(prefix="/api", tags=["economy"], dependencies=[Depends(require_user)])
 
 class EconomyUpdate(BaseModel):
     xp_delta: int = 0
@@ -15,12 +24,20 @@ class EconomyUpdate(BaseModel):
     wisdom_delta: int = 0
     charisma_delta: int = 0
 
-@router.patch("/users/{user_id}/economy", response_model=UserFullOut)
-async def update_economy(user_id: int, economy: EconomyUpdate, db: Session = Depends(get_db)):
-    user = db.query(UserItem).filter(UserItem.id == user_id).first()
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+# Append a row to economy_ledger in the caller's transaction
+def record_ledger(db, user_id, delta_gold, delta_diamonds, reason, meta=None):
+    db.execute(
+        text("INSERT INTO economy_ledger (user_id, delta_gold, delta_diamonds, reason, meta_json, created_at) "
+             "VALUES (:user_id, :delta_gold, :delta_diamonds, :reason, :meta_json, :created_at)"),
+        {"user_id": user_id, "delta_gold": delta_gold, "delta_diamonds": delta_diamonds, "reason": reason,
+         "meta_json": json.dumps(meta or {}), "created_at": local_now()},
+    )
+
+# Apply deltas to a loaded user and stage the ledger/rollup rows; the caller commits
+def apply_economy(db, user, economy):
+    user_id = user.id
+    before = {c: getattr(user, c) for c in ("gold",) + stats.STAT_COLUMNS}
+    level_before = user.level
     
     user.xp += economy.xp_delta
     user.gold += economy.gold_delta
@@ -50,6 +67,28 @@ async def update_economy(user_id: int, economy: EconomyUpdate, db: Session = Dep
     if user.charisma < 0:
         user.charisma = 0
     
+    # Ledger and daily rollup get what was actually applied after the clamps above
+    applied = {c: getattr(user, c) - before[c] for c in before}
+    if economy.xp_delta or any(applied.values()):
+        meta = {"xp": economy.xp_delta, **{c: applied[c] for c in stats.STAT_COLUMNS}}
+        record_ledger(db, user_id, applied["gold"], 0, "economy", meta)
+        stats.record(db, user_id, date.today(), xp=economy.xp_delta, **applied)
+    if user.level > level_before:
+        # Flush first: an achievement reward updates the same row with plain SQL,
+        # then reload so the object carries the reward into later changes
+        db.flush()
+        if achievements.reached(db, user_id, "level_up", "level", level_before, user.level):
+            db.refresh(user)
+
+@router.patch("/users/{user_id}/economy", response_model=UserFullOut)
+def update_economy(user_id: int, economy: EconomyUpdate, db: Session = Depends(get_user_db)):
+    user = db.query(UserItem).filter(UserItem.id == user_id).first()
+    
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    apply_economy(db, user, economy)
+    
     try:
         db.commit()
         db.refresh(user)
@@ -57,17 +96,24 @@ async def update_economy(user_id: int, economy: EconomyUpdate, db: Session = Dep
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to update economy: {str(e)}")
     
+    leaderboard.update_user(user)
     return user
 
 @router.patch("/users/{user_id}/rollover")
-async def update_rollover(user_id: int, db: Session = Depends(get_db)):
+def update_rollover(user_id: int, db: Session = Depends(get_user_db)):
     user = db.query(UserItem).filter(UserItem.id == user_id).first()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    from datetime import datetime
-    user.last_rollover = datetime.now().date().isoformat()
+    from datetime import datetime, timedelta
+    today = datetime.now().date()
+    missed = []
+    if user.last_rollover != today.isoformat():
+        # Recurring quests due on the days since the previous rollover
+        first = date.fromisoformat(user.last_rollover) if user.last_rollover else today - timedelta(days=1)
+        missed = recurrence.missed(db, user_id, first, today - timedelta(days=1))
+    events = guild.rollover(db, user, today)
     
     try:
         db.commit()
@@ -76,4 +122,13 @@ async def update_rollover(user_id: int, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to update rollover: {str(e)}")
     
-    return {"success": True, "last_rollover": user.last_rollover}
+    leaderboard.update_user(user)
+    return {
+        "success": True,
+        "last_rollover": user.last_rollover,
+        "guild_rank": user.guild_rank,
+        "guild_streak": user.guild_streak,
+        "events": [event for event, _ in events],
+        "due_today": recurrence.due_on(db, user_id, today),
+        "missed": missed,
+    }
@@ -0,0 +1,226 @@
+import os
+import heapq
+import threading
+from bisect import insort
+from collections import OrderedDict
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from db import shard_router
+from metrics import gauge
+from sessions import require_user
+from serialize import json_response
+
+router = APIRouter(prefix="/api", tags=["feed"], dependencies=[Depends(require_user)])
+
+# Newest entries kept in memory per user
+HEAD_SIZE = int(os.getenv("FEED_HEAD_SIZE", "50"))
+# Users whose newest entries are kept in memory
+CACHE_USERS = int(os.getenv("FEED_CACHE_USERS", "1000"))
+MAX_LIMIT = 200
+
+# The feed is narrative_events and quest_logs as one stream, newest first, ordered by
+# (time, kind, id). A page ends at a cursor holding the last entry's key, and the next
+# page is the entries below it: a range scan per table on its (user_id, time) index,
+# merged. The two id bounds in each query make rows that share the cursor's timestamp
+# come out in the same order as the merge puts them.
+_SOURCES = {
+    "narrative": text("""
+        SELECT id, created_at, event_type, text FROM narrative_events
+        WHERE user_id = :user_id AND created_at <= :at AND (created_at < :at OR id < :tie_id)
+        ORDER BY created_at DESC, id DESC LIMIT :n
+    """),
+    "quest_log": text("""
+        SELECT id, logged_at, quest_id, outcome, xp_delta, gold_delta, hp_delta FROM quest_logs
+        WHERE user_id = :user_id AND logged_at <= :at AND (logged_at < :at OR id < :tie_id)
+        ORDER BY logged_at DESC, id DESC LIMIT :n
+    """),
+}
+
+def narrative_entry(event_id, event_type, event_text, created_at):
+    return {"kind": "narrative", "id": event_id, "at": created_at, "event_type": event_type, "text": event_text}
+
+def quest_log_entry(row):
+    return {"kind": "quest_log", "id": row["id"], "at": row["logged_at"], "quest_id": row["quest_id"],
+            "outcome": row["outcome"], "xp_delta": row["xp_delta"], "gold_delta": row["gold_delta"],
+            "hp_delta": row["hp_delta"]}
+
+def _key(entry):
+    return (entry["at"], entry["kind"], entry["id"])
+
+def cursor(entry):
+    return f"{entry['at']}|{entry['kind']}|{entry['id']}"
+
+def parse_cursor(value):
+    at, _, rest = value.partition("|")
+    kind, _, entry_id = rest.partition("|")
+    if not at or kind not in _SOURCES or not entry_id.isdigit():
+        raise ValueError(value)
+    return at, kind, int(entry_id)
+
+def read(conn, user_id, before, n):
+    # The n newest entries below the cursor key `before` (None for the newest overall)
+    at, kind, entry_id = before or ("9999", "", 0)
+    streams = []
+    for source, sql in _SOURCES.items():
+        # At the cursor's timestamp a source sorting below the cursor's kind is entirely
+        # after it, one sorting above entirely before it
+        tie_id = entry_id if source == kind else (2 ** 63 - 1 if source < kind else 0)
+        rows = conn.execute(sql, {"user_id": user_id, "at": at, "tie_id": tie_id, "n": n}).all()
+        if source == "narrative":
+            streams.append([narrative_entry(r[0], r[2], r[3], r[1]) for r in rows])
+        else:
+            streams.append([quest_log_entry(r._mapping) for r in rows])
+    merged = heapq.merge(*streams, key=_key, reverse=True)
+    return [entry for entry, _ in zip(merged, range(n))]
+
+class _Head:
+    __slots__ = ("entries", "loaded", "more")
+
+    def __init__(self):
+        # Oldest first; while not loaded, only what was committed since the load began
+        self.entries = []
+        self.loaded = False
+        self.more = False
+
+class FeedHeads:
+    # Each cached user's newest entries, so the first page of a feed is answered from
+    # memory. A head is loaded from the tables on its first miss and from then on kept
+    # current by the write paths, which hand over what they committed (see stage()).
+    # Commits that land while a head is loading are collected on it and merged in, so a
+    # load never misses one. An LRU over users bounds memory.
+    def __init__(self, max_users, size):
+        self._lock = threading.Lock()
+        self._heads = OrderedDict()
+        self.max_users = max_users
+        self.size = size
+
+    def __len__(self):
+        return len(self._heads)
+
+    def first_page(self, user_id, limit):
+        # (entries, next cursor), or None when the head can't answer
+        with self._lock:
+            head = self._heads.get(user_id)
+            if head is None or not head.loaded or (len(head.entries) < limit and head.more):
+                return None
+            self._heads.move_to_end(user_id)
+            page = [entry for _, entry in head.entries[-limit:]]
+            more = len(head.entries) > limit or head.more
+        page.reverse()
+        return page, cursor(page[-1]) if more and page else None
+
+    def begin_load(self, user_id):
+        with self._lock:
+            head = self._heads.get(user_id)
+            if head is None:
+                head = self._heads[user_id] = _Head()
+                while len(self._heads) > self.max_users:
+                    self._heads.popitem(last=False)
+            return head
+
+    def finish_load(self, user_id, head, entries):
+        # entries: the size + 1 newest, newest first, read after begin_load()
+        with self._lock:
+            if self._heads.get(user_id) is not head or head.loaded:
+                return
+            seen = {key for key, _ in head.entries}
+            for entry in entries[:self.size]:
+                if _key(entry) not in seen:
+                    head.entries.append((_key(entry), entry))
+            head.entries.sort(key=lambda item: item[0])
+            head.more = head.more or len(entries) > self.size
+            self._trim(head)
+            head.loaded = True
+
+    def add(self, user_id, entries):
+        with self._lock:
+            head = self._heads.get(user_id)
+            if head is None:
+                return
+            for entry in entries:
+                insort(head.entries, (_key(entry), entry), key=lambda item: item[0])
+            self._trim(head)
+
+    def _trim(self, head):
+        if len(head.entries) > self.size:
+            del head.entries[:len(head.entries) - self.size]
+            head.more = True
+
+    def forget(self, user_id):
+        # For writes that bypass stage() (an import)
+        with self._lock:
+            self._heads.pop(user_id, None)
+
+heads = FeedHeads(CACHE_USERS, HEAD_SIZE)
+
+gauge("questify_feed_cached_users", "Users whose newest feed entries are in memory", lambda: len(heads))
+
+# Write paths stage entries on their session; they reach the heads once the session
+# commits and are dropped if it rolls back. Each entry remembers the savepoint it was
+# staged in (None outside one), so rolling back a savepoint drops only what it staged.
+# Connections (the offline rebuild and backfill tools) are not staged: those run with
+# the app stopped.
+def stage(db, user_id, entry):
+    if isinstance(db, Session):
+        db.info.setdefault("feed", []).append((db.get_nested_transaction(), user_id, entry))
+
+def _after_commit(session):
+    staged = session.info.pop("feed", None)
+    if staged:
+        by_user = {}
+        for _, user_id, entry in staged:
+            by_user.setdefault(user_id, []).append(entry)
+        for user_id, entries in by_user.items():
+            heads.add(user_id, entries)
+
+def _within(transaction, outer):
+    while transaction is not None:
+        if transaction is outer:
+            return True
+        transaction = transaction.parent
+    return False
+
+def _after_soft_rollback(session, previous_transaction):
+    staged = session.info.get("feed")
+    if not staged:
+        return
+    if previous_transaction.nested:
+        session.info["feed"] = [item for item in staged if not _within(item[0], previous_transaction)]
+    else:
+        session.info.pop("feed", None)
+
+event.listen(Session, "after_commit", _after_commit)
+event.listen(Session, "after_soft_rollback", _after_soft_rollback)
+
+def _load(user_id, head, limit):
+    with shard_router.engine(user_id).connect() as conn:
+        entries = read(conn, user_id, None, max(limit, heads.size) + 1)
+    heads.finish_load(user_id, head, entries)
+    return entries
+
+def _read(user_id, before, limit):
+    with shard_router.engine(user_id).connect() as conn:
+        return read(conn, user_id, before, limit + 1)
+
+# Quest log outcomes and narrative events (promotions, demotions, milestones) newest
+# first. Pass the returned next cursor as before= for the following page; next is null
+# on the last one.
+@router.get("/users/{user_id}/feed")
+async def user_feed(user_id: int, before: Optional[str] = None, limit: int = 50):
+    limit = min(max(limit, 1), MAX_LIMIT)
+    if before is None:
+        hit = heads.first_page(user_id, limit)
+        if hit is not None:
+            return json_response({"items": hit[0], "next": hit[1]})
+        entries = await run_in_threadpool(_load, user_id, heads.begin_load(user_id), limit)
+    else:
+        try:
+            key = parse_cursor(before)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        entries = await run_in_threadpool(_read, user_id, key, limit)
+    page = entries[:limit]
+    return json_response({"items": page, "next": cursor(page[-1]) if len(entries) > limit else None})
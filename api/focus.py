@@ -0,0 +1,275 @@
+import os
+import time
+import logging
+import secrets
+import threading
+from datetime import date, timedelta
+from typing import Optional, Literal
+from fastapi import APIRouter, HTTPException, Depends, Query
+from pydantic import BaseModel, Field, ConfigDict
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from db import get_user_db, local_now, shard_router
+from sessions import require_user
+import achievements
+
+router = APIRouter(prefix="/api", tags=["focus"], dependencies=[Depends(require_user)])
+
+logger = logging.getLogger("questify.focus")
+
+# A session with no heartbeat for this long is closed as 'timeout'
+FOCUS_TIMEOUT_S = int(os.getenv("FOCUS_TIMEOUT_S", "600"))
+# Reported focus time may run ahead of the server clock by this much, no more
+CLOCK_SLACK_S = 5
+
+class FocusStartIn(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    task_id: Optional[str] = Field(None, alias="taskId")
+    quest_id: Optional[int] = Field(None, alias="questId")
+    target_min: int = Field(25, alias="targetMin")
+
+class Heartbeat(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    elapsed_s: int = Field(alias="elapsedS")   # focused seconds on the client timer so far
+
+class HeartbeatBatchIn(BaseModel):
+    beats: list[Heartbeat]
+
+class FocusEndIn(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    outcome: Literal["success", "abandoned"] = "success"
+    elapsed_s: Optional[int] = Field(None, alias="elapsedS")
+
+class ActiveSession:
+    __slots__ = ("user_id", "task_id", "quest_id", "target_min", "started_at", "started", "elapsed_s", "last_seen")
+
+    def __init__(self, user_id, task_id, quest_id, target_min):
+        self.user_id = user_id
+        self.task_id = task_id
+        self.quest_id = quest_id
+        self.target_min = target_min
+        self.started_at = local_now()
+        self.started = time.monotonic()
+        self.elapsed_s = 0
+        self.last_seen = self.started
+
+    def report(self, elapsed_s):
+        # Beats can arrive batched and out of order; the largest plausible value wins
+        ceiling = int(time.monotonic() - self.started) + CLOCK_SLACK_S
+        self.elapsed_s = max(self.elapsed_s, min(max(elapsed_s, 0), ceiling))
+        self.last_seen = time.monotonic()
+
+# In-progress sessions live in memory; only finished sessions reach focus_sessions
+_active = {}
+_lock = threading.Lock()
+
+def _write_session(db, session, outcome):
+    db.execute(
+        text("""
+            INSERT INTO focus_sessions (user_id, quest_id, task_id, started_at, ended_at,
+                                        target_min, actual_min, outcome)
+            VALUES (:user_id, :quest_id, :task_id, :started_at, :ended_at, :target_min, :actual_min, :outcome)
+        """),
+        {"user_id": session.user_id, "quest_id": session.quest_id, "task_id": session.task_id,
+         "started_at": session.started_at, "ended_at": local_now(), "target_min": session.target_min,
+         "actual_min": session.elapsed_s // 60, "outcome": outcome},
+    )
+    completed = int(outcome == "success")
+    db.execute(
+        text("""
+            INSERT INTO focus_daily (user_id, day, task_id, sessions, completed, minutes)
+            VALUES (:user_id, :day, :task_id, 1, :completed, :minutes)
+            ON CONFLICT(user_id, day, task_id) DO UPDATE SET
+                sessions = sessions + 1,
+                completed = completed + excluded.completed,
+                minutes = minutes + excluded.minutes
+        """),
+        {"user_id": session.user_id, "day": session.started_at[:10], "task_id": session.task_id or "",
+         "completed": completed, "minutes": session.elapsed_s // 60},
+    )
+    poms_done = None
+    if completed and session.task_id:
+        # Single UPDATE, so concurrent completions on the same task can't lose a pom
+        poms_done = db.execute(
+            text("UPDATE tasks SET poms_done = COALESCE(poms_done, 0) + 1 "
+                 "WHERE id = :task_id AND user_id = :user_id RETURNING poms_done"),
+            {"task_id": session.task_id, "user_id": session.user_id},
+        ).scalar()
+    if completed:
+        achievements.count(db, session.user_id, "focus_session",
+                           focus_sessions=1, focus_minutes=session.elapsed_s // 60)
+    return poms_done
+
+def expire_stale(user_id=None):
+    # Close sessions that stopped sending heartbeats (only user_id's, if given). Each is
+    # written on its owner's shard; one that fails to write goes back for the next pass.
+    cutoff = time.monotonic() - FOCUS_TIMEOUT_S
+    with _lock:
+        stale = [sid for sid, s in _active.items()
+                 if s.last_seen < cutoff and (user_id is None or s.user_id == user_id)]
+        sessions = [(sid, _active.pop(sid)) for sid in stale]
+    for sid, session in sessions:
+        db = shard_router.session(session.user_id)
+        try:
+            _write_session(db, session, "timeout")
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("could not close timed out focus session of user %s", session.user_id)
+            with _lock:
+                _active.setdefault(sid, session)
+        finally:
+            db.close()
+    return len(sessions)
+
+def _get_active(user_id, session_id):
+    session = _active.get(session_id)
+    if session is None or session.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Focus session not found")
+    return session
+
+@router.post("/users/{user_id}/focus/sessions", status_code=201)
+def start_focus(user_id: int, item: FocusStartIn, db: Session = Depends(get_user_db)):
+    exists = db.execute(text("SELECT 1 FROM users WHERE id = :id"), {"id": user_id}).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    if item.task_id is not None:
+        task = db.execute(
+            text("SELECT 1 FROM tasks WHERE id = :id AND user_id = :user_id"),
+            {"id": item.task_id, "user_id": user_id},
+        ).first()
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+
+    # Every start and end sweeps all users' timed out sessions, so one whose owner never
+    # comes back is still recorded
+    expire_stale()
+
+    session_id = secrets.token_urlsafe(12)
+    session = ActiveSession(user_id, item.task_id, item.quest_id, max(item.target_min, 1))
+    with _lock:
+        _active[session_id] = session
+    return {"session_id": session_id, "started_at": session.started_at, "target_min": session.target_min}
+
+# Clients may buffer beats while offline and send them in one batch
+@router.post("/users/{user_id}/focus/sessions/{session_id}/heartbeats")
+def focus_heartbeats(user_id: int, session_id: str, item: HeartbeatBatchIn):
+    session = _get_active(user_id, session_id)
+    if item.beats:
+        session.report(max(beat.elapsed_s for beat in item.beats))
+    return {"session_id": session_id, "elapsed_s": session.elapsed_s}
+
+@router.post("/users/{user_id}/focus/sessions/{session_id}/end")
+def end_focus(user_id: int, session_id: str, item: FocusEndIn, db: Session = Depends(get_user_db)):
+    # Taken out of _active so a second end can't write it twice; it goes back if the write
+    # fails, so the client can retry
+    with _lock:
+        session = _get_active(user_id, session_id)
+        del _active[session_id]
+    expire_stale()
+    if item.elapsed_s is not None:
+        session.report(item.elapsed_s)
+
+    try:
+        poms_done = _write_session(db, session, item.outcome)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        with _lock:
+            _active.setdefault(session_id, session)
+        raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
+
+    return {
+        "session_id": session_id,
+        "outcome": item.outcome,
+        "elapsed_s": session.elapsed_s,
+        "task_id": session.task_id,
+        "poms_done": poms_done,
+    }
+
+def _window(from_, to):
+    to = to or date.today()
+    from_ = from_ or to - timedelta(days=29)
+    if from_ > to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    return from_.isoformat(), to.isoformat()
+
+# Focus minutes per day, from the focus_daily rollup (one row per day and task). The
+# reads first close the user's own timed out sessions so those show up here.
+@router.get("/users/{user_id}/focus/daily")
+def focus_by_day(user_id: int, from_: Optional[date] = Query(None, alias="from"), to: Optional[date] = None,
+                 db: Session = Depends(get_user_db)):
+    from_day, to_day = _window(from_, to)
+    expire_stale(user_id)
+    rows = db.execute(
+        text("""
+            SELECT day, SUM(sessions) AS sessions, SUM(completed) AS completed, SUM(minutes) AS minutes
+            FROM focus_daily
+            WHERE user_id = :user_id AND day BETWEEN :from_day AND :to_day
+            GROUP BY day ORDER BY day
+        """),
+        {"user_id": user_id, "from_day": from_day, "to_day": to_day},
+    ).mappings().all()
+    return [dict(r) for r in rows]
+
+@router.get("/users/{user_id}/focus/tasks")
+def focus_by_task(user_id: int, from_: Optional[date] = Query(None, alias="from"), to: Optional[date] = None,
+                  db: Session = Depends(get_user_db)):
+    from_day, to_day = _window(from_, to)
+    expire_stale(user_id)
+    rows = db.execute(
+        text("""
+            SELECT NULLIF(task_id, '') AS task_id, SUM(sessions) AS sessions,
+                   SUM(completed) AS completed, SUM(minutes) AS minutes
+            FROM focus_daily
+            WHERE user_id = :user_id AND day BETWEEN :from_day AND :to_day
+            GROUP BY task_id ORDER BY minutes DESC
+        """),
+        {"user_id": user_id, "from_day": from_day, "to_day": to_day},
+    ).mappings().all()
+    return [dict(r) for r in rows]
+
+# Raw finished sessions, newest first, as a range scan on idx_focus_user_time. Pages are
+# keyed on (started_at, id): pass the last row's started_at as before and its id as
+# before_id, so sessions sharing a start time are neither skipped nor repeated.
+@router.get("/users/{user_id}/focus/sessions")
+def list_focus_sessions(user_id: int, before: Optional[str] = None, before_id: int = 0, limit: int = 50,
+                        db: Session = Depends(get_user_db)):
+    expire_stale(user_id)
+    rows = db.execute(
+        text("""
+            SELECT id, task_id, quest_id, started_at, ended_at, target_min, actual_min, outcome
+            FROM focus_sessions
+            WHERE user_id = :user_id AND started_at <= :before AND (started_at < :before OR id < :before_id)
+            ORDER BY started_at DESC, id DESC LIMIT :limit
+        """),
+        {"user_id": user_id, "before": before or "9999", "before_id": before_id,
+         "limit": min(max(limit, 1), 200)},
+    ).mappings().all()
+    return [dict(r) for r in rows]
+
+def rebuild(conn):
+    # Re-derive focus_daily from focus_sessions
+    conn.execute(text("DELETE FROM focus_daily"))
+    conn.execute(text("""
+        INSERT INTO focus_daily (user_id, day, task_id, sessions, completed, minutes)
+        SELECT user_id, date(started_at), COALESCE(task_id, ''), COUNT(*),
+               SUM(outcome = 'success'), SUM(actual_min)
+        FROM focus_sessions
+        GROUP BY user_id, date(started_at), COALESCE(task_id, '')
+    """))
+
+if __name__ == "__main__":
+    import sys
+    from db import user_engines
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python focus.py rebuild")
+        sys.exit(1)
+    for engine in user_engines():
+        with engine.begin() as conn:
+            rebuild(conn)
+    print("Rebuilt focus_daily")
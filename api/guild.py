@@ -0,0 +1,283 @@
+from datetime import date, timedelta
+from sqlalchemy import text
+from db import local_now
+import achievements
+import feed
+
+GUILD_RANKS = ["Bronze", "Silver", "Gold", "Platinum", "Diamond"]
+# Hearts on the name plate; a full row at rollover promotes the adventurer
+HEARTS_PER_RANK = 5
+
+def _rank_index(rank):
+    return GUILD_RANKS.index(rank) if rank in GUILD_RANKS else 0
+
+def close_day(rank, hearts, active):
+    # One day ending. Active days add a heart and a full row promotes; an idle day
+    # empties the hearts, and an idle day with no hearts left demotes one rank.
+    idx = _rank_index(rank)
+    if active:
+        hearts += 1
+        if hearts >= HEARTS_PER_RANK:
+            if idx + 1 < len(GUILD_RANKS):
+                return GUILD_RANKS[idx + 1], 0, "promotion"
+            return rank, HEARTS_PER_RANK, None
+        return rank, hearts, None
+    if hearts > 0:
+        return rank, 0, None
+    if idx > 0:
+        return GUILD_RANKS[idx - 1], 0, "demotion"
+    return rank, 0, None
+
+def close_days(rank, hearts, active, count):
+    # Same outcome as calling close_day `count` times, but stops once nothing can change
+    # (Bronze with no hearts when idle, top rank with full hearts when active), so a
+    # long absence costs at most a handful of steps
+    events = []
+    for _ in range(count):
+        new_rank, new_hearts, event = close_day(rank, hearts, active)
+        if event:
+            events.append((event, new_rank))
+        if (new_rank, new_hearts) == (rank, hearts):
+            break
+        rank, hearts = new_rank, new_hearts
+    return rank, hearts, events
+
+def _event_text(event, rank):
+    if event == "promotion":
+        return f"Promoted to {rank} rank in the guild"
+    return f"Demoted to {rank} rank in the guild"
+
+def record_activity(db, user_id, day):
+    # O(1) upsert of the user's daily check-in run; out-of-order days leave it untouched.
+    # Returns the run length after the upsert.
+    yesterday = (day - timedelta(days=1)).isoformat()
+    return db.execute(text("""
+        INSERT INTO daily_checkins (user_id, current_run, last_day) VALUES (:user_id, 1, :day)
+        ON CONFLICT(user_id) DO UPDATE SET
+            current_run = CASE
+                WHEN last_day >= :day THEN current_run
+                WHEN last_day = :yesterday THEN current_run + 1
+                ELSE 1 END,
+            last_day = MAX(last_day, :day)
+        RETURNING current_run
+    """), {"user_id": user_id, "day": day.isoformat(), "yesterday": yesterday}).scalar()
+
+def record_quest_streak(db, user_id, quest_id, day):
+    yesterday = (day - timedelta(days=1)).isoformat()
+    return db.execute(text("""
+        INSERT INTO streaks (user_id, quest_id, count, last_day) VALUES (:user_id, :quest_id, 1, :day)
+        ON CONFLICT(user_id, quest_id) DO UPDATE SET
+            count = CASE
+                WHEN last_day >= :day THEN count
+                WHEN last_day = :yesterday THEN count + 1
+                ELSE 1 END,
+            last_day = MAX(last_day, :day)
+        RETURNING count
+    """), {"user_id": user_id, "quest_id": quest_id, "day": day.isoformat(), "yesterday": yesterday}).scalar()
+
+# Event hooks for the write paths. They only stage statements; the caller commits them
+# together with the change that triggered them.
+def on_task_completed(db, user_id, task_id, day):
+    db.execute(
+        text("INSERT INTO task_logs (user_id, task_id, logged_at, outcome) "
+             "VALUES (:user_id, :task_id, :logged_at, 'complete')"),
+        {"user_id": user_id, "task_id": task_id, "logged_at": local_now()},
+    )
+    _streak(db, user_id, "daily_streak", record_activity(db, user_id, day))
+
+def on_task_uncompleted(db, user_id, task_id, day):
+    # Only an undo of a completion made the same day counts; un-checking yesterday's
+    # Daily at rollover is a reset, not an undo. Returns whether an undo was logged.
+    last = db.execute(
+        text("SELECT outcome FROM task_logs WHERE user_id = :user_id AND logged_at >= :day "
+             "AND task_id = :task_id ORDER BY id DESC LIMIT 1"),
+        {"user_id": user_id, "day": day.isoformat(), "task_id": task_id},
+    ).scalar()
+    if last != "complete":
+        return False
+    db.execute(
+        text("INSERT INTO task_logs (user_id, task_id, logged_at, outcome) "
+             "VALUES (:user_id, :task_id, :logged_at, 'undo')"),
+        {"user_id": user_id, "task_id": task_id, "logged_at": local_now()},
+    )
+    return True
+
+def on_quest_completed(db, user_id, quest_id, day):
+    _streak(db, user_id, "daily_streak", record_activity(db, user_id, day))
+    _streak(db, user_id, "quest_streak", record_quest_streak(db, user_id, quest_id, day))
+
+def _streak(db, user_id, metric, length):
+    # Streaks grow one day at a time, so only a threshold equal to the new length can be crossed
+    achievements.reached(db, user_id, "streak", metric, length - 1, length)
+
+def _add_narrative(db, user_id, events, created_at=None):
+    for event, rank in events:
+        params = {"user_id": user_id, "event_type": event, "text": _event_text(event, rank),
+                  "created_at": created_at or local_now()}
+        result = db.execute(
+            text("INSERT INTO narrative_events (user_id, event_type, text, created_at) "
+                 "VALUES (:user_id, :event_type, :text, :created_at)"),
+            params,
+        )
+        feed.stage(db, user_id, feed.narrative_entry(result.lastrowid, event, params["text"], params["created_at"]))
+
+def close_span(rank, hearts, first, last, active_days):
+    # Close every day from first to last inclusive. active_days are the sorted days in
+    # that span with a completion; each run of them and each idle gap between runs is one
+    # close_days call. Events come back with the first day of the segment that raised them.
+    events = []
+    day = first
+    runs = []
+    for active_day in active_days:
+        if runs and active_day == runs[-1][1] + timedelta(days=1):
+            runs[-1][1] = active_day
+        else:
+            runs.append([active_day, active_day])
+    segments = []
+    for run_start, run_end in runs:
+        segments.append((False, day, run_start - timedelta(days=1)))
+        segments.append((True, run_start, run_end))
+        day = run_end + timedelta(days=1)
+    segments.append((False, day, last))
+    for active, start, end in segments:
+        count = (end - start).days + 1
+        if count > 0:
+            rank, hearts, new_events = close_days(rank, hearts, active, count)
+            events.extend((event, new_rank, start) for event, new_rank in new_events)
+    return rank, hearts, events
+
+def _active_days(db, user_id, first, before):
+    # Days with a completion from first (None for the start of history) up to, not
+    # including, before: a range scan on each log's (user_id, logged_at) index
+    rows = db.execute(text("""
+        SELECT date(logged_at) AS day FROM quest_logs
+        WHERE user_id = :user_id AND outcome = 'complete' AND logged_at >= :first AND logged_at < :before
+        UNION
+        SELECT date(logged_at) FROM task_logs
+        WHERE user_id = :user_id AND outcome = 'complete' AND logged_at >= :first AND logged_at < :before
+        ORDER BY day
+    """), {"user_id": user_id, "first": first.isoformat() if first else "", "before": before.isoformat()})
+    return [date.fromisoformat(day) for day, in rows]
+
+def rollover(db, user, today):
+    # Close every day since the previous rollover, or since the first completion on the
+    # first rollover, the same span rebuild replays. Only the days in that span are read,
+    # so a daily rollover reads one day of logs.
+    if user.last_rollover == today.isoformat():
+        return []
+
+    first = date.fromisoformat(user.last_rollover) if user.last_rollover else None
+    last = today - timedelta(days=1)
+    active_days = _active_days(db, user.id, first, today)
+    if first is None:
+        first = active_days[0] if active_days else last
+
+    rank, hearts, events = close_span(user.guild_rank, user.guild_streak, first, last, active_days)
+    events = [(event, new_rank) for event, new_rank, _ in events]
+    user.guild_rank = rank
+    user.guild_streak = hearts
+    user.last_rollover = today.isoformat()
+    _add_narrative(db, user.id, events)
+    return events
+
+class _Replay:
+    # Per-user state while streaming history in (user_id, day) order
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.rank, self.hearts = GUILD_RANKS[0], 0
+        self.run, self.last_day = 0, None
+        self.days = []
+        self.quest_streaks = {}
+        self.narrative = []
+
+    def activity(self, day, quest_id):
+        if self.last_day != day:
+            if self.last_day is not None and (day - self.last_day).days == 1:
+                self.run += 1
+            else:
+                self.run = 1
+            self.last_day = day
+            self.days.append(day)
+        if quest_id is not None:
+            count, last = self.quest_streaks.get(quest_id, (0, None))
+            if last != day:
+                count = count + 1 if last == day - timedelta(days=1) else 1
+            self.quest_streaks[quest_id] = (count, day)
+
+    def finish(self, close_until):
+        # The days live rollovers have closed, in one span
+        days = [day for day in self.days if day < close_until]
+        if not days:
+            return
+        self.rank, self.hearts, events = close_span(self.rank, self.hearts, days[0],
+                                                    close_until - timedelta(days=1), days)
+        # Rollover for the closed day happens the morning after
+        self.narrative = [(event, rank, (day + timedelta(days=1)).isoformat()) for event, rank, day in events]
+
+def rebuild(conn):
+    # Recompute check-ins, quest streaks, guild ranks and promotion/demotion events from
+    # task_logs and quest_logs in one pass ordered by (user, day). Only one user's state
+    # (at most their list of active days) is held at a time.
+
+    # Days before a user's last rollover have been closed; a user who never rolled over has none
+    last_rollovers = {
+        row.id: date.fromisoformat(row.last_rollover) if row.last_rollover else date.min
+        for row in conn.execute(text("SELECT id, last_rollover FROM users"))
+    }
+
+    conn.execute(text("DELETE FROM daily_checkins"))
+    conn.execute(text("DELETE FROM streaks"))
+    conn.execute(text("DELETE FROM narrative_events WHERE event_type IN ('promotion', 'demotion')"))
+    conn.execute(text("UPDATE users SET guild_rank = :rank, guild_streak = 0"), {"rank": GUILD_RANKS[0]})
+
+    history = conn.execute(text("""
+        SELECT user_id, quest_id, day FROM (
+            SELECT user_id, quest_id, date(logged_at) AS day FROM quest_logs WHERE outcome = 'complete'
+            UNION ALL
+            SELECT user_id, NULL, date(logged_at) FROM task_logs WHERE outcome = 'complete'
+        ) ORDER BY user_id, day
+    """))
+
+    users = 0
+    state = None
+    for user_id, quest_id, day in history:
+        if state is None or state.user_id != user_id:
+            if state is not None:
+                _flush(conn, state, last_rollovers.get(state.user_id, date.min))
+                users += 1
+            state = _Replay(user_id)
+        state.activity(date.fromisoformat(day), quest_id)
+    if state is not None:
+        _flush(conn, state, last_rollovers.get(state.user_id, date.min))
+        users += 1
+    return users
+
+def _flush(conn, state, close_until):
+    state.finish(close_until)
+    conn.execute(
+        text("UPDATE users SET guild_rank = :rank, guild_streak = :hearts WHERE id = :user_id"),
+        {"rank": state.rank, "hearts": state.hearts, "user_id": state.user_id},
+    )
+    conn.execute(
+        text("INSERT INTO daily_checkins (user_id, current_run, last_day) VALUES (:user_id, :run, :day)"),
+        {"user_id": state.user_id, "run": state.run, "day": state.last_day.isoformat()},
+    )
+    if state.quest_streaks:
+        conn.execute(
+            text("INSERT INTO streaks (user_id, quest_id, count, last_day) VALUES (:user_id, :quest_id, :count, :day)"),
+            [{"user_id": state.user_id, "quest_id": quest_id, "count": count, "day": day.isoformat()}
+             for quest_id, (count, day) in state.quest_streaks.items()],
+        )
+    for event, rank, when in state.narrative:
+        _add_narrative(conn, state.user_id, [(event, rank)], when)
+
+if __name__ == "__main__":
+    import sys
+    from db import user_engines
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python guild.py rebuild")
+        sys.exit(1)
+    for engine in user_engines():
+        with engine.begin() as conn:
+            print(f"Rebuilt guild ranks and streaks for {rebuild(conn)} users")
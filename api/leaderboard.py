@@ -0,0 +1,176 @@
+import threading
+from bisect import bisect_left, insort
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
+from sqlalchemy import text
+from sessions import require_user
+
+router = APIRouter(prefix="/api", tags=["leaderboard"])
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    display_name: str
+    level: int
+    xp: int
+    guild_rank: str
+
+class RankOut(BaseModel):
+    rank: int
+    total: int
+
+class UserRanksOut(BaseModel):
+    user_id: int
+    global_rank: RankOut
+    guild_rank: str
+    guild: RankOut
+
+class Ranking:
+    # Sorted array of (-level, -xp, user_id): position + 1 is the rank, so rank lookups
+    # are a bisect (O(log N)) and top-K / neighbourhood reads are slices
+    def __init__(self):
+        self.keys = []
+
+    def add(self, key):
+        insort(self.keys, key)
+
+    def remove(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def rank(self, key):
+        return bisect_left(self.keys, key) + 1
+
+    def slice(self, start, stop):
+        return self.keys[max(start, 0):stop]
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.global_ranking = Ranking()
+        self.guilds = {}
+        # user_id -> (display_name, level, xp, guild_rank)
+        self.users = {}
+
+    @staticmethod
+    def _key(user_id, level, xp):
+        return (-level, -xp, user_id)
+
+    def rebuild(self, *dbs):
+        # One db per shard when users are sharded
+        users = {}
+        guild_keys = {}
+        global_keys = []
+        for db in dbs:
+            for user_id, display_name, level, xp, guild_rank in db.execute(
+                text("SELECT id, display_name, level, xp, guild_rank FROM users")
+            ):
+                key = self._key(user_id, level, xp)
+                users[user_id] = (display_name, level, xp, guild_rank)
+                global_keys.append(key)
+                guild_keys.setdefault(guild_rank, []).append(key)
+
+        # One sort per ranking instead of N inserts
+        global_ranking = Ranking()
+        global_ranking.keys = sorted(global_keys)
+        guilds = {}
+        for guild_rank, keys in guild_keys.items():
+            guilds[guild_rank] = Ranking()
+            guilds[guild_rank].keys = sorted(keys)
+
+        with self._lock:
+            self.users = users
+            self.global_ranking = global_ranking
+            self.guilds = guilds
+
+    # Called from the write paths after a commit that may move a player
+    def update(self, user_id, display_name, level, xp, guild_rank):
+        key = self._key(user_id, level, xp)
+        with self._lock:
+            old = self.users.get(user_id)
+            if old is not None:
+                old_key = self._key(user_id, old[1], old[2])
+                self.global_ranking.remove(old_key)
+                self.guilds[old[3]].remove(old_key)
+            self.users[user_id] = (display_name, level, xp, guild_rank)
+            self.global_ranking.add(key)
+            self.guilds.setdefault(guild_rank, Ranking()).add(key)
+
+    def update_user(self, user):
+        self.update(user.id, user.display_name, user.level, user.xp, user.guild_rank)
+
+    def _entries(self, keys, first_rank):
+        out = []
+        for offset, key in enumerate(keys):
+            user_id = key[2]
+            display_name, level, xp, guild_rank = self.users[user_id]
+            out.append({
+                "rank": first_rank + offset,
+                "user_id": user_id,
+                "display_name": display_name,
+                "level": level,
+                "xp": xp,
+                "guild_rank": guild_rank,
+            })
+        return out
+
+    def _ranking(self, guild_rank):
+        if guild_rank is None:
+            return self.global_ranking
+        return self.guilds.get(guild_rank, Ranking())
+
+    def top(self, limit, guild_rank=None):
+        with self._lock:
+            return self._entries(self._ranking(guild_rank).slice(0, limit), 1)
+
+    def ranks(self, user_id):
+        with self._lock:
+            info = self.users.get(user_id)
+            if info is None:
+                return None
+            key = self._key(user_id, info[1], info[2])
+            guild = self.guilds[info[3]]
+            return {
+                "user_id": user_id,
+                "global_rank": {"rank": self.global_ranking.rank(key), "total": len(self.global_ranking.keys)},
+                "guild_rank": info[3],
+                "guild": {"rank": guild.rank(key), "total": len(guild.keys)},
+            }
+
+    def around(self, user_id, radius, in_guild=False):
+        with self._lock:
+            info = self.users.get(user_id)
+            if info is None:
+                return None
+            ranking = self.guilds[info[3]] if in_guild else self.global_ranking
+            rank = ranking.rank(self._key(user_id, info[1], info[2]))
+            start = max(rank - 1 - radius, 0)
+            return self._entries(ranking.slice(start, rank + radius), start + 1)
+
+leaderboard = Leaderboard()
+
+MAX_LIMIT = 100
+
+@router.get("/leaderboard", response_model=list[LeaderboardEntry])
+def global_leaderboard(limit: int = 10):
+    return leaderboard.top(min(max(limit, 1), MAX_LIMIT))
+
+@router.get("/leaderboard/guilds/{guild_rank}", response_model=list[LeaderboardEntry])
+def guild_leaderboard(guild_rank: str, limit: int = 10):
+    return leaderboard.top(min(max(limit, 1), MAX_LIMIT), guild_rank)
+
+@router.get("/users/{user_id}/rank", response_model=UserRanksOut, dependencies=[Depends(require_user)])
+def user_rank(user_id: int):
+    ranks = leaderboard.ranks(user_id)
+    if ranks is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return ranks
+
+# Players just above and below the user; guild=true limits it to the user's guild
+@router.get("/users/{user_id}/leaderboard", response_model=list[LeaderboardEntry], dependencies=[Depends(require_user)])
+def around_user(user_id: int, radius: int = 5, guild: bool = False):
+    entries = leaderboard.around(user_id, min(max(radius, 0), MAX_LIMIT), guild)
+    if entries is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return entries
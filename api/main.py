@@ -1,6 +1,7 @@
 # from cs4700 folder: python -m PyInstaller --add-data "db/questify.db;db" --onefile api/main.py --distpath ap
 
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -8,10 +9,50 @@ from dotenv import load_dotenv
 from auth import router as auth_router
 from tasks import router as tasks_router
 from economy import router as economy_router
+from quests import router as quests_router
+from stats import router as stats_router
+from focus import router as focus_router
+from shop import router as shop_router
+from achievements import router as achievements_router
+from sync import router as sync_router
+from transfer import router as transfer_router
+from recurrence import router as calendar_router
+from bootstrap import router as bootstrap_router
+from feed import router as feed_router
+from admission import AdmissionMiddleware, ADMISSION_ENABLED
+from metrics import router as metrics_router, MetricsMiddleware, METRICS_ENABLED, install_db_hooks
+from profiling import router as admin_router, ProfilingMiddleware, install_slow_query_log, track_threads
+from leaderboard import router as leaderboard_router, leaderboard
+from maintenance import router as maintenance_router, scheduler, MAINTENANCE_ENABLED
+from reminders import router as reminders_router, reminders, REMINDERS_ENABLED
+from db import all_engines, user_engines, shard_router, init_schema
 
 load_dotenv()
 
-API = FastAPI(title="Questify API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app):
+    init_schema()
+    shard_router.load()
+    conns = [e.connect() for e in user_engines()]
+    try:
+        leaderboard.rebuild(*conns)
+    finally:
+        for conn in conns:
+            conn.close()
+    if MAINTENANCE_ENABLED:
+        scheduler.start(all_engines())
+    if REMINDERS_ENABLED:
+        reminders.start()
+    yield
+    reminders.stop()
+    scheduler.stop()
+
+API = FastAPI(title="Questify API", version="0.1.0", lifespan=lifespan)
+
+# Added before CORS so it runs inside it: preflights never count against a bucket, and
+# 429s still carry the CORS headers the browser needs to read Retry-After
+if ADMISSION_ENABLED:
+    API.add_middleware(AdmissionMiddleware)
 
 API.add_middleware(
     CORSMiddleware,
@@ -20,8 +61,18 @@ API.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+API.add_middleware(ProfilingMiddleware)
+for db_engine in all_engines():
+    install_slow_query_log(db_engine)
+
+if METRICS_ENABLED:
+    API.add_middleware(MetricsMiddleware)
+    for db_engine in all_engines():
+        install_db_hooks(db_engine)
+
 @API.get("/api/health")
 def health():
     return {"ok": True}
@@ -29,6 +80,25 @@ def health():
 API.include_router(auth_router)
 API.include_router(tasks_router)
 API.include_router(economy_router)
+API.include_router(quests_router)
+API.include_router(stats_router)
+API.include_router(focus_router)
+API.include_router(shop_router)
+API.include_router(achievements_router)
+API.include_router(sync_router)
+API.include_router(transfer_router)
+API.include_router(calendar_router)
+API.include_router(bootstrap_router)
+API.include_router(feed_router)
+API.include_router(leaderboard_router)
+API.include_router(admin_router)
+API.include_router(maintenance_router)
+API.include_router(reminders_router)
+
+if METRICS_ENABLED:
+    API.include_router(metrics_router)
+
+track_threads(API)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,257 @@
+import os
+import re
+import time
+import logging
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy import event
+from db import database_files, get_data_dir
+from profiling import require_admin
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+logger = logging.getLogger("questify.maintenance")
+
+# Set MAINTENANCE_ENABLED=0 to keep the scheduler thread from starting (the admin route
+# and the command line still work)
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "1") != "0"
+# The database counts as quiet once nothing has committed for this long
+QUIET_SECONDS = float(os.getenv("MAINTENANCE_QUIET_SECONDS", "30"))
+TICK_SECONDS = 5
+# Work done by one run of an incremental job; a job with work left runs again next tick
+FTS_MERGE_PAGES = 500
+VACUUM_PAGES = 1000
+# A WAL file left bigger than this is truncated once every frame is checkpointed
+WAL_TRUNCATE_BYTES = 16 * 1024 * 1024
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(get_data_dir(), "backups"))
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL_HOURS", "24")) * 3600
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# Pages copied per backup step, and the pause between steps that lets other work run
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP_MS", "5")) / 1000
+
+def _connect(path):
+    # Own autocommit connection, outside the pool, so a job controls its transactions
+    return sqlite3.connect(path, timeout=5, isolation_level=None)
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# Every job runs once per database file (the directory and each shard when users are
+# sharded) and returns (bytes, detail); what the bytes measure is the job's own unit of work
+
+def analyze(conn, path):
+    # analysis_limit bounds the rows sampled per index, so a big ledger costs about as much
+    # as a small one; the planner only needs rough row counts and selectivity
+    conn.execute("PRAGMA analysis_limit=400")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    stats_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(stat)), 0) FROM sqlite_stat1").fetchone()[0]
+    return stats_bytes, {"tables": conn.execute("SELECT COUNT(DISTINCT tbl) FROM sqlite_stat1").fetchone()[0]}
+
+def fts_merge(conn, path):
+    # One bounded step of merging quest_search's b-tree segments towards a single one (a
+    # negative page count merges even below the automerge threshold, like an incremental
+    # 'optimize'). FTS5 reports a merge with nothing left to do as fewer than two changes.
+    before = conn.execute("SELECT COALESCE(SUM(LENGTH(block)), 0) FROM quest_search_data").fetchone()[0]
+    changes = conn.total_changes
+    conn.execute("INSERT INTO quest_search(quest_search, rank) VALUES('merge', ?)", (-FTS_MERGE_PAGES,))
+    more = conn.total_changes - changes >= 2
+    after = conn.execute("SELECT COALESCE(SUM(LENGTH(block)), 0) FROM quest_search_data").fetchone()[0]
+    return before - after, {"index_bytes": after, "more": more}
+
+def wal_checkpoint(conn, path):
+    # PASSIVE never waits on readers or writers. The WAL file only shrinks when every
+    # frame made it into the database, and then TRUNCATE has nothing left to copy.
+    page_size = _pragma(conn, "page_size")
+    wal_path = path + "-wal"
+    busy, frames, copied = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    if frames >= 0 and copied == frames and _file_size(wal_path) > WAL_TRUNCATE_BYTES:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return max(copied, 0) * page_size, {"frames": frames, "wal_bytes": _file_size(wal_path)}
+
+def incremental_vacuum(conn, path):
+    page_size = _pragma(conn, "page_size")
+    free = _pragma(conn, "freelist_count")
+    if _pragma(conn, "auto_vacuum") != 2:
+        # Existing files need one offline VACUUM to switch modes
+        return 0, {"free_bytes": free * page_size, "skipped": "auto_vacuum is not INCREMENTAL, "
+                   "run `python maintenance.py enable-incremental-vacuum` with the app stopped"}
+    # execute() steps the pragma once, which frees a single page; executescript runs it out
+    conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+    left = _pragma(conn, "freelist_count")
+    return (free - left) * page_size, {"free_bytes": left * page_size, "more": left > 0}
+
+def backup(conn, path, dest_dir=None):
+    # Copy the database through the online backup API a few pages at a time. The read
+    # transaction pins one WAL snapshot for the whole copy, so writers carry on and the
+    # backup never restarts because of them. Written to a .part file and renamed, so a
+    # crash never leaves a truncated backup that looks complete. Shards are copied one after
+    # another, each from its own snapshot; a user's rows never span two files.
+    dest_dir = dest_dir or BACKUP_DIR
+    os.makedirs(dest_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    path = os.path.join(dest_dir, f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.db")
+    part = path + ".part"
+    steps = [0]
+
+    def progress(status, remaining, total):
+        steps[0] += 1
+
+    target = sqlite3.connect(part)
+    try:
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        conn.backup(target, pages=BACKUP_STEP_PAGES, progress=progress, sleep=BACKUP_STEP_SLEEP)
+        conn.execute("COMMIT")
+    except BaseException:
+        target.close()
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    target.close()
+    os.replace(part, path)
+
+    backups = sorted(name for name in os.listdir(dest_dir) if re.fullmatch(rf"{stem}-\d{{8}}-\d{{6}}\.db", name))
+    for name in backups[:-BACKUP_KEEP]:
+        os.remove(os.path.join(dest_dir, name))
+    return _file_size(path), {"path": path, "steps": steps[0]}
+
+# name -> (job, seconds between runs)
+JOBS = {
+    "wal_checkpoint": (wal_checkpoint, 60),
+    "fts_merge": (fts_merge, 600),
+    "incremental_vacuum": (incremental_vacuum, 3600),
+    "analyze": (analyze, 6 * 3600),
+    "backup": (backup, BACKUP_INTERVAL),
+}
+
+class Scheduler:
+    # A daemon thread that runs one due job per tick, and only while the database is
+    # quiet, so maintenance never competes with players for the write lock. Incremental
+    # jobs that report more work stay due until they finish.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_write = time.monotonic()
+        self.last_run = {name: None for name in JOBS}
+        self.history = deque(maxlen=100)
+
+    def on_commit(self, conn):
+        self.last_write = time.monotonic()
+
+    def quiet(self):
+        return time.monotonic() - self.last_write >= QUIET_SECONDS
+
+    def due(self, name, now):
+        last = self.last_run[name]
+        return last is None or now - last >= JOBS[name][1]
+
+    def run(self, name):
+        job = JOBS[name][0]
+        with self._lock:
+            start = time.perf_counter()
+            size, details = 0, {}
+            for path in database_files():
+                conn = _connect(path)
+                try:
+                    file_bytes, details[os.path.basename(path)] = job(conn, path)
+                finally:
+                    conn.close()
+                size += file_bytes
+            result = {"job": name, "at": datetime.now().isoformat(sep=" ", timespec="seconds"),
+                      "seconds": round(time.perf_counter() - start, 4), "bytes": size, "files": details}
+            more = any(detail.get("more") for detail in details.values())
+            self.last_run[name] = None if more else time.monotonic()
+            self.history.append(result)
+        logger.info("%s took %.3fs, %d bytes %s", name, result["seconds"], size, details)
+        return result
+
+    def _loop(self):
+        while not self._stop.wait(TICK_SECONDS):
+            if not self.quiet():
+                continue
+            now = time.monotonic()
+            # The most overdue job first; never-run jobs count as most overdue
+            due = [name for name in JOBS if self.due(name, now)]
+            if not due:
+                continue
+            name = max(due, key=lambda n: float("inf") if self.last_run[n] is None else now - self.last_run[n])
+            try:
+                self.run(name)
+            except Exception:
+                logger.exception("maintenance job %s failed", name)
+                self.last_run[name] = now
+
+    def start(self, engines):
+        for engine in engines:
+            event.listen(engine, "commit", self.on_commit)
+        # Nothing runs right after startup: the first runs wait for their interval
+        now = time.monotonic()
+        self.last_run = {name: now for name in JOBS}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+scheduler = Scheduler()
+
+@router.get("/maintenance", dependencies=[Depends(require_admin)])
+def maintenance_status():
+    now = time.monotonic()
+    return {
+        "quiet": scheduler.quiet(),
+        "idle_seconds": round(now - scheduler.last_write, 1),
+        "jobs": {name: {"interval_seconds": interval,
+                        "due": scheduler.due(name, now)}
+                 for name, (_, interval) in JOBS.items()},
+        "history": list(scheduler.history),
+    }
+
+# Run a job now, whether or not the database is quiet
+@router.post("/maintenance/{job}", dependencies=[Depends(require_admin)])
+def run_maintenance(job: str):
+    if job not in JOBS:
+        raise HTTPException(status_code=404, detail=f"Unknown job, expected one of: {', '.join(JOBS)}")
+    return scheduler.run(job)
+
+if __name__ == "__main__":
+    import sys
+
+    args = sys.argv[1:]
+    if args[:1] == ["enable-incremental-vacuum"] and len(args) == 1:
+        # VACUUM rewrites the whole file and blocks everyone while it does; app stopped
+        for path in database_files():
+            conn = _connect(path)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            print(f"{path}: auto_vacuum = {_pragma(conn, 'auto_vacuum')}")
+            conn.close()
+    elif args[:1] == ["backup"] and len(args) <= 2:
+        for path in database_files():
+            conn = _connect(path)
+            size, detail = backup(conn, path, args[1] if len(args) == 2 else None)
+            conn.close()
+            print(f"Backed up {size} bytes to {detail['path']}")
+    elif args[:1] == ["run"] and len(args) == 2 and args[1] in JOBS:
+        print(scheduler.run(args[1]))
+    else:
+        print("usage: python maintenance.py run <job> | backup [dir] | enable-incremental-vacuum")
+        print(f"jobs: {', '.join(JOBS)}")
+        sys.exit(1)
@@ -0,0 +1,203 @@
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+# Set METRICS_ENABLED=0 to skip the middleware, the engine hooks and the endpoint entirely
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+router = APIRouter(prefix="/api", tags=["metrics"])
+
+# [query count, seconds in SQL] for the request currently being served
+_request_db = ContextVar("request_db", default=None)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # one slot per bucket plus +Inf, allocated once so observe() never grows anything
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Plain int/float bumps under the GIL: a lost increment under a race is fine for metrics
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class RouteStats:
+    __slots__ = ("latency", "db_queries", "db_seconds")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.db_queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_seconds = Histogram(LATENCY_BUCKETS)
+
+# (method, route template, status) -> RouteStats
+_routes = {}
+# (host, status) -> Histogram
+_outbound = {}
+# (route class, decision) -> count
+_admission = {}
+# name -> (help text, function returning the current value)
+_gauges = {}
+
+def observe_request(method, route, status, seconds, db_queries, db_seconds):
+    key = (method, route, status)
+    stats = _routes.get(key)
+    if stats is None:
+        stats = _routes.setdefault(key, RouteStats())
+    stats.latency.observe(seconds)
+    stats.db_queries.observe(db_queries)
+    stats.db_seconds.observe(db_seconds)
+
+def observe_outbound(host, status, seconds):
+    key = (host, status)
+    hist = _outbound.get(key)
+    if hist is None:
+        hist = _outbound.setdefault(key, Histogram(LATENCY_BUCKETS))
+    hist.observe(seconds)
+
+def observe_admission(route_class, decision):
+    key = (route_class, decision)
+    _admission[key] = _admission.get(key, 0) + 1
+
+def gauge(name, help_text, fn):
+    # Values sampled at scrape time, for state another module already keeps
+    _gauges[name] = (help_text, fn)
+
+class MetricsMiddleware:
+    # Pure ASGI so timing wraps the whole stack without BaseHTTPMiddleware's extra task
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        db = [0, 0.0]
+        token = _request_db.set(db)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db.reset(token)
+            # Label by route template, never the raw path, so user ids don't explode the series
+            route = getattr(scope.get("route"), "path_format", None) or "<unmatched>"
+            observe_request(scope["method"], route, status[0], elapsed, db[0], db[1])
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    db = _request_db.get()
+    if db is not None:
+        db[0] += 1
+        db[1] += elapsed
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute, so drop its start time here
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+def install_db_hooks(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+def _outbound_request(request):
+    request.extensions["metrics_start"] = time.perf_counter()
+
+def _outbound_response(response):
+    start = response.request.extensions.get("metrics_start")
+    if start is not None:
+        observe_outbound(response.request.url.host, response.status_code, time.perf_counter() - start)
+
+async def _outbound_request_async(request):
+    _outbound_request(request)
+
+async def _outbound_response_async(response):
+    _outbound_response(response)
+
+# Pass as httpx.AsyncClient(event_hooks=outbound_hooks()) to time calls to external APIs,
+# or httpx.Client(event_hooks=outbound_hooks(sync=True))
+def outbound_hooks(sync=False):
+    if not METRICS_ENABLED:
+        return {}
+    if sync:
+        return {"request": [_outbound_request], "response": [_outbound_response]}
+    return {"request": [_outbound_request_async], "response": [_outbound_response_async]}
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels):
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+def _render_histogram(lines, name, labels, hist):
+    cumulative = 0
+    for bound, count in zip(hist.bounds, hist.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+    lines.append(f"{name}_sum{{{labels}}} {hist.sum}")
+    lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+def render_metrics():
+    lines = []
+    # list() snapshots the dicts so a new series added mid-render can't break iteration
+    routes = list(_routes.items())
+    outbound = list(_outbound.items())
+
+    series = (
+        ("questify_http_request_duration_seconds", "Request latency by route and status", "latency"),
+        ("questify_db_queries_per_request", "SQL statements executed per request", "db_queries"),
+        ("questify_db_seconds_per_request", "Time spent in SQL per request", "db_seconds"),
+    )
+    for name, help_text, attr in series:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for (method, route, status), stats in routes:
+            _render_histogram(lines, name, _labels(method=method, route=route, status=status), getattr(stats, attr))
+
+    name = "questify_http_outbound_duration_seconds"
+    lines.append(f"# HELP {name} Outbound HTTP call latency by host and status")
+    lines.append(f"# TYPE {name} histogram")
+    for (host, status), hist in outbound:
+        _render_histogram(lines, name, _labels(host=host, status=status), hist)
+
+    name = "questify_admission_decisions_total"
+    lines.append(f"# HELP {name} Admission decisions by route class (allowed, limited, shed, timeout)")
+    lines.append(f"# TYPE {name} counter")
+    for (route_class, decision), count in list(_admission.items()):
+        lines.append(f"{name}{{{_labels(route_class=route_class, decision=decision)}}} {count}")
+
+    for name, (help_text, fn) in list(_gauges.items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {fn()}")
+
+    return "\n".join(lines) + "\n"
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,301 @@
+import os
+import sys
+import time
+import hmac
+import inspect
+import logging
+import functools
+import threading
+from collections import Counter, deque
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import event
+from db import get_data_dir
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+logger = logging.getLogger("questify.slow_query")
+
+# Profiling and the admin routes stay off unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_HEADER = b"x-questify-profile"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(get_data_dir(), "profiles"))
+PROFILE_SLOTS = int(os.getenv("PROFILE_SLOTS", "50"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+# Statements slower than this are logged; SLOW_QUERY_MS=0 disables the log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+_API_DIR = str(Path(__file__).resolve().parent)
+
+# ASGI scope of the request being served, so the slow-query log can name the route
+_current_scope = ContextVar("current_scope", default=None)
+# Sampler of the request being profiled; the context follows the request into the
+# threadpool, so a sync endpoint can add the worker it runs on (see track_threads)
+_current_sampler = ContextVar("current_sampler", default=None)
+
+def _is_admin(token):
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def _route_of(scope):
+    if scope is None:
+        return None
+    return getattr(scope.get("route"), "path_format", None) or scope.get("path")
+
+class Sampler(threading.Thread):
+    # Wall-clock stack sampler for one request: every interval, walk the frames of the
+    # threads working on it and count the stacks that pass through our own code, in
+    # collapsed "a;b;c N" form. The event loop thread runs every request's coroutines, so
+    # there a stack only counts if it passes through this request's `root` frame.
+    def __init__(self, interval, loop_thread, root):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.loop_thread = loop_thread
+        self.root = root
+        self.threads = {loop_thread}
+        self.counts = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in tuple(self.threads):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self._sample(frame, thread_id == self.loop_thread)
+
+    def _sample(self, frame, need_root):
+        stack = []
+        in_app = False
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename.startswith(_API_DIR):
+                in_app = True
+            if frame is self.root:
+                need_root = False
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if in_app and not need_root:
+            stack.reverse()
+            self.counts[";".join(stack)] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+class ProfileStore:
+    # Ring buffer of the last `slots` profiles on disk, one collapsed-stack file each
+    def __init__(self, directory, slots):
+        self.directory = directory
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._seq = None
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"profile_{profile_id}.folded")
+
+    def ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        ids = []
+        for name in os.listdir(self.directory):
+            if name.startswith("profile_") and name.endswith(".folded"):
+                try:
+                    ids.append(int(name[len("profile_"):-len(".folded")]))
+                except ValueError:
+                    pass
+        return sorted(ids)
+
+    def next_id(self):
+        with self._lock:
+            if self._seq is None:
+                existing = self.ids()
+                self._seq = existing[-1] if existing else 0
+            self._seq += 1
+            return self._seq
+
+    def write(self, profile_id, text):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(profile_id) + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self._path(profile_id))
+        for old in self.ids():
+            if old <= profile_id - self.slots:
+                try:
+                    os.remove(self._path(old))
+                except FileNotFoundError:
+                    pass
+
+    def read(self, profile_id):
+        try:
+            with open(self._path(profile_id)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+profiles = ProfileStore(PROFILE_DIR, PROFILE_SLOTS)
+
+def _tracked(call):
+    @functools.wraps(call)
+    def run(**values):
+        sampler = _current_sampler.get()
+        if sampler is None:
+            return call(**values)
+        thread_id = threading.get_ident()
+        sampler.threads.add(thread_id)
+        try:
+            return call(**values)
+        finally:
+            sampler.threads.discard(thread_id)
+    return run
+
+def track_threads(app):
+    # Sync endpoints run on threadpool workers, which a profile can't tell apart from
+    # the workers serving other requests; wrapped, each adds itself to its request's
+    # sampler for as long as it runs. FastAPI chose sync or async when the route was
+    # built, so swapping the callable keeps the route on the threadpool.
+    if not ADMIN_TOKEN:
+        return
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not inspect.iscoroutinefunction(route.dependant.call):
+            route.dependant.call = _tracked(route.dependant.call)
+
+def _finish(sampler, profile_id):
+    sampler.stop()
+    profiles.write(profile_id, sampler.collapsed())
+
+# Requests left to profile after an admin armed it through POST /api/admin/profiling
+_armed = {"remaining": 0, "path_prefix": None}
+
+def _take_armed(path):
+    prefix = _armed["path_prefix"]
+    if _armed["remaining"] <= 0 or (prefix and not path.startswith(prefix)):
+        return False
+    _armed["remaining"] -= 1
+    return True
+
+def _wants_profile(scope):
+    if not ADMIN_TOKEN:
+        return False
+    if scope["path"].startswith(router.prefix):
+        return False
+    headers = dict(scope["headers"])
+    if PROFILE_HEADER in headers and _is_admin(headers.get(b"x-admin-token", b"").decode("latin-1")):
+        return True
+    return _take_armed(scope["path"])
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _current_scope.set(scope)
+        try:
+            if not _wants_profile(scope):
+                await self.app(scope, receive, send)
+                return
+
+            profile_id = profiles.next_id()
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-questify-profile-id", str(profile_id).encode())]
+                await send(message)
+
+            sampler = Sampler(PROFILE_INTERVAL, threading.get_ident(), sys._getframe())
+            sampler_token = _current_sampler.set(sampler)
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                _current_sampler.reset(sampler_token)
+                await run_in_threadpool(_finish, sampler, profile_id)
+        finally:
+            _current_scope.reset(token)
+
+# Keep the most recent slow statements around for the admin endpoint as well as the log
+slow_queries = deque(maxlen=200)
+
+def _redact(parameters):
+    # Only the shape of the parameters is kept: values may hold emails or password hashes
+    if parameters is None:
+        return []
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if parameters and isinstance(parameters[0], (list, tuple, dict)):
+        return f"<{len(parameters)} parameter sets>"
+    return [type(v).__name__ for v in parameters]
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["slow_query_start"].pop()) * 1000
+    if elapsed_ms < SLOW_QUERY_MS:
+        return
+    entry = {
+        "at": time.time(),
+        "ms": round(elapsed_ms, 2),
+        "route": _route_of(_current_scope.get()),
+        "statement": " ".join(statement.split()),
+        "parameters": _redact(parameters),
+    }
+    slow_queries.append(entry)
+    logger.warning("slow query %.1fms route=%s sql=%s params=%s",
+                   elapsed_ms, entry["route"], entry["statement"], entry["parameters"])
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("slow_query_start"):
+        conn.info["slow_query_start"].pop()
+
+def install_slow_query_log(engine):
+    if SLOW_QUERY_MS <= 0:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+class ProfilingArm(BaseModel):
+    requests: int = 1
+    path_prefix: Optional[str] = None
+
+# Profile the next N requests (optionally only under a path prefix) without a special header
+@router.post("/profiling", dependencies=[Depends(require_admin)])
+def arm_profiling(item: ProfilingArm):
+    _armed["remaining"] = max(item.requests, 0)
+    _armed["path_prefix"] = item.path_prefix
+    return dict(_armed)
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    return {"profiles": profiles.ids()}
+
+# Collapsed stacks, loadable by flamegraph.pl or speedscope
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+def get_profile(profile_id: int):
+    text = profiles.read(profile_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(text)
+
+@router.get("/slow-queries", dependencies=[Depends(require_admin)])
+def list_slow_queries():
+    return list(slow_queries)
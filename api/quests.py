@@ -1,14 +1,26 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from typing import Optional, List
-from .db import get_conn
+from typing import Optional, Literal
+from datetime import date
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+import orjson
+from db import get_user_db, local_now
+from sessions import require_user
+from serialize import json_response
+import guild
+import achievements
+import stats
+import recurrence
+import reminders
+import feed
 
-router = APIRouter(prefix="/api", tags=["quests"])
+router = APIRouter(prefix="/api", tags=["quests"], dependencies=[Depends(require_user)])
 
 class QuestIn(BaseModel):
     title: str
-    type: str = "todo"         # 'habit' | 'daily' | 'todo'
-    rank: str = "E"            # 'E','D','C','B','A','S'
+    type: Literal["habit", "daily", "todo"] = "todo"
+    rank: Literal["E", "D", "C", "B", "A", "S"] = "E"
     notes: Optional[str] = None
     tags: str = "[]"
     due_at: Optional[str] = None
@@ -16,33 +28,142 @@ class QuestIn(BaseModel):
     difficulty: int = 2
     is_negative: int = 0
 
+class QuestLogIn(BaseModel):
+    outcome: Literal["complete", "fail", "negative"] = "complete"
+    xp_delta: int = 0
+    gold_delta: int = 0
+    hp_delta: int = 0
+
+MAX_RECENT_LOGS = 50
+
+# Quests with their subquests, streak and most recent logs in ONE statement, however many
+# quests there are: the children are folded into JSON arrays by correlated subqueries that
+# seek idx_subquests_quest / idx_quest_logs_quest_time, and the streak is a join.
+_QUEST_DETAIL_SQL = """
+    SELECT q.*,
+           s.count AS streak_count, s.last_day AS streak_last_day,
+           (SELECT json_group_array(json_object('id', sq.id, 'title', sq.title, 'is_done', sq.is_done))
+            FROM (SELECT id, title, is_done FROM subquests WHERE quest_id = q.id ORDER BY id) AS sq)
+               AS subquests_json,
+           (SELECT json_group_array(json_object('id', l.id, 'logged_at', l.logged_at, 'outcome', l.outcome,
+                                                'xp_delta', l.xp_delta, 'gold_delta', l.gold_delta,
+                                                'hp_delta', l.hp_delta))
+            FROM (SELECT id, logged_at, outcome, xp_delta, gold_delta, hp_delta FROM quest_logs
+                  WHERE quest_id = q.id ORDER BY logged_at DESC, id DESC LIMIT :logs) AS l)
+               AS logs_json
+    FROM quests q
+    LEFT JOIN streaks s ON s.user_id = q.user_id AND s.quest_id = q.id
+    WHERE q.user_id = :user_id {where}
+    ORDER BY q.created_at DESC
+"""
+_LIST_SQL = text(_QUEST_DETAIL_SQL.format(where=""))
+_DETAIL_SQL = text(_QUEST_DETAIL_SQL.format(where="AND q.id = :quest_id"))
+
+def _nest(row):
+    quest = dict(row)
+    count = quest.pop("streak_count")
+    last_day = quest.pop("streak_last_day")
+    quest["streak"] = {"count": count, "last_day": last_day} if count is not None else None
+    quest["subquests"] = orjson.loads(quest.pop("subquests_json"))
+    quest["recent_logs"] = orjson.loads(quest.pop("logs_json"))
+    return quest
+
 @router.get("/users/{user_id}/quests")
-def list_quests(user_id: int):
-    with get_conn() as conn:
-        rows = conn.execute(
-            "SELECT * FROM quests WHERE user_id = ? ORDER BY created_at DESC",
-            (user_id,)
-        ).fetchall()
-        return [dict(r) for r in rows]
+def list_quests(user_id: int, logs: int = 5, db: Session = Depends(get_user_db)):
+    rows = db.execute(
+        _LIST_SQL, {"user_id": user_id, "logs": min(max(logs, 0), MAX_RECENT_LOGS)},
+    ).mappings().all()
+    return json_response([_nest(r) for r in rows])
+
+@router.get("/users/{user_id}/quests/{quest_id}")
+def get_quest(user_id: int, quest_id: int, logs: int = 20, db: Session = Depends(get_user_db)):
+    row = db.execute(
+        _DETAIL_SQL, {"user_id": user_id, "quest_id": quest_id, "logs": min(max(logs, 0), MAX_RECENT_LOGS)},
+    ).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Quest not found")
+    return json_response(_nest(row))
+
+def _check_rule(payload):
+    if payload.repeats_rule:
+        try:
+            recurrence.parse_rule(payload.repeats_rule)
+        except recurrence.InvalidRule as e:
+            raise HTTPException(status_code=400, detail=f"Invalid repeats_rule: {e}")
 
 @router.post("/users/{user_id}/quests", status_code=201)
-def create_quest(user_id: int, payload: QuestIn):
-    with get_conn() as conn:
-        # ensure user exists
-        exists = conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone()
-        if not exists:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        cur = conn.execute(
-            """
+def create_quest(user_id: int, payload: QuestIn, db: Session = Depends(get_user_db)):
+    _check_rule(payload)
+    # ensure user exists
+    exists = db.execute(text("SELECT 1 FROM users WHERE id = :id"), {"id": user_id}).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    result = db.execute(
+        text("""
             INSERT INTO quests (user_id, title, type, rank, notes, tags, due_at, repeats_rule,
                                 difficulty, is_negative)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (user_id, payload.title, payload.type, payload.rank, payload.notes, payload.tags,
-             payload.due_at, payload.repeats_rule, payload.difficulty, payload.is_negative)
+            VALUES (:user_id, :title, :type, :rank, :notes, :tags, :due_at, :repeats_rule,
+                    :difficulty, :is_negative)
+        """),
+        {"user_id": user_id, **payload.model_dump()},
+    )
+    quest_id = result.lastrowid
+    row = db.execute(text("SELECT * FROM quests WHERE id = :id"), {"id": quest_id}).mappings().one()
+    db.commit()
+    reminders.quest_changed(quest_id, user_id, row["due_at"], row["is_active"])
+    return dict(row)
+
+@router.put("/users/{user_id}/quests/{quest_id}")
+def update_quest(user_id: int, quest_id: int, payload: QuestIn, db: Session = Depends(get_user_db)):
+    _check_rule(payload)
+    result = db.execute(
+        text("""
+            UPDATE quests SET title = :title, type = :type, rank = :rank, notes = :notes, tags = :tags,
+                              due_at = :due_at, repeats_rule = :repeats_rule, difficulty = :difficulty,
+                              is_negative = :is_negative
+            WHERE id = :id AND user_id = :user_id
+        """),
+        {"id": quest_id, "user_id": user_id, **payload.model_dump()},
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Quest not found")
+    row = db.execute(text("SELECT * FROM quests WHERE id = :id"), {"id": quest_id}).mappings().one()
+    db.commit()
+    # Expanded occurrences were computed from the old rule
+    recurrence.cache.invalidate(quest_id)
+    reminders.quest_changed(quest_id, user_id, row["due_at"], row["is_active"])
+    return dict(row)
+
+# Log a quest outcome; completions also advance the quest's streak and the daily check-in
+@router.post("/users/{user_id}/quests/{quest_id}/logs", status_code=201)
+def log_quest(user_id: int, quest_id: int, payload: QuestLogIn, db: Session = Depends(get_user_db)):
+    exists = db.execute(
+        text("SELECT 1 FROM quests WHERE id = :id AND user_id = :user_id"),
+        {"id": quest_id, "user_id": user_id},
+    ).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Quest not found")
+
+    try:
+        result = db.execute(
+            text("""
+                INSERT INTO quest_logs (quest_id, user_id, logged_at, outcome, xp_delta, gold_delta, hp_delta)
+                VALUES (:quest_id, :user_id, :logged_at, :outcome, :xp_delta, :gold_delta, :hp_delta)
+            """),
+            {"quest_id": quest_id, "user_id": user_id, "logged_at": local_now(), **payload.model_dump()},
         )
-        quest_id = cur.lastrowid
-        row = conn.execute("SELECT * FROM quests WHERE id = ?", (quest_id,)).fetchone()
-        conn.commit()
-        return dict(row)
+        if payload.outcome == "complete":
+            guild.on_quest_completed(db, user_id, quest_id, date.today())
+            stats.record(db, user_id, date.today(), quests_completed=1)
+            achievements.count(db, user_id, "quest_complete", quests_completed=1)
+        else:
+            stats.record(db, user_id, date.today(), quests_failed=1)
+        row = db.execute(text("SELECT * FROM quest_logs WHERE id = :id"), {"id": result.lastrowid}).mappings().one()
+        feed.stage(db, user_id, feed.quest_log_entry(row))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
+
+    return dict(row)
@@ -0,0 +1,333 @@
+import os
+import calendar
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from math import gcd
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from db import get_user_db
+from sessions import require_user
+from serialize import json_response
+
+router = APIRouter(prefix="/api", tags=["calendar"], dependencies=[Depends(require_user)])
+
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+# Widest window one calendar request may ask for
+MAX_WINDOW_DAYS = 400
+# Quests whose expanded months are kept in memory
+CACHE_QUESTS = int(os.getenv("RECURRENCE_CACHE_QUESTS", "5000"))
+# Expanded months kept per quest
+CACHE_MONTHS = 36
+# Dailies missed longer ago than this are not reported at rollover
+MISSED_LOOKBACK_DAYS = 30
+# The Gregorian calendar repeats every 400 years, so a generator that has gone this many
+# periods without an occurrence never produces another one. parse_rule() rejects the
+# rules that would get here; this keeps a stored rule from spinning a worker regardless.
+CYCLE_DAYS = 7
+CYCLE_MONTHS = 400 * 12
+CYCLE_YEARS = 400
+
+class InvalidRule(ValueError):
+    pass
+
+class Rule:
+    # The RRULE subset quests use: FREQ=DAILY|WEEKLY|MONTHLY|YEARLY with INTERVAL,
+    # BYDAY (weekday codes, DAILY/WEEKLY), BYMONTHDAY (MONTHLY, negative counts from the
+    # end), COUNT and UNTIL. An optional DTSTART line overrides the quest's start day.
+    __slots__ = ("freq", "interval", "byday", "bymonthday", "count", "until", "dtstart")
+
+    def __init__(self, freq, interval=1, byday=(), bymonthday=(), count=None, until=None, dtstart=None):
+        self.freq = freq
+        self.interval = interval
+        self.byday = byday
+        self.bymonthday = bymonthday
+        self.count = count
+        self.until = until
+        self.dtstart = dtstart
+
+    def occurrences(self, start, from_day=None):
+        # Lazily yield occurrence days in order. With no COUNT the generator jumps straight
+        # to the period containing from_day; with COUNT it must count from the start.
+        start = self.dtstart or start
+        skip_to = from_day if self.count is None and from_day and from_day > start else None
+        gen = getattr(self, "_" + self.freq.lower())(start, skip_to)
+        n = 0
+        for day in gen:
+            if day < start:
+                continue
+            if self.until and day > self.until:
+                return
+            n += 1
+            if self.count is not None and n > self.count:
+                return
+            yield day
+
+    def _daily(self, start, skip_to):
+        k = -(-(skip_to - start).days // self.interval) if skip_to else 0
+        if (date.max - start).days < k * self.interval:
+            return
+        day = start + timedelta(days=k * self.interval)
+        step = timedelta(days=self.interval)
+        allowed = set(self.byday)
+        misses = 0
+        while misses < CYCLE_DAYS:
+            if not allowed or day.weekday() in allowed:
+                misses = 0
+                yield day
+            else:
+                misses += 1
+            if date.max - day < step:
+                return
+            day += step
+
+    def _weekly(self, start, skip_to):
+        days = sorted(self.byday) or [start.weekday()]
+        week = start - timedelta(days=start.weekday())
+        if skip_to:
+            weeks = (skip_to - week).days // 7
+            week += timedelta(weeks=weeks - weeks % self.interval)
+        step = timedelta(weeks=self.interval)
+        while (date.max - week).days >= 6:
+            for wd in days:
+                yield week + timedelta(days=wd)
+            if date.max - week < step + timedelta(days=6):
+                return
+            week += step
+
+    def _monthly(self, start, skip_to):
+        monthdays = self.bymonthday or (start.day,)
+        index = start.year * 12 + start.month - 1
+        if skip_to:
+            months = skip_to.year * 12 + skip_to.month - 1 - index
+            index += months - months % self.interval
+        empty = 0
+        while empty < CYCLE_MONTHS and index // 12 <= date.max.year:
+            year, month = divmod(index, 12)
+            last = calendar.monthrange(year, month + 1)[1]
+            # Days that don't exist in this month (the 31st in April) are skipped
+            days = sorted({d if d > 0 else last + 1 + d for d in monthdays if -last <= d <= last and d != 0})
+            empty = 0 if days else empty + 1
+            for d in days:
+                yield date(year, month + 1, d)
+            index += self.interval
+
+    def _yearly(self, start, skip_to):
+        year = start.year
+        if skip_to and skip_to.year > year:
+            years = skip_to.year - year
+            year += years - years % self.interval
+        misses = 0
+        while misses < CYCLE_YEARS and year <= date.max.year:
+            if start.month != 2 or start.day != 29 or calendar.isleap(year):
+                misses = 0
+                yield date(year, start.month, start.day)
+            else:
+                misses += 1
+            year += self.interval
+
+def _parse_day(value):
+    try:
+        return datetime.strptime(value[:8], "%Y%m%d").date()
+    except ValueError:
+        raise InvalidRule(f"Bad date {value!r}")
+
+def _monthdays_reachable(monthdays, interval, first_month=None):
+    # Whether the months an INTERVAL steps through hold one of the days, from every start
+    # month (or just first_month, when DTSTART fixes it). From a given start only every
+    # gcd(interval, 12)th month comes round; February counts as 29 days when the years
+    # it comes round in reach leap years whatever the start year.
+    step = gcd(interval, 12)
+    february = 29 if gcd(interval // step, 4) == 1 else 28
+    lengths = (31, february, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+    offsets = range(step) if first_month is None else ((first_month - 1) % step,)
+    return all(any(-lengths[m] <= d <= lengths[m] for m in range(offset, 12, step) for d in monthdays)
+               for offset in offsets)
+
+@lru_cache(maxsize=4096)
+def parse_rule(rule_text):
+    # "FREQ=WEEKLY;BYDAY=MO,WE,FR", optionally prefixed with "RRULE:" and preceded by a
+    # "DTSTART:20260101" line
+    dtstart = None
+    rule = None
+    for line in rule_text.strip().splitlines():
+        line = line.strip()
+        if line.upper().startswith("DTSTART"):
+            dtstart = _parse_day(line.split(":", 1)[-1].split("=", 1)[-1])
+        elif line:
+            rule = line[6:] if line.upper().startswith("RRULE:") else line
+    if not rule:
+        raise InvalidRule("Missing RRULE")
+
+    parts = {}
+    for part in rule.split(";"):
+        if not part:
+            continue
+        key, sep, value = part.partition("=")
+        if not sep:
+            raise InvalidRule(f"Bad rule part {part!r}")
+        parts[key.strip().upper()] = value.strip().upper()
+
+    freq = parts.pop("FREQ", None)
+    if freq not in ("DAILY", "WEEKLY", "MONTHLY", "YEARLY"):
+        raise InvalidRule(f"Unsupported FREQ {freq!r}")
+    try:
+        interval = int(parts.pop("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+        bymonthday = tuple(int(d) for d in parts.pop("BYMONTHDAY").split(",")) if "BYMONTHDAY" in parts else ()
+    except ValueError:
+        raise InvalidRule("INTERVAL, COUNT and BYMONTHDAY must be integers")
+    parts.pop("COUNT", None)
+    byday = ()
+    if "BYDAY" in parts:
+        codes = parts.pop("BYDAY").split(",")
+        if any(code not in WEEKDAYS for code in codes):
+            raise InvalidRule("BYDAY takes weekday codes (MO..SU)")
+        byday = tuple(sorted({WEEKDAYS.index(code) for code in codes}))
+    until = _parse_day(parts.pop("UNTIL")) if "UNTIL" in parts else None
+    parts.pop("WKST", None)
+    if parts:
+        raise InvalidRule(f"Unsupported rule parts: {', '.join(sorted(parts))}")
+    if interval < 1 or (count is not None and count < 1):
+        raise InvalidRule("INTERVAL and COUNT must be positive")
+    if byday and freq not in ("DAILY", "WEEKLY"):
+        raise InvalidRule("BYDAY is supported with DAILY and WEEKLY only")
+    if bymonthday and freq != "MONTHLY":
+        raise InvalidRule("BYMONTHDAY is supported with MONTHLY only")
+    if any(d == 0 or not -31 <= d <= 31 for d in bymonthday):
+        raise InvalidRule("BYMONTHDAY must be 1..31 or -31..-1")
+    # Rules that could never produce an occurrence
+    if freq == "DAILY" and byday and interval % 7 == 0:
+        raise InvalidRule("A DAILY INTERVAL that is a multiple of 7 never changes weekday; "
+                          "use FREQ=WEEKLY with BYDAY")
+    if bymonthday and not _monthdays_reachable(bymonthday, interval, dtstart.month if dtstart else None):
+        raise InvalidRule("BYMONTHDAY falls in none of the months this INTERVAL reaches")
+    return Rule(freq, interval, byday, bymonthday, count, until, dtstart)
+
+def quest_rule(repeats_rule, quest_type):
+    # Dailies without an explicit rule repeat every day
+    if repeats_rule:
+        return parse_rule(repeats_rule)
+    if quest_type == "daily":
+        return parse_rule("FREQ=DAILY")
+    return None
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+class OccurrenceCache:
+    # quest_id -> (rule text, start day, {month start: tuple of ISO days}). Windows are
+    # served from whole expanded months, so overlapping calendar pages share the work and
+    # ISO strings go straight into responses. Editing a quest drops its entry; LRU over
+    # quests and a cap on months per quest bound memory.
+    def __init__(self, max_quests):
+        self._lock = threading.Lock()
+        self._quests = OrderedDict()
+        self.max_quests = max_quests
+
+    def _months(self, quest_id, rule_text, start):
+        with self._lock:
+            entry = self._quests.get(quest_id)
+            if entry is None or entry[0] != rule_text or entry[1] != start or len(entry[2]) > CACHE_MONTHS:
+                entry = (rule_text, start, {})
+                self._quests[quest_id] = entry
+            self._quests.move_to_end(quest_id)
+            while len(self._quests) > self.max_quests:
+                self._quests.popitem(last=False)
+        return entry[2]
+
+    def between(self, quest_id, rule_text, rule, start, from_day, to_day):
+        months = self._months(quest_id, rule_text, start)
+        lo, hi = from_day.isoformat(), to_day.isoformat()
+        out = []
+        month = _month_start(from_day)
+        while month <= to_day:
+            end = _next_month(month)
+            days = months.get(month)
+            if days is None:
+                expanded = []
+                for day in rule.occurrences(start, month):
+                    if day >= end:
+                        break
+                    if day >= month:
+                        expanded.append(day.isoformat())
+                days = months[month] = tuple(expanded)
+            if month < from_day or end > to_day:
+                days = days[bisect_left(days, lo):bisect_right(days, hi)]
+            out.extend(days)
+            month = end
+        return out
+
+    def invalidate(self, quest_id):
+        with self._lock:
+            self._quests.pop(quest_id, None)
+
+cache = OccurrenceCache(CACHE_QUESTS)
+
+def _start_of(quest):
+    return date.fromisoformat(quest.created_at[:10])
+
+def recurring_quests(db, user_id):
+    return db.execute(
+        text("SELECT id, title, type, repeats_rule, created_at FROM quests "
+             "WHERE user_id = :user_id AND is_active = 1 AND (repeats_rule IS NOT NULL OR type = 'daily')"),
+        {"user_id": user_id},
+    ).all()
+
+def expand(db, user_id, from_day, to_day):
+    # [(quest row, [ISO days])] for the user's recurring quests; quests with a rule that no
+    # longer parses are left out rather than failing the whole calendar
+    out = []
+    for quest in recurring_quests(db, user_id):
+        try:
+            rule = quest_rule(quest.repeats_rule, quest.type)
+        except InvalidRule:
+            continue
+        days = cache.between(quest.id, quest.repeats_rule or quest.type, rule, _start_of(quest), from_day, to_day)
+        if days:
+            out.append((quest, days))
+    return out
+
+def due_on(db, user_id, day):
+    return [quest.id for quest, _ in expand(db, user_id, day, day)]
+
+def missed(db, user_id, first, last):
+    # Occurrences between first and last (inclusive) without a completion logged that day
+    first = max(first, last - timedelta(days=MISSED_LOOKBACK_DAYS - 1))
+    if first > last:
+        return []
+    done = set(db.execute(
+        text("SELECT quest_id, date(logged_at) FROM quest_logs WHERE user_id = :user_id "
+             "AND outcome = 'complete' AND logged_at >= :first AND logged_at < :after"),
+        {"user_id": user_id, "first": first.isoformat(), "after": (last + timedelta(days=1)).isoformat()},
+    ).all())
+    return [{"quest_id": quest.id, "day": day}
+            for quest, days in expand(db, user_id, first, last)
+            for day in days if (quest.id, day) not in done]
+
+# Occurrences of the user's recurring quests between two days, grouped per quest
+@router.get("/users/{user_id}/calendar")
+def quest_calendar(user_id: int, from_: Optional[date] = Query(None, alias="from"), to: Optional[date] = None,
+                   db: Session = Depends(get_user_db)):
+    from_ = from_ or date.today()
+    to = to or from_ + timedelta(days=30)
+    if from_ > to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (to - from_).days >= MAX_WINDOW_DAYS:
+        raise HTTPException(status_code=400, detail=f"Window is limited to {MAX_WINDOW_DAYS} days")
+    return json_response({
+        "from": from_.isoformat(),
+        "to": to.isoformat(),
+        "quests": [
+            {"quest_id": quest.id, "title": quest.title, "type": quest.type,
+             "dates": days}
+            for quest, days in expand(db, user_id, from_, to)
+        ],
+    })
@@ -0,0 +1,282 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta
+import httpx
+from fastapi import APIRouter, Depends
+from sqlalchemy import text
+from db import user_engines, shard_router
+from metrics import gauge, outbound_hooks
+from profiling import require_admin
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+logger = logging.getLogger("questify.reminders")
+
+# Set REMINDERS_ENABLED=0 to keep the reminder thread from starting
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "1") != "0"
+# How long before due_at a reminder fires
+LEAD_SECONDS = float(os.getenv("REMINDER_LEAD_MINUTES", "15")) * 60
+# Most reminders held in memory; the rest wait in the tables until their turn
+MAX_PENDING = int(os.getenv("REMINDER_MAX_PENDING", "100000"))
+# Days of due dates loaded ahead of today
+HORIZON_DAYS = int(os.getenv("REMINDER_HORIZON_DAYS", "2"))
+# Reminders that came due while the app was down still fire if they are at most this late
+GRACE_SECONDS = 60
+# Fired reminders are POSTed here as a JSON array, one request per tick
+WEBHOOK_URL = os.getenv("REMINDER_WEBHOOK_URL", "")
+TICK_SECONDS = 1
+RECENT = 200
+
+# Pending tasks and quests, read in due_at order through the partial indexes on due_at
+_WINDOW_SQL = {
+    "task": text("SELECT id, user_id, due_at FROM tasks WHERE done = 0 AND due_at >= :lo AND due_at < :hi "
+                 "ORDER BY due_at LIMIT :n"),
+    "quest": text("SELECT id, user_id, due_at FROM quests WHERE is_active = 1 AND due_at >= :lo AND due_at < :hi "
+                  "ORDER BY due_at LIMIT :n"),
+}
+_TIED_SQL = {
+    "task": text("SELECT id, user_id, due_at FROM tasks WHERE done = 0 AND due_at = :due_at"),
+    "quest": text("SELECT id, user_id, due_at FROM quests WHERE is_active = 1 AND due_at = :due_at"),
+}
+_USER_SQL = {
+    "task": text("SELECT id, due_at FROM tasks WHERE user_id = :user_id AND done = 0 "
+                 "AND due_at >= :lo AND due_at < :hi"),
+    "quest": text("SELECT id, due_at FROM quests WHERE user_id = :user_id AND is_active = 1 "
+                  "AND due_at >= :lo AND due_at < :hi"),
+}
+# Read back when a reminder fires: the item must still be pending with the same due date
+_CURRENT_SQL = {
+    "task": text("SELECT title, due_at FROM tasks WHERE id = :id AND done = 0"),
+    "quest": text("SELECT title, due_at FROM quests WHERE id = :id AND is_active = 1"),
+}
+
+def fire_time(due_at):
+    # Unix time the reminder for due_at fires, or None if due_at isn't an ISO date. Times
+    # without an offset are local, like the rest of the app's timestamps; a bare date is
+    # due at the start of the day.
+    if not due_at:
+        return None
+    try:
+        return datetime.fromisoformat(due_at).timestamp() - LEAD_SECONDS
+    except ValueError:
+        return None
+
+class Reminders:
+    # A min-heap of (fire time, kind, id, user id) over a prefix of the due dates: every
+    # pending task and quest whose due_at sorts below loaded_until is in memory, the rest
+    # are still only in the tables. A daemon thread pops what is due, and tops the prefix
+    # up from the due_at indexes as the days go by or as the heap drains.
+    #
+    # _pending maps (kind, id) to the fire time it is scheduled for. Cancelling or moving
+    # a reminder only changes that entry; heap entries that no longer match it are
+    # skipped when they surface, and the heap is rebuilt once they outnumber the live ones.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._heap = []
+        self._pending = {}
+        self.loaded_from = ""
+        self.loaded_until = ""
+        self.recent = deque(maxlen=RECENT)
+        self.fired = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._http = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _add(self, kind, item_id, user_id, due_at, now):
+        # Caller holds the lock
+        at = fire_time(due_at)
+        if at is None or at < now - GRACE_SECONDS:
+            self._pending.pop((kind, item_id), None)
+            return
+        if self._pending.get((kind, item_id)) != at:
+            self._pending[(kind, item_id)] = at
+            heapq.heappush(self._heap, (at, kind, item_id, user_id))
+
+    def schedule(self, kind, item_id, user_id, due_at):
+        # Called by the write paths whenever an item's due date may have changed
+        with self._lock:
+            if not due_at or not self.loaded_from <= due_at < self.loaded_until:
+                # Outside the prefix: the table is the only copy, the refill finds it
+                self._pending.pop((kind, item_id), None)
+            elif (kind, item_id) not in self._pending and len(self._pending) >= self.capacity:
+                # No room; shrink the prefix so the refill reads it (and what follows) again
+                self.loaded_until = due_at
+            else:
+                self._add(kind, item_id, user_id, due_at, time.time())
+
+    def cancel(self, kind, item_id):
+        with self._lock:
+            self._pending.pop((kind, item_id), None)
+
+    def refill(self):
+        # Extend the prefix towards HORIZON_DAYS ahead, as far as capacity allows. The
+        # first load starts yesterday so due dates written with a UTC offset are not missed.
+        with self._lock:
+            if not self.loaded_from:
+                self.loaded_from = self.loaded_until = (date.today() - timedelta(days=1)).isoformat()
+        hi = (date.today() + timedelta(days=HORIZON_DAYS + 1)).isoformat()
+        with self._lock:
+            lo, room = self.loaded_until, self.capacity - len(self._pending)
+        if lo >= hi or room <= 0:
+            return 0
+        rows = []
+        for engine in user_engines():
+            with engine.connect() as conn:
+                for kind, sql in _WINDOW_SQL.items():
+                    rows.extend((due_at, kind, item_id, user_id) for item_id, user_id, due_at in
+                                conn.execute(sql, {"lo": lo, "hi": hi, "n": room + 1}))
+        rows.sort()
+        until = hi
+        if len(rows) > room:
+            # Stop below the first due date that didn't fit, so items sharing it load together
+            until = rows[room][0]
+            if until == lo:
+                # More than fit share one due date; take all of them rather than stall
+                rows = self._tied(lo)
+                until = lo + "\x00"
+            else:
+                rows = [row for row in rows[:room] if row[0] < until]
+        now = time.time()
+        with self._lock:
+            if self.loaded_until != lo:
+                # A write shrank the prefix meanwhile; the next refill starts from there
+                until = min(until, self.loaded_until)
+            for due_at, kind, item_id, user_id in rows:
+                if due_at < until:
+                    self._add(kind, item_id, user_id, due_at, now)
+            self.loaded_until = until
+        return len(rows)
+
+    def _tied(self, due_at):
+        rows = []
+        for engine in user_engines():
+            with engine.connect() as conn:
+                for kind, sql in _TIED_SQL.items():
+                    rows.extend((due_at, kind, item_id, user_id) for item_id, user_id, due_at in
+                                conn.execute(sql, {"due_at": due_at}))
+        return rows
+
+    def load_user(self, user_id):
+        # For writes that bypass the hooks (an import): schedule whatever of the user's
+        # falls inside the prefix
+        with self._lock:
+            params = {"user_id": user_id, "lo": self.loaded_from, "hi": self.loaded_until}
+        with shard_router.engine(user_id).connect() as conn:
+            rows = [(kind, item_id, due_at) for kind, sql in _USER_SQL.items()
+                    for item_id, due_at in conn.execute(sql, params)]
+        for kind, item_id, due_at in rows:
+            self.schedule(kind, item_id, user_id, due_at)
+
+    def pop_due(self, now):
+        due = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                at, kind, item_id, user_id = heapq.heappop(heap)
+                if self._pending.get((kind, item_id)) == at:
+                    del self._pending[(kind, item_id)]
+                    due.append((at, kind, item_id, user_id))
+            if len(heap) > 2 * len(self._pending) + 1024:
+                self._heap = [(at, kind, item_id, user_id) for at, kind, item_id, user_id in heap
+                              if self._pending.get((kind, item_id)) == at]
+                heapq.heapify(self._heap)
+        return due
+
+    def fire(self, due):
+        # Read each item back from its shard: one that was finished, deleted or moved to
+        # another date since it was scheduled (by a rolled back write, a sync or an import)
+        # is dropped instead of reminding anyone
+        events = []
+        fired_at = datetime.now().isoformat(sep=" ", timespec="seconds")
+        for at, kind, item_id, user_id in due:
+            with shard_router.engine(user_id).connect() as conn:
+                row = conn.execute(_CURRENT_SQL[kind], {"id": item_id}).first()
+            if row is None or fire_time(row.due_at) != at:
+                continue
+            events.append({"type": kind, "id": item_id, "user_id": user_id, "title": row.title,
+                           "due_at": row.due_at, "fired_at": fired_at})
+        if events:
+            self.fired += len(events)
+            self.recent.extend(events)
+            self._send(events)
+        return events
+
+    def _send(self, events):
+        logger.info("%d reminders fired", len(events))
+        if not WEBHOOK_URL:
+            return
+        if self._http is None:
+            self._http = httpx.Client(timeout=5, event_hooks=outbound_hooks(sync=True))
+        try:
+            response = self._http.post(WEBHOOK_URL, json=events)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            logger.exception("reminder webhook failed, %d reminders dropped", len(events))
+
+    def tick(self):
+        due = self.pop_due(time.time())
+        if due:
+            self.fire(due)
+        self.refill()
+
+    def _loop(self):
+        # The first tick does the initial load, off the startup path; until then the prefix
+        # is empty and the write paths leave everything to it
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("reminder tick failed")
+            if self._stop.wait(TICK_SECONDS):
+                return
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="reminders", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+reminders = Reminders(MAX_PENDING)
+
+gauge("questify_reminders_pending", "Reminders held in memory", lambda: len(reminders))
+
+# Write-path hooks
+
+def task_changed(task_id, user_id, due_at, done):
+    if done:
+        reminders.cancel("task", task_id)
+    else:
+        reminders.schedule("task", task_id, user_id, due_at)
+
+def task_deleted(task_id):
+    reminders.cancel("task", task_id)
+
+def quest_changed(quest_id, user_id, due_at, is_active):
+    if is_active:
+        reminders.schedule("quest", quest_id, user_id, due_at)
+    else:
+        reminders.cancel("quest", quest_id)
+
+# The local sink: what fired lately, and what is waiting
+@router.get("/reminders", dependencies=[Depends(require_admin)])
+def reminder_status():
+    return {
+        "pending": len(reminders),
+        "loaded": [reminders.loaded_from, reminders.loaded_until],
+        "fired": reminders.fired,
+        "webhook": bool(WEBHOOK_URL),
+        "recent": list(reminders.recent),
+    }
@@ -0,0 +1,29 @@
+from fastapi.responses import ORJSONResponse
+
+# Fast path for hot read endpoints: select plain row tuples and map them straight onto
+# the response model's JSON keys, skipping ORM object loading and per-object pydantic
+# validation. Routes keep response_model so the OpenAPI schema does not change.
+class RowMapper:
+    def __init__(self, model, entity):
+        fields = model.model_fields
+        names = list(fields)
+        self.columns = [getattr(entity, name) for name in names]
+        self.keys = tuple(fields[name].serialization_alias or name for name in names)
+        # SQLite hands back 0/1 for boolean columns, the model promises true/false
+        self.bool_keys = tuple(key for name, key in zip(names, self.keys) if fields[name].annotation is bool)
+
+    def one(self, row):
+        out = dict(zip(self.keys, row))
+        for key in self.bool_keys:
+            out[key] = bool(out[key])
+        return out
+
+    def many(self, rows):
+        keys = self.keys
+        if not self.bool_keys:
+            return [dict(zip(keys, row)) for row in rows]
+        one = self.one
+        return [one(row) for row in rows]
+
+def json_response(content, status_code=200):
+    return ORJSONResponse(content, status_code=status_code)
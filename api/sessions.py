@@ -0,0 +1,112 @@
+import os
+import time
+import hmac
+import base64
+import hashlib
+import logging
+import secrets
+import threading
+from typing import Optional
+from fastapi import Depends, Header, HTTPException
+
+logger = logging.getLogger("questify.sessions")
+
+# Session tokens are "<key id>.<user id>.<expires>.<signature>", the signature being an
+# HMAC-SHA256 of the first three parts. Checking one is a hash and a comparison: no
+# session table, no database round trip.
+
+def parse_keys(spec):
+    # "k2:secret,k1:older-secret": the first key signs new tokens and every key listed
+    # verifies, so a rotation puts the new key first and drops the old one once the
+    # tokens it signed have expired
+    keys = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        kid, sep, secret = entry.partition(":")
+        if not sep or not kid or not secret or "." in kid:
+            raise ValueError(f"SESSION_KEYS entries are <key id>:<secret>, got {entry!r}")
+        keys[kid] = secret.encode()
+    return keys
+
+SESSION_KEYS = parse_keys(os.getenv("SESSION_KEYS", ""))
+if not SESSION_KEYS:
+    # Fine for development; tokens stop verifying when the process restarts
+    logger.warning("SESSION_KEYS is not set, signing sessions with a random key")
+    SESSION_KEYS = {"dev": secrets.token_bytes(32)}
+SIGNING_KID = next(iter(SESSION_KEYS))
+SESSION_TTL = int(float(os.getenv("SESSION_TTL_HOURS", "168")) * 3600)
+
+def _sign(key, payload):
+    return base64.urlsafe_b64encode(hmac.new(key, payload.encode(), hashlib.sha256).digest()).rstrip(b"=").decode()
+
+def issue(user_id):
+    # (token, unix time it expires at)
+    expires = int(time.time()) + SESSION_TTL
+    payload = f"{SIGNING_KID}.{user_id}.{expires}"
+    return f"{payload}.{_sign(SESSION_KEYS[SIGNING_KID], payload)}", expires
+
+class Revoked:
+    # Signatures of tokens logged out before they expired, with their expiry. An entry is
+    # only needed until then, so the set stays as small as the logouts of one TTL.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires = {}
+
+    def add(self, signature, expires):
+        now = time.time()
+        with self._lock:
+            # Swapped in whole, so lookups never see the dict change under them
+            kept = {sig: at for sig, at in self._expires.items() if at > now}
+            kept[signature] = expires
+            self._expires = kept
+
+    def __contains__(self, signature):
+        return signature in self._expires
+
+    def __len__(self):
+        return len(self._expires)
+
+revoked = Revoked()
+
+def verify(token):
+    # The user id the token was issued to, or None if it is malformed, forged, expired
+    # or revoked. Tokens are ASCII; anything else is refused before compare_digest, which
+    # raises on non-ASCII str
+    if not token or not token.isascii():
+        return None
+    parts = token.split(".")
+    if len(parts) != 4:
+        return None
+    kid, user_id, expires, signature = parts
+    key = SESSION_KEYS.get(kid)
+    if key is None or not user_id.isdigit() or not expires.isdigit():
+        return None
+    if not hmac.compare_digest(signature, _sign(key, f"{kid}.{user_id}.{expires}")):
+        return None
+    if int(expires) <= time.time() or signature in revoked:
+        return None
+    return int(user_id)
+
+def revoke(token):
+    if verify(token) is not None:
+        revoked.add(token.rsplit(".", 1)[1], int(token.split(".")[2]))
+
+def bearer_token(authorization):
+    if authorization and authorization[:7].lower() == "bearer ":
+        return authorization[7:].strip()
+    return None
+
+# Both dependencies are async on purpose: they never block, and a plain def would be
+# sent to the threadpool, which costs far more than checking the signature
+
+# The logged-in user, for routes that don't name one in the path
+async def session_user(authorization: Optional[str] = Header(None)):
+    user_id = verify(bearer_token(authorization))
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not logged in", headers={"WWW-Authenticate": "Bearer"})
+    return user_id
+
+# For routes under /users/{user_id}: the path must name the logged-in user
+async def require_user(user_id: int, session: int = Depends(session_user)):
+    if session != user_id:
+        raise HTTPException(status_code=403, detail="Not allowed for this user")
+    return user_id
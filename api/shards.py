@@ -0,0 +1,140 @@
+import sys
+import orjson
+from sqlalchemy import create_engine, text
+from db import engine, shard_engines, shard_router, init_schema, get_shard_file, DB_SHARDS, SHARDED
+from transfer import Importer, _export_lines, _purge
+
+# Rebalancing tool for sharded installs (DB_SHARDS >= 2). Run it with the app stopped:
+# the app loads who-lives-where once at startup.
+#
+#   python shards.py status               users per shard
+#   python shards.py rebalance            move every user to the shard its id hashes to,
+#                                         including users still in an unsharded questify.db
+#   python shards.py move <user_id> <n>   pin one (busy) user to shard n
+
+# Account rows that are not part of an export; copied as they are
+ACCOUNT_TABLES = (("users", "id"), ("user_passwords", "user_id"), ("sync_ops", "user_id"))
+# Shard number for users still in questify.db from before it was sharded
+DIRECTORY = -1
+
+_old_engines = {}
+
+def _engine_for(shard):
+    if shard == DIRECTORY:
+        return engine
+    if shard < DB_SHARDS:
+        return shard_engines[shard]
+    # A shard left over from a bigger DB_SHARDS, being emptied
+    if shard not in _old_engines:
+        _old_engines[shard] = create_engine(f"sqlite:///{get_shard_file(shard)}")
+    return _old_engines[shard]
+
+def _copy_account(user_id, source, target):
+    with source.connect() as conn:
+        rows = {table: conn.execute(text(f"SELECT * FROM {table} WHERE {key} = :id"), {"id": user_id}).mappings().all()
+                for table, key in ACCOUNT_TABLES}
+    with target.begin() as conn:
+        for table, table_rows in rows.items():
+            if table_rows:
+                cols = list(table_rows[0].keys())
+                conn.execute(text(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join(':' + c for c in cols)})"),
+                             [dict(r) for r in table_rows])
+
+def _delete_account(user_id, target):
+    _purge(user_id, target)
+    with target.begin() as conn:
+        for table, key in reversed(ACCOUNT_TABLES):
+            conn.execute(text(f"DELETE FROM {table} WHERE {key} = :id"), {"id": user_id})
+
+def move_user(user_id, source_shard, target_shard):
+    # Copy through the export/import path (quest ids are reassigned on the target, as on
+    # an import), point the directory at the copy, then delete the original. Whatever an
+    # interrupted move left on the target is cleared first, so a move can just be rerun.
+    source, target = _engine_for(source_shard), _engine_for(target_shard)
+    _delete_account(user_id, target)
+    _copy_account(user_id, source, target)
+    importer = Importer(user_id, target, trusted=True)
+    for line in _export_lines(user_id, source):
+        importer.line(orjson.loads(line))
+        importer.write_ready()
+    importer.finish()
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE user_shards SET shard = :shard, moved = :moved WHERE user_id = :user_id"),
+                     {"shard": target_shard, "moved": int(target_shard != shard_router.placement(user_id)),
+                      "user_id": user_id})
+    _delete_account(user_id, source)
+
+def _adopt_unsharded_users():
+    # Users created before sharding are still in questify.db; list them in the directory
+    # so the moves below carry them out to their shards
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO user_shards (user_id, shard, email, display_name)
+            SELECT u.id, :directory, u.email, u.display_name FROM users u
+            WHERE NOT EXISTS (SELECT 1 FROM user_shards s WHERE s.user_id = u.id)
+        """), {"directory": DIRECTORY}).rowcount
+
+def _sweep():
+    # Drop copies an interrupted move left behind on a shard the directory doesn't point at
+    with engine.connect() as conn:
+        homes = dict(conn.execute(text("SELECT user_id, shard FROM user_shards")).all())
+    swept = 0
+    for shard, shard_engine in enumerate(shard_engines):
+        with shard_engine.connect() as conn:
+            ids = [row[0] for row in conn.execute(text("SELECT id FROM users"))]
+        for user_id in ids:
+            if homes.get(user_id) != shard:
+                _delete_account(user_id, shard_engine)
+                swept += 1
+    return swept
+
+def rebalance():
+    init_schema()
+    adopted = _adopt_unsharded_users()
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT user_id, shard, moved FROM user_shards ORDER BY user_id")).all()
+    moved = 0
+    for user_id, shard, pinned in rows:
+        target = shard_router.placement(user_id)
+        # Pinned users stay where they were put, unless their shard is going away
+        if shard == target or (pinned and 0 <= shard < DB_SHARDS):
+            continue
+        move_user(user_id, shard, target)
+        moved += 1
+    swept = _sweep()
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f"PRAGMA user_version = {DB_SHARDS}")
+    return adopted, moved, swept
+
+def status():
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT shard, COUNT(*), SUM(moved) FROM user_shards GROUP BY shard ORDER BY shard")).all()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not SHARDED:
+        print("Set DB_SHARDS to the number of shards (2 or more) first")
+        sys.exit(1)
+    if args == ["status"]:
+        for shard, users, pinned in status():
+            print(f"shard {shard}: {users} users ({pinned} pinned)")
+    elif args == ["rebalance"]:
+        adopted, moved, swept = rebalance()
+        print(f"Spread over {DB_SHARDS} shards: {adopted} unsharded users adopted, {moved} moved, "
+              f"{swept} stale copies removed")
+    elif len(args) == 3 and args[0] == "move" and args[1].isdigit() and args[2].isdigit():
+        user_id, shard = int(args[1]), int(args[2])
+        if shard >= DB_SHARDS:
+            print(f"Shard must be below {DB_SHARDS}")
+            sys.exit(1)
+        with engine.connect() as conn:
+            current = conn.execute(text("SELECT shard FROM user_shards WHERE user_id = :id"), {"id": user_id}).scalar()
+        if current is None:
+            print("User not found")
+            sys.exit(1)
+        if current != shard:
+            move_user(user_id, current, shard)
+        print(f"User {user_id} is on shard {shard}")
+    else:
+        print("usage: python shards.py status | rebalance | move <user_id> <shard>")
+        sys.exit(1)
@@ -0,0 +1,288 @@
+import json
+import threading
+import time
+from datetime import date
+from typing import Optional, Literal
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from pydantic import BaseModel, Field, field_validator
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from db import get_db, get_user_db, engine, SHARDED, copy_shared_tables
+from sessions import require_user
+from economy import record_ledger
+from profiling import require_admin
+from serialize import json_response
+import stats
+import achievements
+
+router = APIRouter(prefix="/api", tags=["shop"])
+
+class ShopItemIn(BaseModel):
+    id: Optional[int] = None
+    kind: Literal["gear", "cosmetic", "pet", "consumable", "reward_slot"]
+    name: str
+    rarity: str = "Common"
+    cost_gold: int = Field(0, ge=0)
+    cost_diamonds: int = Field(0, ge=0)
+    meta_json: str = "{}"
+    stock: Optional[int] = Field(None, ge=0)   # None means unlimited
+
+    # The catalog parses every item's meta_json when it loads, so one bad value would take
+    # the whole shop down; it is refused here instead
+    @field_validator("meta_json")
+    @classmethod
+    def _meta_is_an_object(cls, value):
+        try:
+            meta = json.loads(value)
+        except ValueError:
+            raise ValueError("meta_json must be valid JSON")
+        if not isinstance(meta, dict):
+            raise ValueError("meta_json must be a JSON object")
+        return value
+
+class PurchaseIn(BaseModel):
+    item_id: int
+    qty: int = Field(1, ge=1, le=99)
+    # Version of the catalog the client priced the purchase from; a stale one is refused
+    catalog_version: Optional[int] = None
+
+class RewardIn(BaseModel):
+    label: str
+    cost_diamonds: int = Field(10, ge=0)
+
+class CatalogSnapshot:
+    __slots__ = ("version", "items", "body")
+
+    def __init__(self, version, items, body):
+        self.version = version
+        self.items = items
+        self.body = body
+
+class Catalog:
+    # The catalog is the same for every player and changes only through the admin route,
+    # so it is read once, pre-serialized, and stamped with a version for ETags. Readers get
+    # an immutable snapshot, so an edit mid-request can't mix old prices with a new version.
+    # A miss reads on its own connection, never the caller's session: a purchase's
+    # transaction must not begin with a read (see purchase()).
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._last_version = 0
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = self._snapshot = self._load()
+        return snapshot
+
+    def _load(self):
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT id, kind, name, rarity, cost_gold, cost_diamonds, meta_json, stock "
+                     "FROM shop_items ORDER BY id")
+            ).mappings().all()
+        items = {}
+        for row in rows:
+            items[row["id"]] = {
+                "id": row["id"],
+                "kind": row["kind"],
+                "name": row["name"],
+                "rarity": row["rarity"],
+                "cost_gold": row["cost_gold"],
+                "cost_diamonds": row["cost_diamonds"],
+                "meta": json.loads(row["meta_json"] or "{}"),
+                "limited": row["stock"] is not None,
+            }
+        # Milliseconds keep versions increasing across restarts
+        version = self._last_version = max(int(time.time() * 1000), self._last_version + 1)
+        body = json_response({"version": version, "items": list(items.values())}).body
+        return CatalogSnapshot(version, items, body)
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+catalog = Catalog()
+
+def _etag(version):
+    return f'W/"catalog-{version}"'
+
+@router.get("/shop/items")
+def list_shop_items(if_none_match: Optional[str] = Header(None)):
+    current = catalog.get()
+    headers = {"ETag": _etag(current.version)}
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=current.body, media_type="application/json", headers=headers)
+
+@router.put("/admin/shop/items", dependencies=[Depends(require_admin)])
+def upsert_shop_item(item: ShopItemIn, db: Session = Depends(get_db)):
+    result = db.execute(
+        text("""
+            INSERT INTO shop_items (id, kind, name, rarity, cost_gold, cost_diamonds, meta_json, stock)
+            VALUES (:id, :kind, :name, :rarity, :cost_gold, :cost_diamonds, :meta_json, :stock)
+            ON CONFLICT(id) DO UPDATE SET
+                kind = excluded.kind, name = excluded.name, rarity = excluded.rarity,
+                cost_gold = excluded.cost_gold, cost_diamonds = excluded.cost_diamonds,
+                meta_json = excluded.meta_json, stock = excluded.stock
+            RETURNING id
+        """),
+        item.model_dump(),
+    )
+    item_id = result.scalar()
+    db.commit()
+    copy_shared_tables()
+    catalog.invalidate()
+    return {"id": item_id, "version": catalog.get().version}
+
+def _insufficient(db, user_id):
+    exists = db.execute(text("SELECT 1 FROM users WHERE id = :id"), {"id": user_id}).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    raise HTTPException(status_code=409, detail="Not enough gold or diamonds")
+
+def _debit(db, user_id, gold, diamonds):
+    # Check and debit in one conditional UPDATE: two purchases racing for the last coins
+    # can't both pass, and the balance never goes negative
+    return db.execute(
+        text("""
+            UPDATE users SET gold = gold - :gold, diamonds = diamonds - :diamonds
+            WHERE id = :user_id AND gold >= :gold AND diamonds >= :diamonds
+            RETURNING gold, diamonds
+        """),
+        {"user_id": user_id, "gold": gold, "diamonds": diamonds},
+    ).first()
+
+_TAKE_STOCK = text("UPDATE shop_items SET stock = stock - :qty WHERE id = :id AND stock >= :qty RETURNING stock")
+
+def _take_stock(db, item_id, qty):
+    # With sharded users the directory holds the one true stock count, taken in its own
+    # transaction and handed back by _return_stock if the purchase then fails
+    if not SHARDED:
+        return db.execute(_TAKE_STOCK, {"id": item_id, "qty": qty}).scalar()
+    with engine.begin() as conn:
+        return conn.execute(_TAKE_STOCK, {"id": item_id, "qty": qty}).scalar()
+
+def _return_stock(item_id, qty):
+    if SHARDED:
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE shop_items SET stock = stock + :qty WHERE id = :id"), {"id": item_id, "qty": qty})
+
+# Every statement in a purchase is a write, so the transaction takes SQLite's write lock
+# up front and waits its turn (busy_timeout) instead of failing on a read->write upgrade
+@router.post("/users/{user_id}/shop/purchases", status_code=201, dependencies=[Depends(require_user)])
+def purchase(user_id: int, item: PurchaseIn, db: Session = Depends(get_user_db)):
+    current = catalog.get()
+    if item.catalog_version is not None and item.catalog_version != current.version:
+        raise HTTPException(status_code=409, detail="Catalog has changed, refresh prices")
+    shop_item = current.items.get(item.item_id)
+    if shop_item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    gold = shop_item["cost_gold"] * item.qty
+    diamonds = shop_item["cost_diamonds"] * item.qty
+
+    stock = None
+    if shop_item["limited"]:
+        stock = _take_stock(db, item.item_id, item.qty)
+        if stock is None:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Sold out")
+
+    try:
+        balance = _debit(db, user_id, gold, diamonds)
+        if balance is None:
+            db.rollback()
+            if stock is not None:
+                _return_stock(item.item_id, item.qty)
+            _insufficient(db, user_id)
+
+        owned = db.execute(
+            text("""
+                INSERT INTO inventory (user_id, item_id, qty) VALUES (:user_id, :item_id, :qty)
+                ON CONFLICT(user_id, item_id) DO UPDATE SET qty = qty + excluded.qty
+                RETURNING qty
+            """),
+            {"user_id": user_id, "item_id": item.item_id, "qty": item.qty},
+        ).scalar()
+        record_ledger(db, user_id, -gold, -diamonds, "purchase", {"item_id": item.item_id, "qty": item.qty})
+        stats.record(db, user_id, date.today(), gold=-gold, diamonds=-diamonds)
+        achievements.count(db, user_id, "purchase", purchases=1, gold_spent=gold)
+        db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        if stock is not None:
+            _return_stock(item.item_id, item.qty)
+        raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
+
+    return {
+        "item_id": item.item_id,
+        "qty": owned,
+        "gold": balance.gold,
+        "diamonds": balance.diamonds,
+        "stock": stock,
+    }
+
+@router.get("/users/{user_id}/inventory", dependencies=[Depends(require_user)])
+def list_inventory(user_id: int, db: Session = Depends(get_user_db)):
+    rows = db.execute(
+        text("""
+            SELECT i.item_id, i.qty, s.kind, s.name, s.rarity
+            FROM inventory i JOIN shop_items s ON s.id = i.item_id
+            WHERE i.user_id = :user_id ORDER BY i.item_id
+        """),
+        {"user_id": user_id},
+    ).mappings().all()
+    return [dict(r) for r in rows]
+
+# Custom rewards are the player's own treats ("an hour of games"), bought with diamonds
+@router.get("/users/{user_id}/rewards", dependencies=[Depends(require_user)])
+def list_rewards(user_id: int, db: Session = Depends(get_user_db)):
+    rows = db.execute(
+        text("SELECT id, label, cost_diamonds FROM custom_rewards "
+             "WHERE user_id = :user_id AND is_active = 1 ORDER BY id"),
+        {"user_id": user_id},
+    ).mappings().all()
+    return [dict(r) for r in rows]
+
+@router.post("/users/{user_id}/rewards", status_code=201, dependencies=[Depends(require_user)])
+def create_reward(user_id: int, item: RewardIn, db: Session = Depends(get_user_db)):
+    exists = db.execute(text("SELECT 1 FROM users WHERE id = :id"), {"id": user_id}).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    row = db.execute(
+        text("INSERT INTO custom_rewards (user_id, label, cost_diamonds) VALUES (:user_id, :label, :cost) "
+             "RETURNING id, label, cost_diamonds"),
+        {"user_id": user_id, "label": item.label, "cost": item.cost_diamonds},
+    ).mappings().one()
+    db.commit()
+    return dict(row)
+
+@router.post("/users/{user_id}/rewards/{reward_id}/redeem", dependencies=[Depends(require_user)])
+def redeem_reward(user_id: int, reward_id: int, db: Session = Depends(get_user_db)):
+    cost = db.execute(
+        text("SELECT cost_diamonds FROM custom_rewards WHERE id = :id AND user_id = :user_id AND is_active = 1"),
+        {"id": reward_id, "user_id": user_id},
+    ).scalar()
+    if cost is None:
+        raise HTTPException(status_code=404, detail="Reward not found")
+
+    try:
+        balance = _debit(db, user_id, 0, cost)
+        if balance is None:
+            db.rollback()
+            _insufficient(db, user_id)
+        record_ledger(db, user_id, 0, -cost, "reward", {"reward_id": reward_id})
+        stats.record(db, user_id, date.today(), diamonds=-cost)
+        db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
+
+    return {"reward_id": reward_id, "gold": balance.gold, "diamonds": balance.diamonds}
@@ -0,0 +1,166 @@
+from datetime import date, timedelta
+from typing import Optional, Literal
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from db import get_user_db
+from sessions import require_user
+
+router = APIRouter(prefix="/api", tags=["stats"], dependencies=[Depends(require_user)])
+
+STAT_COLUMNS = ("strength", "dexterity", "intelligence", "wisdom", "charisma")
+# Counters kept per (user, day) in user_daily_stats; xp/gold/stats are net deltas
+ROLLUP_COLUMNS = ("xp", "gold", "diamonds") + STAT_COLUMNS + ("tasks_completed", "quests_completed", "quests_failed")
+
+# Upsert statements are built once per set of columns touched, then reused
+_upserts = {}
+
+def _upsert_sql(columns):
+    sql = _upserts.get(columns)
+    if sql is None:
+        cols = ", ".join(columns)
+        params = ", ".join(f":{c}" for c in columns)
+        updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in columns)
+        sql = text(f"INSERT INTO user_daily_stats (user_id, day, {cols}) VALUES (:user_id, :day, {params}) "
+                   f"ON CONFLICT(user_id, day) DO UPDATE SET {updates}")
+        _upserts[columns] = sql
+    return sql
+
+def record(db, user_id, day, **deltas):
+    # Bump today's rollup row in the caller's transaction; zero deltas are skipped
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    unknown = set(deltas) - set(ROLLUP_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown rollup columns: {sorted(unknown)}")
+    columns = tuple(sorted(deltas))
+    db.execute(_upsert_sql(columns), {"user_id": user_id, "day": day.isoformat(), **deltas})
+
+# Bucket start for each granularity; weeks start on Monday
+_BUCKETS = {
+    "day": "day",
+    "week": "date(day, '-' || ((CAST(strftime('%w', day) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "strftime('%Y-%m-01', day)",
+}
+
+def _completion_rate(completed, failed):
+    attempts = completed + failed
+    return round(completed / attempts, 4) if attempts else None
+
+def _entry(row):
+    completed = row["tasks_completed"] + row["quests_completed"]
+    return {
+        "start": row["start"],
+        "xp": row["xp"],
+        "gold": row["gold"],
+        "diamonds": row["diamonds"],
+        "tasks_completed": row["tasks_completed"],
+        "quests_completed": row["quests_completed"],
+        "quests_failed": row["quests_failed"],
+        "completion_rate": _completion_rate(completed, row["quests_failed"]),
+        "stats": {c: row[c] for c in STAT_COLUMNS},
+    }
+
+# XP, gold, completions and stat changes between two days, grouped by day/week/month.
+# Reads only the pre-aggregated rows: a year of history is at most 366 rows.
+@router.get("/users/{user_id}/stats")
+def user_stats(
+    user_id: int,
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    bucket: Literal["day", "week", "month"] = "day",
+    db: Session = Depends(get_user_db),
+):
+    to = to or date.today()
+    from_ = from_ or to - timedelta(days=29)
+    if from_ > to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    exists = db.execute(text("SELECT 1 FROM users WHERE id = :id"), {"id": user_id}).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    sums = ", ".join(f"SUM({c}) AS {c}" for c in ROLLUP_COLUMNS)
+    rows = db.execute(
+        text(f"""
+            SELECT {_BUCKETS[bucket]} AS start, {sums}
+            FROM user_daily_stats
+            WHERE user_id = :user_id AND day BETWEEN :from_day AND :to_day
+            GROUP BY start ORDER BY start
+        """),
+        {"user_id": user_id, "from_day": from_.isoformat(), "to_day": to.isoformat()},
+    ).mappings().all()
+
+    series = [_entry(row) for row in rows]
+    totals = {c: sum(row[c] for row in rows) for c in ROLLUP_COLUMNS}
+    completed = totals["tasks_completed"] + totals["quests_completed"]
+    return {
+        "user_id": user_id,
+        "from": from_.isoformat(),
+        "to": to.isoformat(),
+        "bucket": bucket,
+        "totals": {
+            "xp": totals["xp"],
+            "gold": totals["gold"],
+            "diamonds": totals["diamonds"],
+            "tasks_completed": totals["tasks_completed"],
+            "quests_completed": totals["quests_completed"],
+            "quests_failed": totals["quests_failed"],
+            "completion_rate": _completion_rate(completed, totals["quests_failed"]),
+            "stats": {c: totals[c] for c in STAT_COLUMNS},
+        },
+        "series": series,
+    }
+
+def rebuild(conn, user_id=None):
+    # Re-derive the rollups from the raw history (economy_ledger, task_logs, quest_logs).
+    # Each source is aggregated inside SQLite with one INSERT ... SELECT ... GROUP BY.
+    where = "" if user_id is None else "WHERE user_id = :user_id"
+    and_user = "" if user_id is None else "AND user_id = :user_id"
+    params = {} if user_id is None else {"user_id": user_id}
+
+    conn.execute(text(f"DELETE FROM user_daily_stats {where}"), params)
+
+    stat_sums = ", ".join(f"SUM(COALESCE(json_extract(meta_json, '$.{c}'), 0))" for c in STAT_COLUMNS)
+    conn.execute(text(f"""
+        INSERT INTO user_daily_stats (user_id, day, xp, gold, diamonds, {", ".join(STAT_COLUMNS)})
+        SELECT user_id, date(created_at), SUM(COALESCE(json_extract(meta_json, '$.xp'), 0)),
+               SUM(delta_gold), SUM(delta_diamonds), {stat_sums}
+        FROM economy_ledger {where}
+        GROUP BY user_id, date(created_at)
+    """), params)
+
+    conn.execute(text(f"""
+        INSERT INTO user_daily_stats (user_id, day, tasks_completed)
+        SELECT user_id, date(logged_at), SUM(CASE outcome WHEN 'complete' THEN 1 ELSE -1 END)
+        FROM task_logs WHERE 1 = 1 {and_user}
+        GROUP BY user_id, date(logged_at)
+        ON CONFLICT(user_id, day) DO UPDATE SET tasks_completed = excluded.tasks_completed
+    """), params)
+
+    conn.execute(text(f"""
+        INSERT INTO user_daily_stats (user_id, day, quests_completed, quests_failed)
+        SELECT user_id, date(logged_at),
+               SUM(outcome = 'complete'), SUM(outcome IN ('fail', 'negative'))
+        FROM quest_logs WHERE 1 = 1 {and_user}
+        GROUP BY user_id, date(logged_at)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            quests_completed = excluded.quests_completed,
+            quests_failed = excluded.quests_failed
+    """), params)
+
+if __name__ == "__main__":
+    import sys
+    from db import user_engines, shard_router
+
+    args = sys.argv[1:]
+    if not args or args[0] != "rebuild" or len(args) > 2:
+        print("usage: python stats.py rebuild [user_id]")
+        sys.exit(1)
+    user_id = int(args[1]) if len(args) == 2 else None
+    shard_router.load()
+    for engine in [shard_router.engine(user_id)] if user_id else user_engines():
+        with engine.begin() as conn:
+            rebuild(conn, user_id)
+    print("Rebuilt daily stats rollups")
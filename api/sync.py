@@ -0,0 +1,156 @@
+import os
+from datetime import date, timedelta
+from typing import Annotated, Literal, Union
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError, StatementError
+from db import get_user_db, local_now
+from sessions import require_user
+from auth import UserItem, USER_ROWS
+from economy import EconomyUpdate, apply_economy
+from leaderboard import leaderboard
+from tasks import TaskIn, TaskItem, apply_create, apply_update, apply_done, get_task
+import reminders
+
+router = APIRouter(prefix="/api", tags=["sync"], dependencies=[Depends(require_user)])
+
+# Operation ids are remembered this long; a client holding work offline for longer
+# than this could have an old operation applied twice
+SYNC_OP_TTL_DAYS = int(os.getenv("SYNC_OP_TTL_DAYS", "30"))
+MAX_SYNC_OPS = 500
+
+class TaskCreateOp(BaseModel):
+    op_id: str
+    type: Literal["task.create"]
+    task: TaskIn
+
+class TaskUpdateOp(BaseModel):
+    op_id: str
+    type: Literal["task.update"]
+    task_id: str
+    task: TaskIn
+
+class TaskDeleteOp(BaseModel):
+    op_id: str
+    type: Literal["task.delete"]
+    task_id: str
+
+class TaskCompleteOp(BaseModel):
+    op_id: str
+    type: Literal["task.complete"]
+    task_id: str
+    done: bool = True
+
+class EconomyOp(BaseModel):
+    op_id: str
+    type: Literal["economy"]
+    delta: EconomyUpdate
+
+SyncOp = Annotated[
+    Union[TaskCreateOp, TaskUpdateOp, TaskDeleteOp, TaskCompleteOp, EconomyOp],
+    Field(discriminator="type"),
+]
+
+class SyncIn(BaseModel):
+    ops: list[SyncOp] = Field(max_length=MAX_SYNC_OPS)
+
+class Rejected(Exception):
+    pass
+
+def _claim(db, user_id, op_id):
+    # Claiming the id is the first write, so a concurrent replay of the same batch waits
+    # for this one to commit and then sees every id as already applied
+    return db.execute(
+        text("INSERT INTO sync_ops (user_id, op_id, seen_at) VALUES (:user_id, :op_id, :seen_at) "
+             "ON CONFLICT DO NOTHING RETURNING op_id"),
+        {"user_id": user_id, "op_id": op_id, "seen_at": local_now()},
+    ).first() is not None
+
+def _release(db, user_id, op_id):
+    # A rejected op is forgotten so the client may fix it and send it again
+    db.execute(text("DELETE FROM sync_ops WHERE user_id = :user_id AND op_id = :op_id"),
+               {"user_id": user_id, "op_id": op_id})
+
+def _existing_task(db, user_id, task_id):
+    db_item = get_task(db, user_id, task_id)
+    if db_item is None:
+        raise Rejected("Task not found")
+    return db_item
+
+# Returns the task a create, update or complete op left behind
+def _apply(db, user, op):
+    if op.type == "task.create":
+        if db.get(TaskItem, op.task.id) is not None:
+            raise Rejected("Task already exists")
+        return apply_create(db, user.id, op.task)
+    elif op.type == "task.update":
+        if op.task.id != op.task_id:
+            raise Rejected("Task id does not match")
+        db_item = _existing_task(db, user.id, op.task_id)
+        apply_update(db, db_item, op.task)
+        return db_item
+    elif op.type == "task.delete":
+        db.delete(_existing_task(db, user.id, op.task_id))
+    elif op.type == "task.complete":
+        db_item = _existing_task(db, user.id, op.task_id)
+        apply_done(db, db_item, op.done)
+        return db_item
+    else:
+        # Earlier ops may have paid achievement rewards with plain SQL; start from the row
+        db.refresh(user)
+        apply_economy(db, user, op.delta)
+
+# Replay a client's offline queue in order, in one transaction. Every op carries a
+# client-generated id; ids already applied are skipped, so retrying a batch after a
+# dropped response is safe. Each op runs in its own savepoint: a rejected op (an unknown
+# task, a value the schema refuses) is undone on its own and does not stop the rest.
+@router.post("/users/{user_id}/sync")
+def sync(user_id: int, batch: SyncIn, db: Session = Depends(get_user_db)):
+    user = db.query(UserItem).filter(UserItem.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    results = []
+    # task id -> (due_at, done) as the batch left it, None if deleted; for the reminders
+    tasks_touched = {}
+    try:
+        for op in batch.ops:
+            if not _claim(db, user_id, op.op_id):
+                results.append({"op_id": op.op_id, "status": "duplicate"})
+                continue
+            try:
+                with db.begin_nested():
+                    db_item = _apply(db, user, op)
+                    db.flush()
+            except (Rejected, IntegrityError, StatementError) as e:
+                detail = str(e.orig) if isinstance(e, StatementError) and e.orig is not None else str(e)
+                _release(db, user_id, op.op_id)
+                results.append({"op_id": op.op_id, "status": "rejected", "detail": detail})
+                continue
+            if op.type == "task.delete":
+                tasks_touched[op.task_id] = None
+            elif db_item is not None:
+                tasks_touched[db_item.id] = (db_item.due_at, db_item.done)
+            results.append({"op_id": op.op_id, "status": "applied"})
+
+        cutoff = (date.today() - timedelta(days=SYNC_OP_TTL_DAYS)).isoformat()
+        db.execute(text("DELETE FROM sync_ops WHERE user_id = :user_id AND seen_at < :cutoff"),
+                   {"user_id": user_id, "cutoff": cutoff})
+        db.commit()
+        db.refresh(user)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
+
+    for task_id, state in tasks_touched.items():
+        if state is None:
+            reminders.task_deleted(task_id)
+        else:
+            reminders.task_changed(task_id, user_id, *state)
+    if any(op.type == "economy" for op in batch.ops):
+        leaderboard.update_user(user)
+    # The profile after the batch, so the client can replace its optimistic copy
+    row = db.execute(select(*USER_ROWS.columns).where(UserItem.id == user_id)).first()
+    return {"results": results, "user": USER_ROWS.one(row)}
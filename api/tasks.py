@@ -1,11 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, Field, ConfigDict
 from typing import Optional
-from db import get_db, Base
-from sqlalchemy import Column, Integer, String
+from db import get_user_db, Base
+from sessions import require_user
+from sqlalchemy import Column, Integer, String, select
 from sqlalchemy.orm import Session
+from serialize import RowMapper, json_response
+from datetime import date
+import guild
+import stats
+import achievements
+import reminders
 
-router = APIRouter(prefix="/api", tags=["tasks"])
+router = APIRouter(prefix="/api", tags=["tasks"], dependencies=[Depends(require_user)])
 
 class TaskItem(Base):
     __tablename__ = "tasks"
@@ -47,29 +54,71 @@ class TaskOut(BaseModel):
     poms_done: Optional[int] = Field(None, serialization_alias="pomsDone")
     poms_estimate: Optional[int] = Field(None, serialization_alias="pomsEstimate")
 
+TASK_ROWS = RowMapper(TaskOut, TaskItem)
+
 @router.get("/users/{user_id}/tasks", response_model=list[TaskOut])
-def list_tasks(user_id: int, db: Session = Depends(get_db)):
-    db_items = db.query(TaskItem).filter(TaskItem.user_id == user_id).all()
-    return db_items
+def list_tasks(user_id: int, db: Session = Depends(get_user_db)):
+    rows = db.execute(select(*TASK_ROWS.columns).where(TaskItem.user_id == user_id)).all()
+    return json_response(TASK_ROWS.many(rows))
+
+# Completion feeds check-ins, guild hearts, the daily rollup and achievements in the same transaction
+def _on_done_changed(db, user_id, task_id, was_done, done):
+    today = date.today()
+    if done and not was_done:
+        guild.on_task_completed(db, user_id, task_id, today)
+        stats.record(db, user_id, today, tasks_completed=1)
+        achievements.count(db, user_id, "task_complete", tasks_completed=1)
+    elif was_done and not done:
+        if guild.on_task_uncompleted(db, user_id, task_id, today):
+            stats.record(db, user_id, today, tasks_completed=-1)
+            achievements.count(db, user_id, "task_complete", tasks_completed=-1)
+
+# Write helpers shared with the sync endpoint; they stage changes and the caller commits
+def apply_create(db, user_id, item):
+    db_item = TaskItem(
+        id=item.id,
+        user_id=user_id,
+        title=item.title,
+        type=item.type,
+        category=item.category,
+        difficulty=item.difficulty,
+        due_at=item.due_at,
+        done=int(item.done),
+        poms_done=item.poms_done,
+        poms_estimate=item.poms_estimate
+    )
+    db.add(db_item)
+    db.flush()
+    _on_done_changed(db, user_id, db_item.id, False, item.done)
+    return db_item
+
+def apply_update(db, db_item, item):
+    was_done = bool(db_item.done)
+    db_item.title = item.title
+    db_item.type = item.type
+    db_item.category = item.category
+    db_item.difficulty = item.difficulty
+    db_item.due_at = item.due_at
+    db_item.done = int(item.done)
+    db_item.poms_done = item.poms_done
+    db_item.poms_estimate = item.poms_estimate
+    _on_done_changed(db, db_item.user_id, db_item.id, was_done, item.done)
+
+def apply_done(db, db_item, done):
+    was_done = bool(db_item.done)
+    db_item.done = int(done)
+    _on_done_changed(db, db_item.user_id, db_item.id, was_done, done)
+
+def get_task(db, user_id, task_id):
+    return db.query(TaskItem).filter(
+        TaskItem.id == task_id,
+        TaskItem.user_id == user_id
+    ).first()
 
 @router.post("/users/{user_id}/tasks", status_code=201, response_model=TaskOut)
-def create_task(item: TaskIn, user_id: int, db: Session = Depends(get_db)):
+def create_task(item: TaskIn, user_id: int, db: Session = Depends(get_user_db)):
     try:
-        db_item = TaskItem(
-            id=item.id,
-            user_id=user_id,
-            title=item.title,
-            type=item.type,
-            category=item.category,
-            difficulty=item.difficulty,
-            due_at=item.due_at,
-            done=int(item.done),
-            poms_done=item.poms_done,
-            poms_estimate=item.poms_estimate
-        )
-        db.add(db_item)
-        db.flush()
-        
+        db_item = apply_create(db, user_id, item)
         db.commit()
         db.refresh(db_item)
         
@@ -77,28 +126,18 @@ def create_task(item: TaskIn, user_id: int, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
 
+    reminders.task_changed(db_item.id, user_id, db_item.due_at, db_item.done)
     return db_item
 
 @router.put("/users/{user_id}/tasks/{task_id}", response_model=TaskOut)
-def update_task(user_id: int, task_id: str, item: TaskIn, db: Session = Depends(get_db)):
-    db_item = db.query(TaskItem).filter(
-        TaskItem.id == task_id,
-        TaskItem.user_id == user_id
-    ).first()
+def update_task(user_id: int, task_id: str, item: TaskIn, db: Session = Depends(get_user_db)):
+    db_item = get_task(db, user_id, task_id)
     
     if not db_item:
         raise HTTPException(status_code=404, detail="Task not found")
     
     try:
-        db_item.title = item.title
-        db_item.type = item.type
-        db_item.category = item.category
-        db_item.difficulty = item.difficulty
-        db_item.due_at = item.due_at
-        db_item.done = int(item.done)
-        db_item.poms_done = item.poms_done
-        db_item.poms_estimate = item.poms_estimate
-        
+        apply_update(db, db_item, item)
         db.commit()
         db.refresh(db_item)
         
@@ -106,14 +145,12 @@ def update_task(user_id: int, task_id: str, item: TaskIn, db: Session = Depends(
         db.rollback()
         raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
     
+    reminders.task_changed(db_item.id, user_id, db_item.due_at, db_item.done)
     return db_item
 
 @router.delete("/users/{user_id}/tasks/{task_id}", status_code=204)
-def delete_task(user_id: int, task_id: str, db: Session = Depends(get_db)):
-    db_item = db.query(TaskItem).filter(
-        TaskItem.id == task_id,
-        TaskItem.user_id == user_id
-    ).first()
+def delete_task(user_id: int, task_id: str, db: Session = Depends(get_user_db)):
+    db_item = get_task(db, user_id, task_id)
     
     if not db_item:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -125,4 +162,5 @@ def delete_task(user_id: int, task_id: str, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
     
+    reminders.task_deleted(task_id)
     return None
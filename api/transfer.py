@@ -0,0 +1,390 @@
+import zlib
+import secrets
+import tempfile
+import orjson
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import text, bindparam
+from db import shard_router, local_now
+from sessions import require_user
+from admission import write_slot
+from leaderboard import leaderboard
+from reminders import reminders
+import feed
+import stats
+
+router = APIRouter(prefix="/api", tags=["transfer"], dependencies=[Depends(require_user)])
+
+EXPORT_FORMAT = "questify-export"
+EXPORT_VERSION = 1
+# Rows fetched per cursor round trip on export, and inserted per transaction on import
+EXPORT_YIELD_PER = 1000
+IMPORT_CHUNK_ROWS = 2000
+# Output is handed to the server in pieces of about this size
+EXPORT_FLUSH_BYTES = 64 * 1024
+# A single NDJSON line longer than this is refused rather than buffered
+MAX_LINE_BYTES = 1024 * 1024
+INFLATE_PIECE_BYTES = 256 * 1024
+# An upload is held in memory up to this size while it is checked, then spooled to disk
+SPOOL_MEMORY_BYTES = 4 * 1024 * 1024
+
+PROFILE_COLUMNS = ("level", "xp", "xp_max", "hp", "mana", "gold", "diamonds", "guild_rank", "guild_streak",
+                   "strength", "dexterity", "intelligence", "wisdom", "charisma", "user_class", "last_rollover")
+# Balances, progression and owned items are not taken from an uploaded export: it is not
+# signed, and a hand-edited one could otherwise mint gold, levels or items. The same goes
+# for the sections marked trusted_only: streaks, check-in runs and achievement counters
+# feed the thresholds that pay rewards and promote in the guild. The account keeps a new
+# account's starting values, the daily rollups are rebuilt from the imported logs, and
+# the ledger and other history load as a record. Only shard moves, which read the export
+# straight from the source shard, carry everything over.
+ECONOMY_COLUMNS = frozenset(("level", "xp", "xp_max", "hp", "mana", "gold", "diamonds", "guild_rank",
+                             "guild_streak", "strength", "dexterity", "intelligence", "wisdom", "charisma"))
+
+class Section:
+    # One table's worth of a user's data. Surrogate ids are not exported, except quest ids,
+    # which other sections refer to and which are remapped on import. Task ids are chosen
+    # by clients and kept, unless another account on this server already has the id.
+    def __init__(self, name, columns, export_sql=None, import_sql=None, quest_ref=None, task_ref=None,
+                 trusted_only=False):
+        self.name = name
+        self.columns = columns
+        cols = ", ".join(columns)
+        self.export_sql = text(export_sql or f"SELECT {cols} FROM {name} WHERE user_id = :user_id")
+        params = ", ".join(f":{c}" for c in columns)
+        self.import_sql = text(import_sql or f"INSERT INTO {name} (user_id, {cols}) VALUES (:user_id, {params})")
+        self.quest_ref = quest_ref
+        self.task_ref = task_ref
+        self.trusted_only = trusted_only
+
+# Parents come before the sections that point at them
+SECTIONS = [
+    Section("profile", PROFILE_COLUMNS,
+            export_sql=f"SELECT {', '.join(PROFILE_COLUMNS)} FROM users WHERE id = :user_id",
+            import_sql="UPDATE users SET " + ", ".join(f"{c} = :{c}" for c in PROFILE_COLUMNS)
+                       + " WHERE id = :user_id"),
+    Section("avatars", ("class", "appearance", "str", "int")),
+    Section("quests", ("id", "title", "type", "rank", "notes", "tags", "due_at", "repeats_rule", "difficulty",
+                       "is_negative", "is_active", "created_at")),
+    Section("subquests", ("quest_id", "title", "is_done"),
+            export_sql="SELECT s.quest_id, s.title, s.is_done FROM subquests s "
+                       "JOIN quests q ON q.id = s.quest_id WHERE q.user_id = :user_id",
+            import_sql="INSERT INTO subquests (quest_id, title, is_done) VALUES (:quest_id, :title, :is_done)",
+            quest_ref="quest_id"),
+    Section("quest_logs", ("quest_id", "logged_at", "outcome", "xp_delta", "gold_delta", "hp_delta"),
+            quest_ref="quest_id"),
+    Section("streaks", ("quest_id", "count", "last_day"), quest_ref="quest_id", trusted_only=True),
+    Section("tasks", ("id", "title", "type", "category", "difficulty", "due_at", "done", "poms_done",
+                      "poms_estimate")),
+    Section("task_logs", ("task_id", "logged_at", "outcome"), task_ref="task_id"),
+    Section("daily_checkins", ("current_run", "last_day"), trusted_only=True),
+    Section("focus_sessions", ("quest_id", "task_id", "started_at", "ended_at", "target_min", "actual_min",
+                               "outcome"), quest_ref="quest_id", task_ref="task_id"),
+    Section("focus_daily", ("day", "task_id", "sessions", "completed", "minutes"), task_ref="task_id"),
+    Section("economy_ledger", ("delta_gold", "delta_diamonds", "reason", "meta_json", "created_at")),
+    Section("user_daily_stats", ("day", "xp", "gold", "diamonds", "strength", "dexterity", "intelligence",
+                                 "wisdom", "charisma", "tasks_completed", "quests_completed", "quests_failed"),
+            trusted_only=True),
+    Section("narrative_events", ("event_type", "text", "created_at")),
+    Section("custom_rewards", ("label", "cost_diamonds", "is_active")),
+    # Shop items and achievements are shared data; they are matched by id and code
+    # and rows pointing at something this server doesn't have are dropped
+    Section("inventory", ("item_id", "qty"),
+            import_sql="INSERT INTO inventory (user_id, item_id, qty) "
+                       "SELECT :user_id, id, :qty FROM shop_items WHERE id = :item_id", trusted_only=True),
+    Section("user_achievements", ("code", "unlocked_at"),
+            export_sql="SELECT a.code, ua.unlocked_at FROM user_achievements ua "
+                       "JOIN achievements a ON a.id = ua.achievement_id WHERE ua.user_id = :user_id",
+            import_sql="INSERT INTO user_achievements (user_id, achievement_id, unlocked_at) "
+                       "SELECT :user_id, id, :unlocked_at FROM achievements WHERE code = :code",
+            trusted_only=True),
+    Section("user_counters", ("metric", "value"), trusted_only=True),
+]
+SECTIONS_BY_NAME = {s.name: s for s in SECTIONS}
+_UPLOAD_PROFILE_SQL = text("UPDATE users SET " + ", ".join(f"{c} = :{c}" for c in PROFILE_COLUMNS
+                                                           if c not in ECONOMY_COLUMNS) + " WHERE id = :user_id")
+
+def _export_lines(user_id, engine=None):
+    # One read transaction, so every section comes from the same snapshot; rows are
+    # pulled EXPORT_YIELD_PER at a time and never collected
+    engine = engine or shard_router.engine(user_id)
+    with engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN")
+        try:
+            yield orjson.dumps({"format": EXPORT_FORMAT, "version": EXPORT_VERSION,
+                                "user_id": user_id, "exported_at": local_now()})
+            for section in SECTIONS:
+                yield orjson.dumps({"section": section.name, "columns": section.columns})
+                result = conn.execution_options(yield_per=EXPORT_YIELD_PER).execute(
+                    section.export_sql, {"user_id": user_id})
+                for row in result:
+                    yield orjson.dumps(tuple(row))
+        finally:
+            conn.rollback()
+
+def _export_chunks(user_id, compress):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buf = bytearray()
+    for line in _export_lines(user_id):
+        buf += line
+        buf += b"\n"
+        if len(buf) >= EXPORT_FLUSH_BYTES:
+            out = compressor.compress(bytes(buf)) if compressor else bytes(buf)
+            buf.clear()
+            if out:
+                yield out
+    tail = bytes(buf)
+    if compressor:
+        tail = compressor.compress(tail) + compressor.flush()
+    if tail:
+        yield tail
+
+# A user's full history as NDJSON: a header line, then per section a line naming its
+# columns followed by one JSON array per row. gzip=true compresses the stream.
+@router.get("/users/{user_id}/export")
+def export_user(user_id: int, gzip: bool = False):
+    if not _exists(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    filename = f"questify-user-{user_id}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        _export_chunks(user_id, gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+class InvalidExport(Exception):
+    pass
+
+class Importer:
+    # Parses lines one at a time. Full chunks of IMPORT_CHUNK_ROWS rows are queued in
+    # `ready` and written by write_ready(), one transaction each; only the quest id map
+    # (one entry per quest) and the renamed task ids outlive a chunk. With check_only, lines are only validated
+    # and rows are dropped as they are parsed; only a trusted source sets the economy.
+    def __init__(self, user_id, engine=None, check_only=False, trusted=False):
+        self.user_id = user_id
+        self.check_only = check_only
+        self.trusted = trusted
+        self.engine = engine or shard_router.engine(user_id)
+        self.header = False
+        self.section = None
+        self.positions = None
+        self.rows = []
+        self.ready = []
+        self.quest_ids = {}
+        self.task_ids = {}
+        self.profile = None
+        self.counts = {}
+
+    def line(self, obj):
+        if not self.header:
+            if not isinstance(obj, dict) or obj.get("format") != EXPORT_FORMAT:
+                raise InvalidExport("Not a Questify export")
+            if obj.get("version") != EXPORT_VERSION:
+                raise InvalidExport(f"Unsupported export version {obj.get('version')}")
+            self.header = True
+        elif isinstance(obj, dict):
+            self._start_section(obj)
+        elif self.section is None or not isinstance(obj, list) or len(obj) != len(self.positions):
+            raise InvalidExport("Row does not match its section")
+        else:
+            self.rows.append([obj[i] for i in self.positions])
+            if len(self.rows) >= IMPORT_CHUNK_ROWS:
+                self._queue()
+
+    def _start_section(self, obj):
+        self._queue()
+        section = SECTIONS_BY_NAME.get(obj.get("section"))
+        if section is None:
+            raise InvalidExport(f"Unknown section {obj.get('section')!r}")
+        columns = obj.get("columns") or []
+        if sorted(columns) != sorted(section.columns):
+            raise InvalidExport(f"Columns of section {section.name} do not match")
+        # Rows are reordered into our column order, whatever order the file uses
+        self.positions = [columns.index(c) for c in section.columns]
+        self.section = section
+
+    def _queue(self):
+        if self.rows:
+            if not self.check_only:
+                self.ready.append((self.section, self.rows))
+            self.rows = []
+
+    def write_ready(self):
+        ready, self.ready = self.ready, []
+        for section, rows in ready:
+            self._write(section, rows)
+
+    def _write(self, section, rows):
+        if section.trusted_only and not self.trusted:
+            return
+        self.counts[section.name] = self.counts.get(section.name, 0) + len(rows)
+        if section.name == "profile":
+            self.profile = dict(zip(section.columns, rows[-1]))
+            return
+        params = [dict(zip(section.columns, row), user_id=self.user_id) for row in rows]
+        with self.engine.begin() as conn:
+            if section.name == "quests":
+                for p in params:
+                    old_id = p.pop("id")
+                    self.quest_ids[old_id] = conn.execute(
+                        text("INSERT INTO quests (user_id, title, type, rank, notes, tags, due_at, repeats_rule, "
+                             "difficulty, is_negative, is_active, created_at) VALUES (:user_id, :title, :type, "
+                             ":rank, :notes, :tags, :due_at, :repeats_rule, :difficulty, :is_negative, :is_active, "
+                             ":created_at) RETURNING id"),
+                        p,
+                    ).scalar()
+                return
+            if section.name == "tasks":
+                self._rename_taken_tasks(conn, params)
+            if section.task_ref:
+                ref = section.task_ref
+                for p in params:
+                    p[ref] = self.task_ids.get(p[ref], p[ref])
+            if section.quest_ref:
+                # Drop rows for quests that were not in the file
+                ref = section.quest_ref
+                params = [p for p in params if p[ref] is None or p[ref] in self.quest_ids]
+                for p in params:
+                    if p[ref] is not None:
+                        p[ref] = self.quest_ids[p[ref]]
+            if params:
+                conn.execute(section.import_sql, params)
+
+    def _rename_taken_tasks(self, conn, params):
+        # Restoring into a second account while the first still exists: its task ids are
+        # taken, so those tasks get fresh ids
+        ids = [p["id"] for p in params]
+        taken = set(conn.execute(text("SELECT id FROM tasks WHERE id IN :ids").bindparams(
+            bindparam("ids", expanding=True)), {"ids": ids}).scalars())
+        for p in params:
+            if p["id"] in taken:
+                new_id = self.task_ids[p["id"]] = secrets.token_urlsafe(12)
+                p["id"] = new_id
+
+    def finish(self):
+        if not self.header:
+            raise InvalidExport("Empty import")
+        if self.check_only:
+            return
+        self._queue()
+        self.write_ready()
+        with self.engine.begin() as conn:
+            if self.profile is not None:
+                sql = SECTIONS_BY_NAME["profile"].import_sql if self.trusted else _UPLOAD_PROFILE_SQL
+                conn.execute(sql, {**self.profile, "user_id": self.user_id})
+            if not self.trusted:
+                stats.rebuild(conn, self.user_id)
+
+def _exists(user_id):
+    with shard_router.engine(user_id).connect() as conn:
+        return conn.execute(text("SELECT 1 FROM users WHERE id = :id"), {"id": user_id}).first() is not None
+
+def _purge(user_id, engine=None):
+    # Undo a failed import; the account was empty before it started
+    engine = engine or shard_router.engine(user_id)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM subquests WHERE quest_id IN (SELECT id FROM quests WHERE user_id = :user_id)"),
+                     {"user_id": user_id})
+        for section in reversed(SECTIONS):
+            if section.name not in ("profile", "subquests"):
+                conn.execute(text(f"DELETE FROM {section.name} WHERE user_id = :user_id"), {"user_id": user_id})
+
+def _has_data(user_id):
+    with shard_router.engine(user_id).connect() as conn:
+        return conn.execute(
+            text("SELECT 1 FROM tasks WHERE user_id = :user_id UNION ALL "
+                 "SELECT 1 FROM quests WHERE user_id = :user_id UNION ALL "
+                 "SELECT 1 FROM economy_ledger WHERE user_id = :user_id LIMIT 1"),
+            {"user_id": user_id},
+        ).first() is not None
+
+def _refresh_leaderboard(user_id):
+    with shard_router.engine(user_id).connect() as conn:
+        user = conn.execute(text("SELECT id, display_name, level, xp, guild_rank FROM users WHERE id = :id"),
+                            {"id": user_id}).first()
+    if user:
+        leaderboard.update_user(user)
+
+def _inflate(decompressor, data):
+    # A 64 KB network chunk of a well-compressed export can hold megabytes of text,
+    # so it is inflated in pieces of bounded size
+    while data:
+        out = decompressor.decompress(data, INFLATE_PIECE_BYTES)
+        data = decompressor.unconsumed_tail
+        if out:
+            yield out
+
+async def _lines(request):
+    # Split the request body into lines as it arrives, gunzipping if it starts with the
+    # gzip magic; memory is bounded by one piece of input plus one line
+    decompressor = None
+    first = True
+    buf = b""
+    async for chunk in request.stream():
+        if first and chunk:
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(31)
+            first = False
+        for piece in _inflate(decompressor, chunk) if decompressor else (chunk,):
+            buf += piece
+            *lines, buf = buf.split(b"\n")
+            if len(buf) > MAX_LINE_BYTES:
+                raise InvalidExport("Line too long")
+            for line in lines:
+                yield line
+    if decompressor:
+        buf += decompressor.flush()
+    if buf:
+        yield buf
+
+def _replay(importer, spool):
+    # Second pass, over an upload already checked line by line
+    spool.seek(0)
+    for line in spool:
+        if line.strip():
+            importer.line(orjson.loads(line))
+            importer.write_ready()
+    importer.finish()
+
+# Load an export (plain or gzipped NDJSON) into an existing, empty account. The body is
+# checked as it streams in and spooled; only then is a write slot taken and the rows
+# written, in chunked transactions. On any error the partial import is removed again.
+@router.post("/users/{user_id}/import", status_code=201)
+async def import_user(user_id: int, request: Request):
+    exists = await run_in_threadpool(_exists, user_id)
+    if not exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    if await run_in_threadpool(_has_data, user_id):
+        raise HTTPException(status_code=409, detail="Import needs an empty account")
+
+    checker = Importer(user_id, check_only=True)
+    importer = Importer(user_id)
+    line_no = 0
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES) as spool:
+        try:
+            async for line in _lines(request):
+                line_no += 1
+                if not line.strip():
+                    continue
+                try:
+                    checker.line(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    raise InvalidExport("Invalid JSON")
+                spool.write(line)
+                spool.write(b"\n")
+            checker.finish()
+        except InvalidExport as e:
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: {e}")
+
+        async with write_slot("transfer"):
+            try:
+                await run_in_threadpool(_replay, importer, spool)
+            except Exception as e:
+                await run_in_threadpool(_purge, user_id)
+                raise HTTPException(status_code=500, detail="Internal server error: "+str(e))
+
+    await run_in_threadpool(_refresh_leaderboard, user_id)
+    await run_in_threadpool(reminders.load_user, user_id)
+    feed.heads.forget(user_id)
+    return {"user_id": user_id, "imported": importer.counts}
@@ -24,6 +24,16 @@ CREATE TABLE IF NOT EXISTS avatars (
   int         INTEGER NOT NULL DEFAULT 10
 );
 
+-- Table: calendar_accounts (written by the calendar service's OAuth callbacks)
+CREATE TABLE IF NOT EXISTS calendar_accounts (
+  id            INTEGER PRIMARY KEY,
+  user_id       INTEGER,
+  provider      VARCHAR(16),
+  access_token  TEXT,
+  refresh_token TEXT,
+  expires_at    DATETIME
+);
+
 -- Table: custom_rewards
 CREATE TABLE IF NOT EXISTS custom_rewards (
   id            INTEGER PRIMARY KEY,
@@ -60,9 +70,21 @@ CREATE TABLE IF NOT EXISTS focus_sessions (
   ended_at    TEXT,
   target_min  INTEGER NOT NULL DEFAULT 25,
   actual_min  INTEGER NOT NULL DEFAULT 0,
-  outcome     TEXT CHECK (outcome IN ('success','abandoned','timeout'))
+  outcome     TEXT CHECK (outcome IN ('success','abandoned','timeout')),
+  task_id     TEXT
 );
 
+-- Table: focus_daily
+CREATE TABLE IF NOT EXISTS focus_daily (
+  user_id    INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  day        TEXT NOT NULL,
+  task_id    TEXT NOT NULL DEFAULT '',
+  sessions   INTEGER NOT NULL DEFAULT 0,
+  completed  INTEGER NOT NULL DEFAULT 0,
+  minutes    INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, day, task_id)
+) WITHOUT ROWID;
+
 -- Table: inventory
 CREATE TABLE IF NOT EXISTS inventory (
   id        INTEGER PRIMARY KEY,
@@ -132,7 +154,8 @@ CREATE TABLE IF NOT EXISTS shop_items (
   rarity        TEXT NOT NULL DEFAULT 'Common',
   cost_gold     INTEGER NOT NULL DEFAULT 0,
   cost_diamonds INTEGER NOT NULL DEFAULT 0,
-  meta_json     TEXT NOT NULL DEFAULT '{}'
+  meta_json     TEXT NOT NULL DEFAULT '{}',
+  stock         INTEGER
 );
 
 -- Table: streaks
@@ -155,6 +178,23 @@ CREATE TABLE IF NOT EXISTS subquests (
 -- Table: tasks
 CREATE TABLE IF NOT EXISTS tasks (id TEXT PRIMARY KEY NOT NULL, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE, title TEXT NOT NULL, type TEXT NOT NULL CHECK (type IN ('Habit', 'Daily', 'To-Do')), category TEXT NOT NULL, difficulty TEXT NOT NULL, due_at TEXT, done INTEGER NOT NULL, poms_done INTEGER, poms_estimate INTEGER);
 
+-- Table: sync_ops
+CREATE TABLE IF NOT EXISTS sync_ops (
+  user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  op_id   TEXT NOT NULL,
+  seen_at TEXT NOT NULL,
+  PRIMARY KEY (user_id, op_id)
+) WITHOUT ROWID;
+
+-- Table: task_logs
+CREATE TABLE IF NOT EXISTS task_logs (
+  id         INTEGER PRIMARY KEY,
+  user_id    INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  task_id    TEXT NOT NULL,
+  logged_at  TEXT NOT NULL DEFAULT (datetime('now')),
+  outcome    TEXT NOT NULL DEFAULT 'complete' CHECK (outcome IN ('complete','undo'))
+);
+
 -- Table: user_achievements
 CREATE TABLE IF NOT EXISTS user_achievements (
   user_id       INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
@@ -163,6 +203,32 @@ CREATE TABLE IF NOT EXISTS user_achievements (
   PRIMARY KEY (user_id, achievement_id)
 );
 
+-- Table: user_counters
+CREATE TABLE IF NOT EXISTS user_counters (
+  user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  metric  TEXT NOT NULL,
+  value   INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, metric)
+) WITHOUT ROWID;
+
+-- Table: user_daily_stats
+CREATE TABLE IF NOT EXISTS user_daily_stats (
+  user_id          INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  day              TEXT NOT NULL,
+  xp               INTEGER NOT NULL DEFAULT 0,
+  gold             INTEGER NOT NULL DEFAULT 0,
+  diamonds         INTEGER NOT NULL DEFAULT 0,
+  strength         INTEGER NOT NULL DEFAULT 0,
+  dexterity        INTEGER NOT NULL DEFAULT 0,
+  intelligence     INTEGER NOT NULL DEFAULT 0,
+  wisdom           INTEGER NOT NULL DEFAULT 0,
+  charisma         INTEGER NOT NULL DEFAULT 0,
+  tasks_completed  INTEGER NOT NULL DEFAULT 0,
+  quests_completed INTEGER NOT NULL DEFAULT 0,
+  quests_failed    INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+
 -- Table: user_passwords
 CREATE TABLE IF NOT EXISTS user_passwords (
             user_id INTEGER UNIQUE,
@@ -173,21 +239,51 @@ CREATE TABLE IF NOT EXISTS user_passwords (
 -- Table: users
 CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, email TEXT UNIQUE NOT NULL, display_name TEXT NOT NULL, created_at TEXT NOT NULL DEFAULT (datetime('now')), level INTEGER NOT NULL DEFAULT 1, xp INTEGER NOT NULL DEFAULT 0, xp_max INTEGER NOT NULL DEFAULT (100), hp INTEGER NOT NULL DEFAULT 100, mana INTEGER NOT NULL DEFAULT 50, gold INTEGER NOT NULL DEFAULT 0, diamonds INTEGER NOT NULL DEFAULT 0, guild_rank TEXT NOT NULL DEFAULT 'Bronze', guild_streak INTEGER NOT NULL DEFAULT (0), strength INTEGER NOT NULL DEFAULT (0), dexterity INTEGER NOT NULL DEFAULT (0), intelligence INTEGER NOT NULL DEFAULT (0), wisdom INTEGER NOT NULL DEFAULT (0), charisma INTEGER NOT NULL DEFAULT (0), user_class TEXT NOT NULL DEFAULT Classless, last_rollover TEXT);
 
+-- Index: ix_calendar_accounts_user_id
+CREATE INDEX IF NOT EXISTS ix_calendar_accounts_user_id ON calendar_accounts(user_id);
+
 -- Index: idx_focus_user_time
 CREATE INDEX IF NOT EXISTS idx_focus_user_time ON focus_sessions(user_id, started_at);
 
 -- Index: idx_inventory_user
 CREATE INDEX IF NOT EXISTS idx_inventory_user ON inventory(user_id);
 
+-- Index: idx_inventory_user_item
+CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_user_item ON inventory(user_id, item_id);
+
 -- Index: idx_ledger_user_time
 CREATE INDEX IF NOT EXISTS idx_ledger_user_time ON economy_ledger(user_id, created_at);
 
 -- Index: idx_quest_logs_user_time
 CREATE INDEX IF NOT EXISTS idx_quest_logs_user_time ON quest_logs(user_id, logged_at);
 
+-- Index: idx_narrative_events_user_time
+CREATE INDEX IF NOT EXISTS idx_narrative_events_user_time ON narrative_events(user_id, created_at);
+
+-- Index: idx_quest_logs_quest_time
+CREATE INDEX IF NOT EXISTS idx_quest_logs_quest_time ON quest_logs(quest_id, logged_at);
+
+-- Index: idx_subquests_quest
+CREATE INDEX IF NOT EXISTS idx_subquests_quest ON subquests(quest_id);
+
+-- Index: idx_task_logs_user_time
+CREATE INDEX IF NOT EXISTS idx_task_logs_user_time ON task_logs(user_id, logged_at);
+
 -- Index: idx_quests_user_type
 CREATE INDEX IF NOT EXISTS idx_quests_user_type ON quests(user_id, type);
 
+-- Index: idx_tasks_user
+CREATE INDEX IF NOT EXISTS idx_tasks_user ON tasks(user_id);
+
+-- Index: idx_users_display_name (login, and the name check at signup)
+CREATE INDEX IF NOT EXISTS idx_users_display_name ON users(display_name);
+
+-- Index: idx_tasks_due_pending (reminders load pending tasks in due_at order)
+CREATE INDEX IF NOT EXISTS idx_tasks_due_pending ON tasks(due_at) WHERE done = 0;
+
+-- Index: idx_quests_due_active
+CREATE INDEX IF NOT EXISTS idx_quests_due_active ON quests(due_at) WHERE is_active = 1;
+
 -- Trigger: quests_ad
 CREATE TRIGGER IF NOT EXISTS quests_ad AFTER DELETE ON quests BEGIN
   INSERT INTO quest_search(quest_search, rowid, title, notes) VALUES('delete', old.id, old.title, old.notes);
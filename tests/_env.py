@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# The app's modules are flat files in api/ and read their settings at import, so this is
+# imported before any of them: a throwaway data directory, a fixed signing key, and none
+# of the background threads or load shedding. Benchmarks import it too.
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api")
+sys.path.insert(0, API_DIR)
+os.environ["QUESTIFY_DATA_DIR"] = tempfile.mkdtemp(prefix="questify-tests-")
+os.environ["CALENDAR_DB"] = os.path.join(os.environ["QUESTIFY_DATA_DIR"], "calendar_local.db")
+os.environ.setdefault("SESSION_KEYS", "test:not-a-secret")
+os.environ["ADMISSION_ENABLED"] = "0"
+os.environ["MAINTENANCE_ENABLED"] = "0"
+os.environ["REMINDERS_ENABLED"] = "0"
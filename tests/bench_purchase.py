@@ -0,0 +1,107 @@
+# Concurrent purchases through the real HTTP stack: uvicorn in its own process, client
+# threads here buying from a limited and an unlimited item for random users as fast as they
+# can. Afterwards the books are checked: nothing oversold, no negative balance, one
+# ledger row per purchase, and no request failed with a database error.
+#
+#   python tests/bench_purchase.py [clients] [seconds]
+#   python tests/bench_purchase.py 32 5
+#
+# The clients share the machine with the server; on a single core they take a good part
+# of the CPU, so the rate printed is a floor for the server alone.
+import sys
+import time
+import random
+import socket
+import os
+import threading
+import subprocess
+import _env
+import httpx
+from sqlalchemy import text
+from db import engine, init_schema
+import sessions
+
+USERS = 200
+STOCK = 500
+START_GOLD = 40
+
+def _seed():
+    init_schema()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, email, display_name, gold) VALUES (:id, :email, 'bench', :gold)"),
+                     [{"id": i, "email": f"b{i}@example.com", "gold": START_GOLD} for i in range(1, USERS + 1)])
+        conn.execute(text("INSERT INTO shop_items (id, kind, name, cost_gold, stock) VALUES "
+                          "(1, 'pet', 'limited', 1, :stock), (2, 'consumable', 'potion', 1, NULL)"),
+                     {"stock": STOCK})
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _client(base, tokens, stop, results):
+    statuses = {}
+    latencies = []
+    with httpx.Client(base_url=base, timeout=30) as http:
+        while time.monotonic() < stop:
+            user_id = random.randint(1, USERS)
+            start = time.perf_counter()
+            response = http.post(f"/api/users/{user_id}/shop/purchases",
+                                 json={"item_id": random.choice((1, 2))},
+                                 headers={"Authorization": f"Bearer {tokens[user_id]}"})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    results.append((statuses, latencies))
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    _seed()
+    tokens = {i: sessions.issue(i)[0] for i in range(1, USERS + 1)}
+
+    # As deployed, with the write gate on: it is what keeps writers from piling up in
+    # busy_timeout. The server shares the data directory set up by _env.
+    port = _free_port()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:API", "--app-dir", _env.API_DIR,
+                               "--port", str(port), "--log-level", "warning"],
+                              env={**os.environ, "ADMISSION_ENABLED": "1"})
+    while True:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/health")
+            break
+        except httpx.TransportError:
+            time.sleep(0.1)
+
+    results = []
+    stop = time.monotonic() + seconds
+    threads = [threading.Thread(target=_client, args=(f"http://127.0.0.1:{port}", tokens, stop, results))
+               for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.terminate()
+    server.wait()
+
+    statuses = {}
+    latencies = sorted(l for _, ls in results for l in ls)
+    for counts, _ in results:
+        for status, n in counts.items():
+            statuses[status] = statuses.get(status, 0) + n
+    with engine.connect() as conn:
+        stock = conn.execute(text("SELECT stock FROM shop_items WHERE id = 1")).scalar()
+        sold = conn.execute(text("SELECT COALESCE(SUM(qty), 0) FROM inventory WHERE item_id = 1")).scalar()
+        negative = conn.execute(text("SELECT COUNT(*) FROM users WHERE gold < 0 OR diamonds < 0")).scalar()
+        ledger = conn.execute(text("SELECT COUNT(*) FROM economy_ledger WHERE reason = 'purchase'")).scalar()
+        spent = conn.execute(text("SELECT SUM(:gold - gold) FROM users"), {"gold": START_GOLD}).scalar()
+
+    print(f"{clients} clients, {seconds:g} s, statuses {dict(sorted(statuses.items()))}")
+    print(f"  {statuses.get(201, 0) / seconds:.0f} purchases/s, {len(latencies) / seconds:.0f} requests/s, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"  limited item: {sold} sold + {stock} left = {sold + stock} (stock was {STOCK})")
+    print(f"  negative balances: {negative}; ledger rows {ledger} for {statuses.get(201, 0)} purchases; "
+          f"gold spent {spent}")
+    ok = (sold + stock == STOCK and stock >= 0 and negative == 0 and ledger == statuses.get(201, 0) == spent
+          and not any(status >= 500 for status in statuses))
+    print("  books balance" if ok else "  BOOKS DO NOT BALANCE")
+    sys.exit(0 if ok else 1)
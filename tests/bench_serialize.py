@@ -0,0 +1,50 @@
+# Serialization cost of a 1,000-task board, ORM objects through response_model
+# validation against row tuples through RowMapper and orjson.
+#
+#   python tests/bench_serialize.py [tasks]
+import sys
+import time
+import _env  # noqa: F401
+import orjson
+from pydantic import TypeAdapter
+from sqlalchemy import select, text
+from db import engine, SessionLocal, init_schema
+from tasks import TaskItem, TaskOut, TASK_ROWS
+
+def best_of(fn, runs=20):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    init_schema()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, email, display_name) VALUES (1, 'bench@example.com', 'bench')"))
+        conn.execute(text("INSERT INTO tasks (id, user_id, title, type, category, difficulty, due_at, done) "
+                          "VALUES (:id, 1, :title, 'To-Do', 'INT', 'Easy', '2026-01-01', 0)"),
+                     [{"id": f"t{i}", "title": f"task {i}"} for i in range(n)])
+    adapter = TypeAdapter(list[TaskOut])
+
+    def orm_path():
+        with SessionLocal() as db:
+            items = db.scalars(select(TaskItem).where(TaskItem.user_id == 1)).all()
+            adapter.dump_json(adapter.validate_python(items, from_attributes=True), by_alias=True)
+
+    def row_path():
+        with SessionLocal() as db:
+            rows = db.execute(select(*TASK_ROWS.columns).where(TaskItem.user_id == 1)).all()
+            orjson.dumps(TASK_ROWS.many(rows))
+
+    with SessionLocal() as db:
+        items = db.scalars(select(TaskItem).where(TaskItem.user_id == 1)).all()
+        rows = db.execute(select(*TASK_ROWS.columns).where(TaskItem.user_id == 1)).all()
+    print(f"{n} tasks, best of 20")
+    print(f"  query + serialize: ORM + response_model {best_of(orm_path):.1f} ms, "
+          f"row tuples + RowMapper {best_of(row_path):.1f} ms")
+    print(f"  serialize only:    response_model "
+          f"{best_of(lambda: adapter.dump_json(adapter.validate_python(items, from_attributes=True), by_alias=True)):.1f} ms, "
+          f"RowMapper + orjson {best_of(lambda: orjson.dumps(TASK_ROWS.many(rows))):.1f} ms")
@@ -0,0 +1,79 @@
+# Write throughput against the number of shards: worker processes commit small
+# ledger + balance transactions for random users as fast as they can. Each shard count
+# runs in its own process tree and data directory, since DB_SHARDS is read at import.
+#
+#   python tests/bench_shards.py [workers] [seconds] [shard counts...]
+#   python tests/bench_shards.py 4 3 1 2 4
+#
+# More shards only raise throughput when there are cores for the writers to run on; on
+# a single core the gain shows up as lower tail latency from fewer lock waits.
+import os
+import sys
+import time
+import random
+import subprocess
+import multiprocessing as mp
+
+USERS = 400
+
+def _seed():
+    from sqlalchemy import text
+    from db import engine, all_engines, shard_router, init_schema, SHARDED
+    init_schema()
+    shard_router.load()
+    for user_id in range(1, USERS + 1):
+        if SHARDED:
+            with engine.begin() as conn:
+                conn.execute(text("INSERT INTO user_shards (user_id, shard, email, display_name) "
+                                  "VALUES (:id, :shard, :email, 'bench')"),
+                             {"id": user_id, "shard": shard_router.placement(user_id), "email": f"b{user_id}"})
+        with shard_router.engine(user_id).begin() as conn:
+            conn.execute(text("INSERT INTO users (id, email, display_name) VALUES (:id, :email, 'bench')"),
+                         {"id": user_id, "email": f"b{user_id}"})
+    # Pooled connections must not be shared with the forked workers
+    for shard_engine in all_engines():
+        shard_engine.dispose()
+
+def _work(seconds, results):
+    from sqlalchemy import text
+    from db import shard_router
+    stop = time.monotonic() + seconds
+    latencies = []
+    while time.monotonic() < stop:
+        user_id = random.randint(1, USERS)
+        start = time.perf_counter()
+        with shard_router.session(user_id) as db:
+            db.execute(text("INSERT INTO economy_ledger (user_id, delta_gold, delta_diamonds, reason, created_at) "
+                            "VALUES (:id, 1, 0, 'bench', '2026-01-01')"), {"id": user_id})
+            db.execute(text("UPDATE users SET gold = gold + 1 WHERE id = :id"), {"id": user_id})
+            db.commit()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    results.put((len(latencies), latencies[int(len(latencies) * 0.99)]))
+
+def run(workers, seconds):
+    import _env  # noqa: F401  (fresh data directory for this shard count)
+    _seed()
+    results = mp.Queue()
+    procs = [mp.Process(target=_work, args=(seconds, results)) for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    out = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    commits = sum(n for n, _ in out) / seconds
+    print(f"  {os.environ['DB_SHARDS']} shard(s): {commits:.0f} commits/s, "
+          f"worst worker p99 {max(p99 for _, p99 in out) * 1000:.1f} ms", flush=True)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]:
+        run(int(sys.argv[2]), float(sys.argv[3]))
+        sys.exit(0)
+    args = sys.argv[1:]
+    workers = int(args[0]) if args else 4
+    seconds = float(args[1]) if len(args) > 1 else 3
+    shard_counts = [int(a) for a in args[2:]] or [1, 2, 4]
+    print(f"{workers} writer processes, {seconds:g} s per run, {os.cpu_count()} CPU(s)")
+    for shards in shard_counts:
+        subprocess.run([sys.executable, __file__, "--run", str(workers), str(seconds)], check=True,
+                       env={**os.environ, "DB_SHARDS": str(shards)})
@@ -0,0 +1,24 @@
+import itertools
+import pytest
+import _env  # noqa: F401  (must run before the app is imported)
+from fastapi.testclient import TestClient
+import main
+
+_users = itertools.count(1)
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.API) as test_client:
+        yield test_client
+
+# Sign up a fresh user; returns (user_id, headers carrying the session token)
+@pytest.fixture
+def signup(client):
+    def make():
+        n = next(_users)
+        response = client.post("/api/signup", json={"email": f"user{n}@example.com",
+                                                    "display_name": f"user{n}", "password": "password"})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        return body["id"], {"Authorization": f"Bearer {body['token']}"}
+    return make
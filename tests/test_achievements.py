@@ -0,0 +1,92 @@
+import pytest
+from sqlalchemy import text
+from db import engine, shard_router, copy_shared_tables, user_engines
+import achievements
+import profiling
+
+TASK = {"title": "Read", "type": "To-Do", "category": "INT", "difficulty": "Easy"}
+
+@pytest.fixture
+def rules(client, monkeypatch):
+    # Define rules through the admin route; they are removed again so other tests' users
+    # don't earn their rewards
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "admin")
+
+    def define(code, event, metric, minimum, gold=0, diamonds=0):
+        response = client.put("/api/admin/achievements", headers={"X-Admin-Token": "admin"}, json={
+            "code": code, "name": code, "description": code,
+            "rule": {"event": event, "metric": metric, "min": minimum},
+            "reward": {"gold": gold, "diamonds": diamonds}})
+        assert response.status_code == 200, response.text
+    yield define
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM achievements WHERE code LIKE 'test-%'"))
+    copy_shared_tables()
+    achievements.rule_index.invalidate()
+
+def _set_done(client, user_id, headers, task_id, done):
+    response = client.put(f"/api/users/{user_id}/tasks/{task_id}", headers=headers,
+                          json={"id": task_id, **TASK, "done": done})
+    assert response.status_code == 200, response.text
+
+def _wallet(client, user_id, headers):
+    user = client.get(f"/api/users/{user_id}", headers=headers).json()
+    return user["gold"], user["diamonds"]
+
+def _unlocked(client, user_id, headers):
+    return [a["code"] for a in client.get(f"/api/users/{user_id}/achievements", headers=headers).json()]
+
+def test_crossing_a_threshold_unlocks_and_pays_once(client, signup, rules):
+    rules("test-two-tasks", "task_complete", "tasks_completed", 2, gold=10, diamonds=1)
+    rules("test-five-tasks", "task_complete", "tasks_completed", 5, gold=99)
+    user_id, headers = signup()
+    for n in range(3):
+        assert client.post(f"/api/users/{user_id}/tasks", headers=headers,
+                           json={"id": f"{user_id}-{n}", **TASK}).status_code == 201
+
+    _set_done(client, user_id, headers, f"{user_id}-0", True)
+    assert _unlocked(client, user_id, headers) == []
+    _set_done(client, user_id, headers, f"{user_id}-1", True)
+    assert _unlocked(client, user_id, headers) == ["test-two-tasks"]
+    assert _wallet(client, user_id, headers) == (10, 1)
+
+    # Undoing drops the counter below the threshold; crossing it again pays nothing
+    _set_done(client, user_id, headers, f"{user_id}-1", False)
+    _set_done(client, user_id, headers, f"{user_id}-1", True)
+    _set_done(client, user_id, headers, f"{user_id}-2", True)
+    assert _unlocked(client, user_id, headers) == ["test-two-tasks"]
+    assert _wallet(client, user_id, headers) == (10, 1)
+
+def test_rules_on_other_events_are_not_checked(client, signup, rules):
+    rules("test-one-quest", "quest_complete", "quests_completed", 1, gold=5)
+    user_id, headers = signup()
+    assert client.post(f"/api/users/{user_id}/tasks", headers=headers,
+                       json={"id": f"{user_id}-a", **TASK}).status_code == 201
+    _set_done(client, user_id, headers, f"{user_id}-a", True)
+    assert _unlocked(client, user_id, headers) == []
+
+    quest = client.post(f"/api/users/{user_id}/quests", headers=headers, json={"title": "Run"}).json()
+    assert client.post(f"/api/users/{user_id}/quests/{quest['id']}/logs", headers=headers,
+                       json={"outcome": "complete"}).status_code == 201
+    assert _unlocked(client, user_id, headers) == ["test-one-quest"]
+
+def test_backfill_unlocks_history_from_before_the_rule(client, signup, rules):
+    user_id, headers = signup()
+    for n in range(3):
+        assert client.post(f"/api/users/{user_id}/tasks", headers=headers,
+                           json={"id": f"{user_id}-{n}", **TASK}).status_code == 201
+        _set_done(client, user_id, headers, f"{user_id}-{n}", True)
+    with shard_router.engine(user_id).connect() as conn:
+        live = dict(conn.execute(text("SELECT metric, value FROM user_counters WHERE user_id = :id"),
+                                 {"id": user_id}).all())
+
+    rules("test-three-tasks", "task_complete", "tasks_completed", 3, gold=7)
+    assert _unlocked(client, user_id, headers) == []
+    for user_engine in user_engines():
+        with user_engine.connect() as conn:
+            achievements.backfill(conn, batch_size=50)
+    assert _unlocked(client, user_id, headers) == ["test-three-tasks"]
+    assert _wallet(client, user_id, headers)[0] == 7
+    with shard_router.engine(user_id).connect() as conn:
+        assert dict(conn.execute(text("SELECT metric, value FROM user_counters WHERE user_id = :id"),
+                                 {"id": user_id}).all()) == live
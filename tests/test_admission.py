@@ -0,0 +1,49 @@
+import asyncio
+import admission
+import sessions
+
+def _scope(method, path, token=None, client="10.0.0.1"):
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    return {"type": "http", "method": method, "path": path, "headers": headers, "client": (client, 1234)}
+
+def test_heartbeats_match_token_session_ids():
+    path = "/api/users/7/focus/sessions/Zk3_q-9aB1cD2eF3/heartbeats"
+    assert admission.route_class("POST", path) == "heartbeat"
+
+def test_buckets_are_keyed_on_the_session_not_the_path():
+    token, _ = sessions.issue(7)
+    assert admission.client_key(_scope("GET", "/api/users/7/tasks", token)) == 7
+    # Someone else naming user 7 in the path spends their own address's bucket
+    assert admission.client_key(_scope("GET", "/api/users/7/tasks", client="10.0.0.2")) == "10.0.0.2"
+    assert admission.client_key(_scope("GET", "/api/users/7/tasks", token + "x", client="10.0.0.2")) == "10.0.0.2"
+
+def test_heartbeats_do_not_wait_for_the_write_gate():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    statuses = []
+    middleware = admission.AdmissionMiddleware(app)
+    gate = admission.write_gate
+    saved = gate.active, admission.WRITE_WAIT_SECONDS
+    # Every write slot taken and no time to wait: gated writes are turned away at once
+    gate.active, admission.WRITE_WAIT_SECONDS = gate.limit, 0.01
+    try:
+        token, _ = sessions.issue(8)
+        asyncio.run(middleware(_scope("POST", "/api/users/8/focus/sessions/abc_DEF-1/heartbeats", token),
+                               receive, send))
+        asyncio.run(middleware(_scope("POST", "/api/users/8/tasks", token), receive, send))
+    finally:
+        gate.active, admission.WRITE_WAIT_SECONDS = saved
+    assert statuses == [200, 429]
+    assert calls == ["/api/users/8/focus/sessions/abc_DEF-1/heartbeats"]
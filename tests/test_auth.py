@@ -0,0 +1,28 @@
+import bcrypt
+from sqlalchemy import text
+from db import shard_router
+
+def _name(client, user_id, headers):
+    return client.get(f"/api/users/{user_id}", headers=headers).json()["display_name"]
+
+def test_a_taken_display_name_is_refused(client, signup):
+    user_id, headers = signup()
+    response = client.post("/api/signup", json={"email": f"again{user_id}@example.com",
+                                                "display_name": _name(client, user_id, headers), "password": "password"})
+    assert response.status_code == 409
+
+def test_accounts_from_before_names_were_unique_each_log_in(client, signup):
+    user_id, headers = signup()
+    other_id, _ = signup()
+    name = _name(client, user_id, headers)
+    # The second account takes the first one's name, with a password of its own
+    with shard_router.engine(other_id).begin() as conn:
+        conn.execute(text("UPDATE users SET display_name = :name WHERE id = :id"), {"name": name, "id": other_id})
+        conn.execute(text("UPDATE user_passwords SET pass_hash = :hash WHERE user_id = :id"),
+                     {"hash": bcrypt.hashpw(b"other", bcrypt.gensalt()), "id": other_id})
+
+    def login(password):
+        return client.post("/api/login", json={"display_name": name, "password": password})
+    assert login("password").json()["id"] == user_id
+    assert login("other").json()["id"] == other_id
+    assert login("wrong").status_code == 401
@@ -0,0 +1,42 @@
+TASK = {"title": "Read", "type": "To-Do", "category": "INT", "difficulty": "Easy"}
+
+def _bootstrap(client, user_id, headers, etag=None):
+    extra = {"If-None-Match": etag} if etag else {}
+    return client.get(f"/api/users/{user_id}/bootstrap", headers={**headers, **extra})
+
+def test_unchanged_dashboard_is_a_304_until_a_task_changes(client, signup):
+    user_id, headers = signup()
+    task_id = f"{user_id}-a"
+    assert client.post(f"/api/users/{user_id}/tasks", headers=headers, json={"id": task_id, **TASK}).status_code == 201
+
+    first = _bootstrap(client, user_id, headers)
+    assert first.status_code == 200, first.text
+    body = first.json()
+    assert body["user"]["id"] == user_id
+    assert [task["title"] for task in body["tasks"]] == ["Read"]
+    etag = first.headers["ETag"]
+
+    again = _bootstrap(client, user_id, headers, etag)
+    assert (again.status_code, again.content, again.headers["ETag"]) == (304, b"", etag)
+
+    response = client.put(f"/api/users/{user_id}/tasks/{task_id}", headers=headers,
+                          json={"id": task_id, **TASK, "title": "Read two chapters"})
+    assert response.status_code == 200, response.text
+    changed = _bootstrap(client, user_id, headers, etag)
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert [task["title"] for task in changed.json()["tasks"]] == ["Read two chapters"]
+
+def test_todays_recurring_quests_are_included(client, signup):
+    user_id, headers = signup()
+    quest = client.post(f"/api/users/{user_id}/quests", headers=headers,
+                        json={"title": "Stretch", "type": "daily", "repeats_rule": "FREQ=DAILY"}).json()
+    today = _bootstrap(client, user_id, headers).json()["today"]
+    assert [event["title"] for event in today["local"]] == ["Stretch"]
+    assert today["local"][0]["id"] == f"quest-{quest['id']}-{today['date']}"
+
+def test_bootstrap_needs_the_users_session(client, signup):
+    user_id, _ = signup()
+    _, other_headers = signup()
+    assert client.get(f"/api/users/{user_id}/bootstrap").status_code == 401
+    assert _bootstrap(client, user_id, other_headers).status_code == 403
@@ -0,0 +1,55 @@
+from sqlalchemy import text
+from db import shard_router
+import feed
+import guild
+
+def _seed(user_id):
+    # Both sources stamped with the same few timestamps, interleaved ids
+    with shard_router.engine(user_id).begin() as conn:
+        quest_id = conn.execute(text("INSERT INTO quests (user_id, title, type) VALUES (:user_id, 'q', 'todo')"),
+                                {"user_id": user_id}).lastrowid
+        for n in range(12):
+            at = f"2026-02-0{1 + n % 3} 09:00:00"
+            conn.execute(text("INSERT INTO narrative_events (user_id, event_type, text, created_at) "
+                              "VALUES (:user_id, 'milestone', :text, :at)"), {"user_id": user_id, "text": str(n), "at": at})
+            conn.execute(text("INSERT INTO quest_logs (quest_id, user_id, logged_at, outcome, xp_delta, gold_delta) "
+                              "VALUES (:quest_id, :user_id, :at, 'complete', 1, 1)"),
+                         {"quest_id": quest_id, "user_id": user_id, "at": at})
+
+def test_pages_cover_entries_with_equal_timestamps_once(client, signup):
+    user_id, headers = signup()
+    _seed(user_id)
+
+    keys = []
+    params = {"limit": 5}
+    while True:
+        response = client.get(f"/api/users/{user_id}/feed", params=params, headers=headers)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        keys += [(entry["at"], entry["kind"], entry["id"]) for entry in body["items"]]
+        if body["next"] is None:
+            break
+        params = {"limit": 5, "before": body["next"]}
+
+    assert len(keys) == len(set(keys)) == 24
+    assert keys == sorted(keys, reverse=True)
+
+def test_rolled_back_writes_do_not_reach_the_cached_head(client, signup):
+    user_id, headers = signup()
+    assert client.get(f"/api/users/{user_id}/feed", headers=headers).json()["items"] == []
+
+    with shard_router.session(user_id) as db:
+        savepoint = db.begin_nested()
+        guild._add_narrative(db, user_id, [("promotion", "Silver")])
+        savepoint.rollback()
+        guild._add_narrative(db, user_id, [("demotion", "Bronze")])
+        db.commit()
+    with shard_router.session(user_id) as db:
+        guild._add_narrative(db, user_id, [("promotion", "Gold")])
+        db.rollback()
+
+    cached, _ = feed.heads.first_page(user_id, 10)
+    assert [entry["event_type"] for entry in cached] == ["demotion"]
+    # and the head agrees with the tables
+    with shard_router.engine(user_id).connect() as conn:
+        assert [entry["id"] for entry in feed.read(conn, user_id, None, 10)] == [entry["id"] for entry in cached]
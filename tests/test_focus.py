@@ -0,0 +1,86 @@
+import focus
+
+def _start(client, user_id, headers):
+    response = client.post(f"/api/users/{user_id}/focus/sessions", json={}, headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()["session_id"]
+
+def _stall(session_id):
+    focus._active[session_id].last_seen -= focus.FOCUS_TIMEOUT_S + 1
+
+def _outcomes(client, user_id, headers):
+    response = client.get(f"/api/users/{user_id}/focus/sessions", headers=headers)
+    assert response.status_code == 200, response.text
+    return [row["outcome"] for row in response.json()]
+
+def test_reads_expire_only_the_readers_sessions(client, signup):
+    alice, alice_headers = signup()
+    bob, bob_headers = signup()
+    alice_session = _start(client, alice, alice_headers)
+    bob_session = _start(client, bob, bob_headers)
+    _stall(alice_session)
+    _stall(bob_session)
+
+    assert _outcomes(client, alice, alice_headers) == ["timeout"]
+    assert alice_session not in focus._active
+    assert bob_session in focus._active
+    assert _outcomes(client, bob, bob_headers) == ["timeout"]
+
+def test_starting_a_session_expires_other_users(client, signup):
+    alice, alice_headers = signup()
+    bob, bob_headers = signup()
+    _stall(_start(client, alice, alice_headers))
+
+    _start(client, bob, bob_headers)
+    with focus.shard_router.session(alice) as db:
+        rows = db.execute(focus.text("SELECT outcome FROM focus_sessions WHERE user_id = :id"),
+                          {"id": alice}).scalars().all()
+    assert rows == ["timeout"]
+
+def test_ending_a_stalled_session_still_records_it(client, signup):
+    user_id, headers = signup()
+    session_id = _start(client, user_id, headers)
+    _stall(session_id)
+    response = client.post(f"/api/users/{user_id}/focus/sessions/{session_id}/end",
+                           json={"outcome": "abandoned"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert _outcomes(client, user_id, headers) == ["abandoned"]
+
+def test_a_failed_end_keeps_the_session_for_a_retry(client, signup, monkeypatch):
+    user_id, headers = signup()
+    session_id = _start(client, user_id, headers)
+
+    def fail(db, session, outcome):
+        raise RuntimeError("disk I/O error")
+    with monkeypatch.context() as patch:
+        patch.setattr(focus, "_write_session", fail)
+        response = client.post(f"/api/users/{user_id}/focus/sessions/{session_id}/end", json={}, headers=headers)
+    assert response.status_code == 500
+    assert session_id in focus._active
+
+    response = client.post(f"/api/users/{user_id}/focus/sessions/{session_id}/end", json={}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert _outcomes(client, user_id, headers) == ["success"]
+
+def test_pages_do_not_skip_or_repeat_sessions_started_together(client, signup):
+    user_id, headers = signup()
+    with focus.shard_router.session(user_id) as db:
+        db.execute(focus.text("""
+            INSERT INTO focus_sessions (user_id, started_at, ended_at, target_min, actual_min, outcome)
+            VALUES (:user_id, :started_at, :started_at, 25, 25, 'success')
+        """), [{"user_id": user_id, "started_at": f"2026-03-0{1 + i // 4}T09:00:00"} for i in range(9)])
+        db.commit()
+        expected = db.execute(focus.text("SELECT id FROM focus_sessions WHERE user_id = :id "
+                                         "ORDER BY started_at DESC, id DESC"), {"id": user_id}).scalars().all()
+
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = client.get(f"/api/users/{user_id}/focus/sessions", params=params, headers=headers)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        if not page:
+            break
+        seen += [row["id"] for row in page]
+        params = {"limit": 2, "before": page[-1]["started_at"], "before_id": page[-1]["id"]}
+    assert seen == expected
@@ -0,0 +1,58 @@
+from datetime import date, timedelta
+from sqlalchemy import text
+from db import shard_router
+from auth import UserItem
+import guild
+
+START = date(2026, 1, 1)
+
+def _complete(user_id, *days):
+    with shard_router.engine(user_id).begin() as conn:
+        conn.execute(text("INSERT INTO task_logs (user_id, task_id, logged_at, outcome) "
+                          "VALUES (:user_id, 'x', :logged_at, 'complete')"),
+                     [{"user_id": user_id, "logged_at": f"{START + timedelta(days=d)}T08:00:00"} for d in days])
+
+def _state(user_id):
+    with shard_router.engine(user_id).connect() as conn:
+        rank, hearts = conn.execute(text("SELECT guild_rank, guild_streak FROM users WHERE id = :id"),
+                                    {"id": user_id}).one()
+        events = conn.execute(text("SELECT text FROM narrative_events WHERE user_id = :id "
+                                   "AND event_type IN ('promotion', 'demotion') ORDER BY created_at, id"),
+                              {"id": user_id}).scalars().all()
+    return rank, hearts, events
+
+def test_rebuild_reproduces_live_rollovers(client, signup):
+    user_id, _ = signup()
+    # Six active days (promotion), an idle stretch (hearts lost, then demotion), and two
+    # runs with a gap between them inside one rollover window
+    _complete(user_id, *range(0, 6), 10, 11, 12, 14, 15)
+    for day in (3, 8, 17):
+        with shard_router.session(user_id) as db:
+            guild.rollover(db, db.get(UserItem, user_id), START + timedelta(days=day))
+            db.commit()
+    live = _state(user_id)
+    assert live[2] == ["Promoted to Silver rank in the guild", "Demoted to Bronze rank in the guild"]
+
+    with shard_router.engine(user_id).begin() as conn:
+        guild.rebuild(conn)
+    assert _state(user_id) == live
+
+def test_first_rollover_closes_the_days_since_the_first_completion(client, signup):
+    user_id, _ = signup()
+    _complete(user_id, *range(0, 5))
+    with shard_router.session(user_id) as db:
+        user = db.get(UserItem, user_id)
+        events = guild.rollover(db, user, START + timedelta(days=5))
+        db.commit()
+        assert (events, user.guild_rank, user.guild_streak) == ([("promotion", "Silver")], "Silver", 0)
+
+def test_close_span_matches_closing_day_by_day():
+    active = {START + timedelta(days=d) for d in (0, 1, 2, 3, 4, 5, 9, 10, 12)}
+    rank, hearts, expected = "Silver", 3, []
+    for d in range(20):
+        rank, hearts, event = guild.close_day(rank, hearts, START + timedelta(days=d) in active)
+        if event:
+            expected.append((event, rank))
+    result = guild.close_span("Silver", 3, START, START + timedelta(days=19), sorted(active))
+    assert result[:2] == (rank, hearts)
+    assert [(event, new_rank) for event, new_rank, _ in result[2]] == expected
@@ -0,0 +1,50 @@
+from db import user_engines
+from leaderboard import Leaderboard, leaderboard
+
+def _economy(client, user_id, headers, **delta):
+    response = client.patch(f"/api/users/{user_id}/economy", headers=headers, json=delta)
+    assert response.status_code == 200, response.text
+
+def _rank(client, user_id, headers):
+    response = client.get(f"/api/users/{user_id}/rank", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["global_rank"]["rank"]
+
+def test_live_updates_agree_with_a_rebuild_from_the_users_table(client, signup):
+    (a, a_headers), (b, b_headers), (c, c_headers) = signup(), signup(), signup()
+    _economy(client, a, a_headers, xp_delta=400)          # several levels up
+    _economy(client, b, b_headers, xp_delta=60)
+    _economy(client, c, c_headers, xp_delta=90)
+    _economy(client, c, c_headers, xp_delta=-30)          # back level with b, so the id breaks the tie
+    sync = {"ops": [{"op_id": "1", "type": "economy", "delta": {"xp_delta": 5}}]}
+    assert client.post(f"/api/users/{b}/sync", headers=b_headers, json=sync).status_code == 200
+    _economy(client, c, c_headers, xp_delta=5)
+
+    assert _rank(client, a, a_headers) < _rank(client, b, b_headers) < _rank(client, c, c_headers)
+
+    rebuilt = Leaderboard()
+    conns = [e.connect() for e in user_engines()]
+    try:
+        rebuilt.rebuild(*conns)
+    finally:
+        for conn in conns:
+            conn.close()
+    ours = {a, b, c}
+    assert {u: leaderboard.users[u] for u in ours} == {u: rebuilt.users[u] for u in ours}
+    assert ([key for key in leaderboard.global_ranking.keys if key[2] in ours]
+            == [key for key in rebuilt.global_ranking.keys if key[2] in ours])
+
+def test_around_and_guild_reads_centre_on_the_user(client, signup):
+    user_id, headers = signup()
+    _economy(client, user_id, headers, xp_delta=30)
+    response = client.get(f"/api/users/{user_id}/leaderboard", headers=headers, params={"radius": 2, "guild": True})
+    assert response.status_code == 200, response.text
+    entries = response.json()
+    me = [entry for entry in entries if entry["user_id"] == user_id]
+    assert me and me[0]["xp"] == 30 and me[0]["guild_rank"] == "Bronze"
+    assert [entry["rank"] for entry in entries] == list(range(entries[0]["rank"], entries[0]["rank"] + len(entries)))
+    assert len(entries) <= 5
+
+    top = client.get("/api/leaderboard/guilds/Bronze", params={"limit": 1000}).json()
+    assert [entry["rank"] for entry in top] == list(range(1, len(top) + 1))
+    assert client.get(f"/api/users/{user_id}/rank", headers=headers).json()["guild"]["rank"] == me[0]["rank"]
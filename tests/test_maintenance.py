@@ -0,0 +1,110 @@
+import os
+import time
+import sqlite3
+from sqlalchemy import event, text
+from db import engine, get_db_file
+import maintenance
+
+def _wait_for(condition, timeout=3):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def _probe(calls):
+    def job(conn, path):
+        calls.append(path)
+        return 0, {}
+    return job
+
+def test_jobs_wait_for_a_quiet_database(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(maintenance, "QUIET_SECONDS", 0.3)
+    monkeypatch.setattr(maintenance, "TICK_SECONDS", 0.01)
+    monkeypatch.setattr(maintenance, "JOBS", {"probe": (_probe(calls), 0)})
+    scheduler = maintenance.Scheduler()
+    scheduler.start([engine])
+    try:
+        busy_until = time.monotonic() + 0.6
+        while time.monotonic() < busy_until:
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE users SET gold = gold WHERE id = 0"))
+            time.sleep(0.05)
+        assert calls == []
+        assert _wait_for(lambda: calls)
+    finally:
+        scheduler.stop()
+        event.remove(engine, "commit", scheduler.on_commit)
+
+def test_a_failing_job_does_not_stop_the_scheduler(monkeypatch):
+    calls = []
+
+    def broken(conn, path):
+        calls.append("broken")
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(maintenance, "QUIET_SECONDS", 0)
+    monkeypatch.setattr(maintenance, "TICK_SECONDS", 0.01)
+    monkeypatch.setattr(maintenance, "JOBS", {"broken": (broken, 0), "probe": (_probe(calls), 0)})
+    scheduler = maintenance.Scheduler()
+    scheduler.start([])
+    try:
+        assert _wait_for(lambda: calls.count("broken") >= 2 and len(calls) > calls.count("broken"))
+        assert scheduler._thread.is_alive()
+    finally:
+        scheduler.stop()
+
+def test_backups_are_renamed_into_place_and_rotated(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(maintenance, "BACKUP_KEEP", 2)
+    path = get_db_file()
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for day in ("20200101", "20200102", "20200103"):
+        (tmp_path / f"{stem}-{day}-000000.db").write_bytes(b"")
+    (tmp_path / "notes.txt").write_text("kept")
+
+    conn = maintenance._connect(path)
+    try:
+        size, detail = maintenance.backup(conn, path, str(tmp_path))
+    finally:
+        conn.close()
+
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{stem}-20200103-000000.db", os.path.basename(detail["path"]),
+                                                   "notes.txt"])
+    assert size == os.path.getsize(detail["path"]) > 0
+    copy = sqlite3.connect(detail["path"])
+    try:
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        assert copy.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'users'").fetchone()[0] == 1
+    finally:
+        copy.close()
+
+def test_a_failed_backup_leaves_no_file(tmp_path):
+    class FailingCopy:
+        # Writes part of the copy, then fails the way a full disk would
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, sql):
+            return self.conn.execute(sql)
+
+        def backup(self, target, **kwargs):
+            target.execute("CREATE TABLE partial (x)")
+            raise sqlite3.OperationalError("database or disk is full")
+
+    path = get_db_file()
+    conn = maintenance._connect(path)
+    try:
+        try:
+            maintenance.backup(FailingCopy(conn), path, str(tmp_path))
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError("backup did not fail")
+        conn.execute("ROLLBACK")
+    finally:
+        conn.close()
+    assert os.listdir(tmp_path) == []
+
+def test_backups_default_to_the_data_directory():
+    assert maintenance.BACKUP_DIR == os.path.join(os.environ["QUESTIFY_DATA_DIR"], "backups")
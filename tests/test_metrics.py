@@ -0,0 +1,87 @@
+import asyncio
+import importlib
+import httpx
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from db import engine, shard_router
+import metrics
+
+def _reply(request):
+    return httpx.Response(204)
+
+def _outbound_count(host):
+    line = next((l for l in metrics.render_metrics().splitlines()
+                 if l.startswith("questify_http_outbound_duration_seconds_count") and f'host="{host}"' in l), None)
+    return int(line.rsplit(" ", 1)[1]) if line else 0
+
+def test_outbound_calls_are_timed_from_sync_and_async_clients():
+    with httpx.Client(transport=httpx.MockTransport(_reply),
+                      event_hooks=metrics.outbound_hooks(sync=True)) as client:
+        client.post("https://hooks.example.com/reminders")
+    assert _outbound_count("hooks.example.com") == 1
+
+    async def call():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(_reply),
+                                     event_hooks=metrics.outbound_hooks()) as client:
+            await client.get("https://calendar.example.com/events")
+    asyncio.run(call())
+    assert _outbound_count("calendar.example.com") == 1
+
+def _series(text, name, **labels):
+    # Value of the first sample of `name` carrying all of `labels`
+    wanted = [f'{k}="{v}"' for k, v in labels.items()]
+    for line in text.splitlines():
+        if line.startswith(name + "{") and all(w in line for w in wanted):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+def test_requests_are_labelled_by_route_template(client, signup):
+    user_id, headers = signup()
+    client.get(f"/api/users/{user_id}/tasks", headers=headers)
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert _series(body, "questify_http_request_duration_seconds_count",
+                   method="GET", route="/api/users/{user_id}/tasks", status="200") >= 1
+    assert f"/api/users/{user_id}/tasks" not in body
+
+def test_sql_statements_and_time_are_counted_per_request(client, signup):
+    user_id, headers = signup()
+    stats = metrics._routes.get(("GET", "/api/users/{user_id}/tasks", 200))
+    before = (stats.db_queries.sum, stats.db_queries.count, stats.db_seconds.sum) if stats else (0, 0, 0.0)
+    executed = []
+    engine = shard_router.engine(user_id)
+    listener = lambda *args: executed.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get(f"/api/users/{user_id}/tasks", headers=headers).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    stats = metrics._routes[("GET", "/api/users/{user_id}/tasks", 200)]
+    assert stats.db_queries.count == before[1] + 1
+    assert stats.db_queries.sum - before[0] == len(executed) >= 1
+    assert stats.db_seconds.sum > before[2]
+
+class _MockedAsyncClient(httpx.AsyncClient):
+    def __init__(self, **kwargs):
+        super().__init__(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, json={"value": []})), **kwargs)
+
+def test_calendar_service_starts_and_serves_its_outbound_timings(signup, monkeypatch):
+    calendar_app = importlib.import_module("allycia changes.main")
+    calendar_sync = importlib.import_module("allycia changes.calendar_sync")
+    monkeypatch.setattr(calendar_sync.httpx, "AsyncClient", _MockedAsyncClient)
+    user_id, headers = signup()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO calendar_accounts (user_id, provider, access_token) "
+                          "VALUES (:id, 'microsoft', 'token')"), {"id": user_id})
+
+    with TestClient(calendar_app.app) as client:
+        response = client.post("/api/calendar/sync", headers=headers)
+        assert response.status_code == 200, response.text
+        body = client.get("/api/metrics").text
+    assert _series(body, "questify_http_outbound_duration_seconds_count",
+                   host="graph.microsoft.com", status="200") >= 1
+    assert _series(body, "questify_http_request_duration_seconds_count",
+                   method="POST", route="/api/calendar/sync", status="200") == 1
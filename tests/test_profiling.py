@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import contextvars
+import threading
+import profiling
+
+def _spin_mine(stop):
+    while not stop.is_set():
+        pass
+
+def _spin_other(stop):
+    while not stop.is_set():
+        pass
+
+def _run(target, stop, frames=None):
+    def body():
+        if frames is not None:
+            frames.append(sys._getframe())
+        target(stop)
+    thread = threading.Thread(target=body, daemon=True)
+    thread.start()
+    return thread
+
+def _profile(monkeypatch, make_sampler):
+    # Counts stacks in this file as "our code"
+    monkeypatch.setattr(profiling, "_API_DIR", os.path.dirname(__file__))
+    stop = threading.Event()
+    frames = []
+    mine = _run(_spin_mine, stop, frames)
+    other = _run(_spin_other, stop)
+    while not frames:
+        time.sleep(0.001)
+    sampler = make_sampler(mine.ident, other.ident, frames[0])
+    sampler.start()
+    time.sleep(0.2)
+    sampler.stop()
+    stop.set()
+    return sampler.collapsed()
+
+def test_only_the_requests_threads_are_sampled(monkeypatch):
+    def make(mine, other, root):
+        sampler = profiling.Sampler(0.005, threading.get_ident(), None)
+        sampler.threads.add(mine)
+        return sampler
+    out = _profile(monkeypatch, make)
+    assert "_spin_mine" in out
+    assert "_spin_other" not in out
+
+def test_loop_thread_stacks_count_only_under_the_requests_frame(monkeypatch):
+    out = _profile(monkeypatch, lambda mine, other, root: profiling.Sampler(0.005, mine, root))
+    assert "_spin_mine" in out
+    # The other thread as the loop thread never runs under the request's frame
+    out = _profile(monkeypatch, lambda mine, other, root: profiling.Sampler(0.005, other, root))
+    assert out == ""
+
+def test_tracked_endpoints_join_their_requests_sampler():
+    sampler = profiling.Sampler(0.005, threading.get_ident(), None)
+    seen = []
+    endpoint = profiling._tracked(lambda **values: seen.append(threading.get_ident() in sampler.threads))
+
+    def in_worker():
+        # As the threadpool runs it: on another thread, in a copy of the request's context
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(endpoint,))
+        worker.start()
+        worker.join()
+
+    token = profiling._current_sampler.set(sampler)
+    try:
+        in_worker()
+    finally:
+        profiling._current_sampler.reset(token)
+    in_worker()
+    assert seen == [True, False]
+    assert sampler.threads == {threading.get_ident()}
+
+def test_profiles_are_kept_under_the_data_directory():
+    assert profiling.PROFILE_DIR == os.path.join(os.environ["QUESTIFY_DATA_DIR"], "profiles")
@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+from sqlalchemy import event, text
+from db import shard_router
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", before)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+
+def _add_quests(user_id, n):
+    # Each quest with two subquests, three logs and a streak row
+    with shard_router.engine(user_id).begin() as conn:
+        for i in range(n):
+            quest_id = conn.execute(text("INSERT INTO quests (user_id, title, type) VALUES (:user_id, :title, 'todo')"),
+                                    {"user_id": user_id, "title": f"quest {i}"}).lastrowid
+            conn.execute(text("INSERT INTO subquests (quest_id, title) VALUES (:quest_id, :title)"),
+                         [{"quest_id": quest_id, "title": f"step {s}"} for s in range(2)])
+            conn.execute(text("INSERT INTO quest_logs (quest_id, user_id, outcome, xp_delta, gold_delta) "
+                              "VALUES (:quest_id, :user_id, 'complete', 5, 1)"),
+                         [{"quest_id": quest_id, "user_id": user_id}] * 3)
+            conn.execute(text("INSERT INTO streaks (user_id, quest_id, count, last_day) "
+                              "VALUES (:user_id, :quest_id, 3, '2026-01-01')"),
+                         {"user_id": user_id, "quest_id": quest_id})
+
+def test_quest_list_is_one_statement_however_many_quests(client, signup):
+    counts = {}
+    for n in (1, 25):
+        user_id, headers = signup()
+        _add_quests(user_id, n)
+        with count_statements(shard_router.engine(user_id)) as statements:
+            body = client.get(f"/api/users/{user_id}/quests", headers=headers).json()
+        assert len(body) == n
+        assert all(len(q["subquests"]) == 2 and len(q["recent_logs"]) == 3 and q["streak"]["count"] == 3
+                   for q in body)
+        counts[n] = len(statements)
+    assert counts == {1: 1, 25: 1}
+
+def test_quest_detail_is_one_statement(client, signup):
+    user_id, headers = signup()
+    _add_quests(user_id, 3)
+    quest_id = client.get(f"/api/users/{user_id}/quests", headers=headers).json()[0]["id"]
+    with count_statements(shard_router.engine(user_id)) as statements:
+        quest = client.get(f"/api/users/{user_id}/quests/{quest_id}", headers=headers).json()
+    assert len(statements) == 1
+    assert [s["title"] for s in quest["subquests"]] == ["step 0", "step 1"]
+
+def test_values_outside_the_schemas_checks_are_422(client, signup):
+    user_id, headers = signup()
+    url = f"/api/users/{user_id}/quests"
+    assert client.post(url, headers=headers, json={"title": "x", "type": "weekly"}).status_code == 422
+    assert client.post(url, headers=headers, json={"title": "x", "rank": "Z"}).status_code == 422
+    quest = client.post(url, headers=headers, json={"title": "x", "type": "habit"}).json()
+    assert client.put(f"{url}/{quest['id']}", headers=headers, json={"title": "x", "type": "Habit"}).status_code == 422
+    response = client.post(f"{url}/{quest['id']}/logs", headers=headers, json={"outcome": "skipped"})
+    assert response.status_code == 422
+    assert "CHECK" not in response.text
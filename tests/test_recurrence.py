@@ -0,0 +1,56 @@
+import time
+from datetime import date
+import pytest
+from sqlalchemy import text
+from db import shard_router
+from recurrence import Rule, InvalidRule, parse_rule
+
+@pytest.mark.parametrize("rule", [
+    "FREQ=MONTHLY;INTERVAL=12;BYMONTHDAY=31",
+    "FREQ=MONTHLY;INTERVAL=12;BYMONTHDAY=30",
+    "FREQ=MONTHLY;INTERVAL=24;BYMONTHDAY=29",
+    "DTSTART:20260401\nFREQ=MONTHLY;INTERVAL=12;BYMONTHDAY=31",
+    "FREQ=DAILY;INTERVAL=7;BYDAY=MO",
+    "FREQ=DAILY;INTERVAL=14;BYDAY=MO,TU",
+])
+def test_rules_that_never_occur_are_rejected(rule):
+    with pytest.raises(InvalidRule):
+        parse_rule(rule)
+
+@pytest.mark.parametrize("rule", [
+    "FREQ=MONTHLY;BYMONTHDAY=31",
+    "FREQ=MONTHLY;INTERVAL=2;BYMONTHDAY=31",
+    "FREQ=MONTHLY;INTERVAL=12;BYMONTHDAY=28",
+    "FREQ=MONTHLY;INTERVAL=12;BYMONTHDAY=29",
+    "FREQ=MONTHLY;INTERVAL=12;BYMONTHDAY=-1",
+    "DTSTART:20260101\nFREQ=MONTHLY;INTERVAL=12;BYMONTHDAY=31",
+    "FREQ=DAILY;INTERVAL=3;BYDAY=MO",
+    "FREQ=WEEKLY;INTERVAL=7;BYDAY=MO",
+])
+def test_rules_that_can_occur_are_accepted(rule):
+    assert parse_rule(rule)
+
+@pytest.mark.parametrize("rule, start", [
+    # Built directly, the way a rule stored before the checks existed is expanded
+    (Rule("MONTHLY", interval=12, bymonthday=(31,)), date(2026, 4, 1)),
+    (Rule("DAILY", interval=7, byday=(0,)), date(2026, 4, 1)),
+    (Rule("YEARLY", interval=100), date(2024, 2, 29)),
+    (Rule("DAILY", interval=10 ** 6), date(2026, 4, 1)),
+    (Rule("WEEKLY", interval=10 ** 5), date(2026, 4, 1)),
+])
+def test_generators_stop(rule, start):
+    began = time.perf_counter()
+    days = list(rule.occurrences(start, date(2026, 5, 1)))
+    assert time.perf_counter() - began < 1
+    assert all(day <= date.max for day in days)
+
+def test_stored_bad_rule_does_not_break_the_calendar(client, signup):
+    user_id, headers = signup()
+    with shard_router.engine(user_id).begin() as conn:
+        conn.execute(text("INSERT INTO quests (user_id, title, type, repeats_rule, created_at) "
+                          "VALUES (:user_id, 'bad', 'todo', 'FREQ=MONTHLY;INTERVAL=12;BYMONTHDAY=31', '2026-04-01')"),
+                     {"user_id": user_id})
+    response = client.get(f"/api/users/{user_id}/calendar", headers=headers,
+                          params={"from": "2026-04-01", "to": "2026-12-31"})
+    assert response.status_code == 200
+    assert client.patch(f"/api/users/{user_id}/rollover", headers=headers).status_code == 200
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+from db import shard_router
+import reminders
+from reminders import Reminders, fire_time
+
+TASK = {"title": "Read", "type": "To-Do", "category": "INT", "difficulty": "Easy"}
+
+@pytest.fixture
+def queue(monkeypatch):
+    # A queue of the test's own, with the first load done; the app's thread is off in tests
+    fresh = Reminders(1000)
+    monkeypatch.setattr(reminders, "reminders", fresh)
+    fresh.refill()
+    return fresh
+
+def _fired(queue, user_id, until):
+    # What fires for user_id up to `until`; the queue also holds other tests' tasks
+    return [event for event in queue.fire(queue.pop_due(until)) if event["user_id"] == user_id]
+
+def _in(hours):
+    return (datetime.now() + timedelta(hours=hours)).isoformat(timespec="seconds")
+
+def _put(client, user_id, headers, task_id, **fields):
+    response = client.put(f"/api/users/{user_id}/tasks/{task_id}", headers=headers,
+                          json={"id": task_id, **TASK, **fields})
+    assert response.status_code == 200, response.text
+
+def _create(client, user_id, headers, task_id, due_at):
+    response = client.post(f"/api/users/{user_id}/tasks", headers=headers,
+                           json={"id": task_id, "dueAt": due_at, **TASK})
+    assert response.status_code == 201, response.text
+
+def test_editing_the_due_time_moves_the_reminder(client, signup, queue):
+    user_id, headers = signup()
+    task_id = f"{user_id}-a"
+    first, second = _in(1), _in(2)
+    _create(client, user_id, headers, task_id, first)
+    assert queue._pending[("task", task_id)] == fire_time(first)
+
+    _put(client, user_id, headers, task_id, dueAt=second)
+    assert queue._pending[("task", task_id)] == fire_time(second)
+    assert _fired(queue, user_id, fire_time(first) + 1) == []
+    events = _fired(queue, user_id, fire_time(second))
+    assert [(event["id"], event["due_at"]) for event in events] == [(task_id, second)]
+
+def test_finishing_or_deleting_a_task_cancels_its_reminder(client, signup, queue):
+    user_id, headers = signup()
+    done, deleted = f"{user_id}-done", f"{user_id}-deleted"
+    _create(client, user_id, headers, done, _in(1))
+    _create(client, user_id, headers, deleted, _in(1))
+
+    _put(client, user_id, headers, done, dueAt=_in(1), done=True)
+    assert client.delete(f"/api/users/{user_id}/tasks/{deleted}", headers=headers).status_code == 204
+    assert ("task", done) not in queue._pending
+    assert ("task", deleted) not in queue._pending
+    assert _fired(queue, user_id, fire_time(_in(3))) == []
+
+def test_rolled_back_writes_fire_nothing(client, signup, queue):
+    user_id, headers = signup()
+    task_id = f"{user_id}-a"
+    due_at = _in(1)
+    _create(client, user_id, headers, task_id, due_at)
+
+    # Sync ops the schema refuses are undone in their savepoint, and so are their reminders
+    batch = {"ops": [
+        {"op_id": "1", "type": "task.update", "task_id": task_id,
+         "task": {**TASK, "id": task_id, "type": "bogus", "dueAt": _in(2)}},
+        {"op_id": "2", "type": "task.create", "task": {**TASK, "id": f"{user_id}-b", "type": "bogus", "dueAt": _in(1)}},
+    ]}
+    response = client.post(f"/api/users/{user_id}/sync", headers=headers, json=batch)
+    assert [r["status"] for r in response.json()["results"]] == ["rejected", "rejected"]
+    assert queue._pending[("task", task_id)] == fire_time(due_at)
+    assert ("task", f"{user_id}-b") not in queue._pending
+
+    # A hook that ran for a transaction which then rolled back: the reminder is read back
+    # from the table when it fires, and dropped
+    moved = _in(2)
+    with shard_router.session(user_id) as db:
+        db.execute(text("UPDATE tasks SET due_at = :due_at WHERE id = :id"), {"due_at": moved, "id": task_id})
+        reminders.task_changed(task_id, user_id, moved, False)
+        db.rollback()
+    assert _fired(queue, user_id, fire_time(_in(3))) == []
@@ -0,0 +1,18 @@
+import inspect
+from fastapi.routing import APIRoute
+from db import get_db, get_user_db
+import main
+
+def _dependencies(dependant):
+    for sub in dependant.dependencies:
+        yield sub.call
+        yield from _dependencies(sub)
+
+def test_routes_using_the_database_are_sync():
+    # A DB call can sit in busy_timeout; from an async route that would stall the loop
+    async_db_routes = [
+        route.path for route in main.API.routes
+        if isinstance(route, APIRoute) and inspect.iscoroutinefunction(route.endpoint)
+        and {get_db, get_user_db} & set(_dependencies(route.dependant))
+    ]
+    assert async_db_routes == []
@@ -0,0 +1,34 @@
+from sqlalchemy import select
+from db import shard_router
+from auth import UserItem, UserFullOut
+from tasks import TaskItem, TaskOut
+
+TASK = {"title": "Read", "type": "To-Do", "category": "INT", "difficulty": "Easy"}
+
+def _pydantic(model, obj):
+    # What response_model validation produced before the row-tuple path
+    return model.model_validate(obj).model_dump(mode="json", by_alias=True)
+
+def test_task_list_matches_response_model(client, signup):
+    user_id, headers = signup()
+    client.post(f"/api/users/{user_id}/tasks", headers=headers, json={"id": f"{user_id}-a", **TASK})
+    client.post(f"/api/users/{user_id}/tasks", headers=headers,
+                json={"id": f"{user_id}-b", **TASK, "dueAt": "2026-01-01", "done": True, "pomsEstimate": 3})
+    body = client.get(f"/api/users/{user_id}/tasks", headers=headers).json()
+    with shard_router.session(user_id) as db:
+        expected = [_pydantic(TaskOut, t) for t in db.scalars(select(TaskItem).where(TaskItem.user_id == user_id))]
+    assert sorted(body, key=lambda t: t["id"]) == sorted(expected, key=lambda t: t["id"])
+    assert body[0]["done"] in (True, False)
+
+def test_profile_matches_response_model(client, signup):
+    user_id, headers = signup()
+    body = client.get(f"/api/users/{user_id}", headers=headers).json()
+    with shard_router.session(user_id) as db:
+        assert body == _pydantic(UserFullOut, db.get(UserItem, user_id))
+
+def test_openapi_keeps_response_models(client):
+    paths = client.get("/openapi.json").json()["paths"]
+    tasks = paths["/api/users/{user_id}/tasks"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert tasks["items"]["$ref"].endswith("/TaskOut")
+    profile = paths["/api/users/{user_id}"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert profile["$ref"].endswith("/UserFullOut")
@@ -0,0 +1,23 @@
+import time
+import sessions
+
+def test_tokens_verify_until_tampered_expired_or_revoked():
+    token, expires_at = sessions.issue(5)
+    assert expires_at > time.time()
+    assert sessions.verify(token) == 5
+    kid, user_id, expires, signature = token.split(".")
+    assert sessions.verify(f"{kid}.6.{expires}.{signature}") is None
+    assert sessions.verify(f"{kid}.{user_id}.{int(time.time()) - 1}.{signature}") is None
+    sessions.revoke(token)
+    assert sessions.verify(token) is None
+
+def test_non_ascii_tokens_are_refused_not_crashed(client, signup):
+    user_id, headers = signup()
+    token = headers["Authorization"].split(" ", 1)[1]
+    forged = token[:-1] + "é"
+    assert sessions.verify(forged) is None
+    assert sessions.verify(token.replace(f".{user_id}.", ".².")) is None
+    # Raw latin-1 header bytes, as any client can send
+    response = client.get(f"/api/users/{user_id}/tasks",
+                          headers={"Authorization": f"Bearer {forged}".encode("latin-1")})
+    assert response.status_code == 401
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import subprocess
+import tempfile
+from db import jump_hash
+
+# DB_SHARDS is read at import, so the sharded app runs in a subprocess with its own
+# data directory; the script prints a JSON summary of where everyone's rows are
+_SCRIPT = r"""
+import os, sys, json, sqlite3, importlib
+import _env
+os.environ["QUESTIFY_DATA_DIR"] = sys.argv[1]
+from fastapi.testclient import TestClient
+import main, shards
+from sqlalchemy import text
+from db import get_shard_file, shard_router, engine, DB_SHARDS
+
+if sys.argv[2] == "rebalance":
+    shards.rebalance()
+with TestClient(main.API) as client, TestClient(importlib.import_module("allycia changes.main").app) as calendar:
+    out = {}
+    if sys.argv[2] == "names":
+        # A second s0 from before the directory kept names unique, with its own password
+        legacy = client.post("/api/signup", json={"email": "legacy@example.com", "display_name": "legacy",
+                                                  "password": "other"}).json()["id"]
+        with shard_router.engine(legacy).begin() as conn:
+            conn.execute(text("UPDATE users SET display_name = 's0' WHERE id = :id"), {"id": legacy})
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE user_shards SET display_name = 's0' WHERE user_id = :id"), {"id": legacy})
+        taken = client.post("/api/signup", json={"email": "again@example.com", "display_name": "s1",
+                                                 "password": "password"}).status_code
+        logins = [client.post("/api/login", json={"display_name": "s0", "password": password}).json().get("id")
+                  for password in ("password", "other", "wrong")]
+        print(json.dumps({"legacy": legacy, "taken": taken, "logins": logins}))
+        sys.exit(0)
+    if sys.argv[2] == "signup":
+        for n in range(12):
+            body = client.post("/api/signup", json={"email": f"s{n}@example.com", "display_name": f"s{n}",
+                                                    "password": "password"}).json()
+            headers = {"Authorization": f"Bearer {body['token']}"}
+            client.post(f"/api/users/{body['id']}/tasks", headers=headers,
+                        json={"id": f"t{n}", "title": "t", "type": "To-Do", "category": "INT", "difficulty": "Easy"})
+            client.patch(f"/api/users/{body['id']}/economy", headers=headers, json={"gold_delta": n + 1})
+            client.post(f"/api/users/{body['id']}/quests", headers=headers, json={"title": "stretch", "type": "daily"})
+    login = {}
+    for n in range(12):
+        body = client.post("/api/login", json={"display_name": f"s{n}", "password": "password"}).json()
+        headers = {"Authorization": f"Bearer {body['token']}"}
+        tasks = client.get(f"/api/users/{body['id']}/tasks", headers=headers).json()
+        homes = [i for i in range(DB_SHARDS)
+                 if sqlite3.connect(get_shard_file(i)).execute("SELECT 1 FROM users WHERE id = ?", (body["id"],)).fetchone()]
+        gold = client.get(f"/api/users/{body['id']}", headers=headers).json()["gold"]
+        quest_days = len(calendar.get("/api/calendar/events", headers=headers).json()["local"])
+        out[body["id"]] = {"tasks": [t["id"] for t in tasks], "gold": gold, "quest_days": quest_days, "homes": homes,
+                           "placement": shard_router.placement(body["id"])}
+print(json.dumps(out))
+"""
+
+def _run(data_dir, shards, step):
+    env = {**os.environ, "DB_SHARDS": str(shards), "PYTHONPATH": os.path.dirname(__file__)}
+    result = subprocess.run([sys.executable, "-c", _SCRIPT, data_dir, step], env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.splitlines()[-1])
+
+def test_jump_hash_moves_few_users_when_growing():
+    users = range(1, 10001)
+    moved = sum(jump_hash(u, 4) != jump_hash(u, 5) for u in users)
+    # About 1/5 move, and only onto the new shard
+    assert 1700 < moved < 2300
+    assert all(jump_hash(u, 5) == 4 for u in users if jump_hash(u, 4) != jump_hash(u, 5))
+
+def test_users_live_on_their_shard_and_survive_a_rebalance():
+    data_dir = tempfile.mkdtemp(prefix="questify-shards-")
+    before = _run(data_dir, 3, "signup")
+    assert len(before) == 12
+    assert len({u["placement"] for u in before.values()}) > 1
+    for user_id, user in before.items():
+        assert user["homes"] == [user["placement"]]
+        assert len(user["tasks"]) == 1
+        # The calendar service finds the daily quest on the user's shard: today and 30 more days
+        assert user["quest_days"] == 31
+
+    after = _run(data_dir, 4, "rebalance")
+    # A move carries the balance over, unlike an uploaded import
+    assert {user_id: (user["tasks"], user["gold"], user["quest_days"]) for user_id, user in after.items()} == \
+           {user_id: (user["tasks"], user["gold"], user["quest_days"]) for user_id, user in before.items()}
+    for user in after.values():
+        assert user["homes"] == [user["placement"]]
+
+    # Signup keeps names unique in the directory; a pair from before still logs in by password
+    names = _run(data_dir, 4, "names")
+    assert names["taken"] == 409
+    s0 = int(next(iter(after)))  # users are reported in login order, s0 first
+    assert names["logins"] == [s0, names["legacy"], None]
@@ -0,0 +1,42 @@
+from sqlalchemy import event, text
+from db import engine, shard_router
+import shop
+import profiling
+
+def test_purchase_on_a_catalog_miss_reads_it_elsewhere(client, signup):
+    user_id, headers = signup()
+    client.patch(f"/api/users/{user_id}/economy", json={"gold_delta": 50}, headers=headers)
+    with engine.begin() as conn:
+        item_id = conn.execute(text("INSERT INTO shop_items (kind, name, cost_gold) VALUES ('pet', 'cat', 5) "
+                                    "RETURNING id")).scalar()
+    shop.catalog.invalidate()
+
+    statements = []
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append((conn.connection.dbapi_connection, statement))
+    user_engine = shard_router.engine(user_id)
+    event.listen(user_engine, "before_cursor_execute", before)
+    try:
+        response = client.post(f"/api/users/{user_id}/shop/purchases", json={"item_id": item_id}, headers=headers)
+    finally:
+        event.remove(user_engine, "before_cursor_execute", before)
+    assert response.status_code == 201, response.text
+
+    # The purchase's connection writes first; the catalog came from another one
+    purchase_conn = next(c for c, sql in statements if "UPDATE users SET gold" in sql)
+    first = next(sql for c, sql in statements if c is purchase_conn)
+    assert "UPDATE users SET gold" in first
+    assert item_id in shop.catalog.get().items
+
+def test_upserts_with_bad_meta_json_are_refused(client, monkeypatch):
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "admin")
+    headers = {"X-Admin-Token": "admin"}
+    for meta in ("{not json", "[1, 2]"):
+        response = client.put("/api/admin/shop/items", json={"kind": "pet", "name": "bad", "meta_json": meta},
+                              headers=headers)
+        assert response.status_code == 422, response.text
+    response = client.put("/api/admin/shop/items", json={"kind": "pet", "name": "owl", "meta_json": '{"wings": 2}'},
+                          headers=headers)
+    assert response.status_code == 200, response.text
+    items = client.get("/api/shop/items").json()["items"]
+    assert {"name": "owl", "meta": {"wings": 2}}.items() <= next(i for i in items if i["name"] == "owl").items()
@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+from db import shard_router
+import stats
+
+TASK = {"title": "Read", "type": "To-Do", "category": "INT", "difficulty": "Easy"}
+
+def _stats(client, user_id, headers, bucket):
+    to = date.today()
+    response = client.get(f"/api/users/{user_id}/stats", headers=headers,
+                          params={"from": (to - timedelta(days=40)).isoformat(), "to": to.isoformat(), "bucket": bucket})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_rollups_match_a_rebuild_from_history(client, signup):
+    user_id, headers = signup()
+    assert client.patch(f"/api/users/{user_id}/economy", headers=headers,
+                        json={"xp_delta": 120, "gold_delta": 30, "strength_delta": 2}).status_code == 200
+    # Clamped at zero: the rollup takes what was applied, not what was asked
+    assert client.patch(f"/api/users/{user_id}/economy", headers=headers,
+                        json={"gold_delta": -500, "wisdom_delta": -3}).status_code == 200
+
+    for task_id in (f"{user_id}-a", f"{user_id}-b"):
+        assert client.post(f"/api/users/{user_id}/tasks", headers=headers,
+                           json={"id": task_id, **TASK}).status_code == 201
+        assert client.put(f"/api/users/{user_id}/tasks/{task_id}", headers=headers,
+                          json={"id": task_id, **TASK, "done": True}).status_code == 200
+    # Same-day undo of one completion
+    assert client.put(f"/api/users/{user_id}/tasks/{user_id}-b", headers=headers,
+                      json={"id": f"{user_id}-b", **TASK}).status_code == 200
+
+    quest = client.post(f"/api/users/{user_id}/quests", headers=headers, json={"title": "Run"}).json()
+    for outcome in ("complete", "fail", "negative"):
+        response = client.post(f"/api/users/{user_id}/quests/{quest['id']}/logs", headers=headers,
+                               json={"outcome": outcome})
+        assert response.status_code == 201, response.text
+
+    live = {bucket: _stats(client, user_id, headers, bucket) for bucket in ("day", "week", "month")}
+    totals = live["day"]["totals"]
+    assert (totals["xp"], totals["gold"], totals["tasks_completed"], totals["quests_completed"],
+            totals["quests_failed"]) == (120, 0, 1, 1, 2)
+    assert totals["stats"]["strength"] == 2 and totals["stats"]["wisdom"] == 0
+    assert all(view["totals"] == totals for view in live.values())
+
+    with shard_router.engine(user_id).begin() as conn:
+        stats.rebuild(conn, user_id)
+    assert {bucket: _stats(client, user_id, headers, bucket) for bucket in live} == live
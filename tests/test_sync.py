@@ -0,0 +1,51 @@
+from db import shard_router
+import feed
+
+TASK = {"title": "Read", "category": "INT", "difficulty": "Easy"}
+
+def test_a_failing_op_is_rejected_alone(client, signup):
+    user_id, headers = signup()
+    gold = client.get(f"/api/users/{user_id}", headers=headers).json()["gold"]
+    batch = {"ops": [
+        {"op_id": "1", "type": "task.create", "task": {"id": f"{user_id}-a", "type": "To-Do", **TASK}},
+        # The model's default type "todo" fails the tasks.type CHECK constraint
+        {"op_id": "2", "type": "task.create", "task": {"id": f"{user_id}-b", **TASK}},
+        {"op_id": "3", "type": "economy", "delta": {"gold_delta": 5}},
+        {"op_id": "4", "type": "task.complete", "task_id": "missing"},
+    ]}
+    response = client.post(f"/api/users/{user_id}/sync", headers=headers, json=batch)
+    assert response.status_code == 200, response.text
+    statuses = [r["status"] for r in response.json()["results"]]
+    assert statuses == ["applied", "rejected", "applied", "rejected"]
+    assert "CHECK constraint" in response.json()["results"][1]["detail"]
+    assert [t["id"] for t in client.get(f"/api/users/{user_id}/tasks", headers=headers).json()] == [f"{user_id}-a"]
+    assert response.json()["user"]["gold"] == gold + 5
+
+    # Applied ops are skipped on a retry; rejected ones were forgotten and run again
+    again = client.post(f"/api/users/{user_id}/sync", headers=headers, json=batch).json()
+    assert [r["status"] for r in again["results"]] == ["duplicate", "rejected", "duplicate", "rejected"]
+    assert again["user"]["gold"] == gold + 5
+
+def test_sync_needs_the_users_session(client, signup):
+    user_id, _ = signup()
+    other_id, other_headers = signup()
+    assert client.post(f"/api/users/{user_id}/sync", json={"ops": []}).status_code == 401
+    assert client.post(f"/api/users/{user_id}/sync", headers=other_headers, json={"ops": []}).status_code == 403
+
+def test_rolled_back_savepoint_drops_only_its_feed_entries(signup):
+    user_id, _ = signup()
+    feed.heads.finish_load(user_id, feed.heads.begin_load(user_id), [])
+    db = shard_router.session(user_id)
+    try:
+        feed.stage(db, user_id, feed.narrative_entry(1, "milestone", "kept", "2026-01-01 00:00:00"))
+        try:
+            with db.begin_nested():
+                feed.stage(db, user_id, feed.narrative_entry(2, "milestone", "undone", "2026-01-01 00:00:01"))
+                raise ValueError
+        except ValueError:
+            pass
+        db.commit()
+    finally:
+        db.close()
+    page, _ = feed.heads.first_page(user_id, 10)
+    assert [entry["text"] for entry in page] == ["kept"]
@@ -0,0 +1,107 @@
+import orjson
+from sqlalchemy import text
+from db import shard_router
+import admission
+
+def _export(client, user_id, headers):
+    response = client.get(f"/api/users/{user_id}/export", headers=headers)
+    assert response.status_code == 200, response.text
+    return [orjson.loads(line) for line in response.content.splitlines()]
+
+def _body(lines):
+    return b"\n".join(orjson.dumps(line) for line in lines)
+
+def _tamper(lines):
+    # Give the profile row max gold and level
+    for i, line in enumerate(lines):
+        if isinstance(line, dict) and line.get("section") == "profile":
+            row = dict(zip(line["columns"], lines[i + 1]))
+            row.update(gold=10 ** 9, level=999, user_class="Mage")
+            lines[i + 1] = [row[c] for c in line["columns"]]
+    return lines
+
+def _forge(lines, section, *rows):
+    # Append rows (as dicts) right after a section's header line
+    for i, line in enumerate(lines):
+        if isinstance(line, dict) and line.get("section") == section:
+            lines[i + 1:i + 1] = [[row[c] for c in line["columns"]] for row in rows]
+            return lines
+    raise AssertionError(section)
+
+def _rows(user_id, sql):
+    with shard_router.engine(user_id).connect() as conn:
+        return conn.execute(text(sql), {"id": user_id}).all()
+
+def test_export_and_import_need_the_owners_session(client, signup):
+    alice, alice_headers = signup()
+    bob, bob_headers = signup()
+    assert client.get(f"/api/users/{alice}/export").status_code == 401
+    assert client.get(f"/api/users/{alice}/export", headers=bob_headers).status_code == 403
+    lines = _export(client, alice, alice_headers)
+    assert client.post(f"/api/users/{bob}/import", content=_body(lines)).status_code == 401
+    assert client.post(f"/api/users/{bob}/import", content=_body(lines), headers=alice_headers).status_code == 403
+
+def test_import_ignores_economy_fields(client, signup):
+    alice, alice_headers = signup()
+    client.post(f"/api/users/{alice}/quests", json={"title": "walk"}, headers=alice_headers)
+    lines = _tamper(_export(client, alice, alice_headers))
+    bob, bob_headers = signup()
+    before = client.get(f"/api/users/{bob}", headers=bob_headers).json()
+
+    response = client.post(f"/api/users/{bob}/import", content=_body(lines), headers=bob_headers)
+    assert response.status_code == 201, response.text
+    after = client.get(f"/api/users/{bob}", headers=bob_headers).json()
+    assert (after["gold"], after["level"]) == (before["gold"], before["level"])
+    assert after["user_class"] == "Mage"
+    quests = client.get(f"/api/users/{bob}/quests", headers=bob_headers).json()
+    assert [q["title"] for q in quests] == ["walk"]
+
+def test_upload_is_checked_before_a_write_slot_is_taken(client, signup, monkeypatch):
+    alice, alice_headers = signup()
+    lines = _export(client, alice, alice_headers)
+    bob, bob_headers = signup()
+    # Every write slot taken and no time to wait
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission, "WRITE_WAIT_SECONDS", 0.01)
+    monkeypatch.setattr(admission.write_gate, "active", admission.write_gate.limit)
+
+    response = client.post(f"/api/users/{bob}/import", content=_body(lines) + b"\n{bad", headers=bob_headers)
+    assert response.status_code == 400
+    response = client.post(f"/api/users/{bob}/import", content=_body(lines), headers=bob_headers)
+    assert response.status_code == 429
+    assert response.headers["retry-after"]
+
+def test_import_ignores_forged_progress(client, signup):
+    alice, alice_headers = signup()
+    client.patch(f"/api/users/{alice}/economy", json={"gold_delta": 7}, headers=alice_headers)
+    lines = _export(client, alice, alice_headers)
+    _forge(lines, "daily_checkins", {"current_run": 999, "last_day": "2026-01-01"})
+    _forge(lines, "user_counters", {"metric": "tasks_completed", "value": 10 ** 6})
+    _forge(lines, "user_daily_stats", {"day": "2026-01-01", "xp": 0, "gold": 10 ** 9, "diamonds": 0,
+                                       "strength": 0, "dexterity": 0, "intelligence": 0, "wisdom": 0,
+                                       "charisma": 0, "tasks_completed": 0, "quests_completed": 0,
+                                       "quests_failed": 0})
+    bob, bob_headers = signup()
+
+    response = client.post(f"/api/users/{bob}/import", content=_body(lines), headers=bob_headers)
+    assert response.status_code == 201, response.text
+    assert _rows(bob, "SELECT * FROM daily_checkins WHERE user_id = :id") == []
+    assert _rows(bob, "SELECT * FROM user_counters WHERE user_id = :id") == []
+    # The rollups come from the imported ledger, not the file's rollup rows
+    assert _rows(bob, "SELECT SUM(gold) FROM user_daily_stats WHERE user_id = :id") == [(7,)]
+
+def test_import_renames_task_ids_another_account_holds(client, signup):
+    alice, alice_headers = signup()
+    task = {"id": f"{alice}-restore", "title": "read", "type": "To-Do", "category": "INT", "difficulty": "Easy"}
+    assert client.post(f"/api/users/{alice}/tasks", json=task, headers=alice_headers).status_code == 201
+    client.put(f"/api/users/{alice}/tasks/{task['id']}", json={**task, "done": True}, headers=alice_headers)
+    lines = _export(client, alice, alice_headers)
+    bob, bob_headers = signup()
+
+    response = client.post(f"/api/users/{bob}/import", content=_body(lines), headers=bob_headers)
+    assert response.status_code == 201, response.text
+    bob_tasks = client.get(f"/api/users/{bob}/tasks", headers=bob_headers).json()
+    assert [(t["title"], t["done"]) for t in bob_tasks] == [("read", True)]
+    assert bob_tasks[0]["id"] != task["id"]
+    assert [t["id"] for t in client.get(f"/api/users/{alice}/tasks", headers=alice_headers).json()] == [task["id"]]
+    assert _rows(bob, "SELECT task_id FROM task_logs WHERE user_id = :id") == [(bob_tasks[0]["id"],)]